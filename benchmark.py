@@ -0,0 +1,41 @@
+import argparse
+import sys
+
+from modules.SSVF import SSVF
+from modules.ClusteringSSVF import ClusteringSSVF
+from modules.Benchmark import Benchmark
+
+# Latency benchmark of SSVF and C-SSVF: the results are written in a JSON file and, if a baseline
+# is given, compared against it; the exit code is 1 if a regression is found
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description="Latency benchmark of SSVF and C-SSVF")
+    parser.add_argument("--output",default="benchmark.json",help="JSON file of the results")
+    parser.add_argument("--baseline",default=None,help="JSON file of the baseline results")
+    parser.add_argument("--tolerance",type=float,default=0.2,help="maximum relative slowdown wrt the baseline")
+    parser.add_argument("--statistic",default="p50",help="statistic of the latencies compared with the baseline")
+    parser.add_argument("--jets",type=int,default=20,help="number of jets per multiplicity")
+    parser.add_argument("--repeats",type=int,default=5,help="number of timed reconstructions of each jet")
+    args = parser.parse_args()
+
+    benchmark = Benchmark({"SSVF": SSVF(), "C-SSVF": ClusteringSSVF()},nJets=args.jets,repeats=args.repeats)
+    results = benchmark.run()
+    Benchmark.save(results,args.output)
+
+    print("%-8s %-10s %-7s %12s %12s %12s %10s" % ("algo","tracks","stage","p50 [ms]","p90 [ms]","p99 [ms]","efficiency"))
+    for measurement in results["measurements"]:
+        multiplicity = "%d/%d/%d" % (measurement["nTracksPV"],measurement["nTracksSV"],measurement["nTracksPileup"])
+        for stage in Benchmark.stages:
+            print("%-8s %-10s %-7s %12.3f %12.3f %12.3f %10.2f" % (measurement["algorithm"],multiplicity,stage,
+                  1e3*measurement[stage]["p50"],1e3*measurement[stage]["p90"],1e3*measurement[stage]["p99"],
+                  measurement["efficiency"]))
+    print("Results written in",args.output)
+
+    if args.baseline is not None:
+        regressions = Benchmark.compare(results,Benchmark.load(args.baseline),args.tolerance,args.statistic)
+        for r in regressions:
+            print("REGRESSION: %s %d/%d/%d %s %s %.3f ms -> %.3f ms (x%.2f)" % (r["algorithm"],r["nTracksPV"],
+                  r["nTracksSV"],r["nTracksPileup"],r["stage"],args.statistic,1e3*r["baseline"],1e3*r["current"],r["ratio"]))
+        if len(regressions) > 0:
+            sys.exit(1)
+        print("No regressions wrt",args.baseline)
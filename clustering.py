@@ -1,5 +1,4 @@
 from modules.JetGenerator import JetGenerator
-from modules.SSVF import SSVF
 from matplotlib import pyplot as plt
 import numpy as np
 from sklearn.cluster import KMeans as KM
@@ -11,18 +10,8 @@ if __name__=="__main__":
     #generator = JetGenerator(1,nTracksPV=10,nTracksSV=15,nTracksPileup=10)
     jet = generator.generate()
     jet = jet[0]
-    jetForClustering = []
-    for t in jet.tracksPV:
-        track = [np.abs(t.IP),t.versor[2]]
-        jetForClustering.append(track)
-    for t in jet.tracksSV:
-        track = [np.abs(t.IP),t.versor[2]]
-        jetForClustering.append(track)
-    for t in jet.tracksPileup:
-        track = [np.abs(t.IP),t.versor[2]]
-        jetForClustering.append(track)
-    
-    jetForClustering = np.asarray(jetForClustering)
+    tracks = jet.collection()
+    jetForClustering = np.column_stack((np.abs(tracks.impactParameters()),tracks.versors[:,2]))
     k = 3
     km = KM(k,max_iter=1000)
     km.fit(jetForClustering)
@@ -41,24 +30,9 @@ if __name__=="__main__":
     ax[1].set_ylabel("$\cos(\eta)$")
 
     ax[0].set_title("MC truth")
-    jetForClustering = []
-    for t in jet.tracksPV:
-        track = [np.abs(t.IP),t.versor[2]]
-        jetForClustering.append(track)
-    jetForClustering = np.array(jetForClustering)
-    ax[0].scatter(jetForClustering[:,0],jetForClustering[:,1],label="PV")
-    jetForClustering = []
-    for t in jet.tracksSV:
-        track = [np.abs(t.IP),t.versor[2]]
-        jetForClustering.append(track)
-    jetForClustering = np.array(jetForClustering)
-    ax[0].scatter(jetForClustering[:,0],jetForClustering[:,1],label="SV")
-    jetForClustering = []
-    for t in jet.tracksPileup:
-        track = [np.abs(t.IP),t.versor[2]]
-        jetForClustering.append(track)
-    jetForClustering = np.array(jetForClustering)
-    ax[0].scatter(jetForClustering[:,0],jetForClustering[:,1],label="Pileup")
+    for category,label in ((jet.categoryPV,"PV"),(jet.categorySV,"SV"),(jet.categoryPileup,"Pileup")):
+        tracks = jet.collection(category)
+        ax[0].scatter(np.abs(tracks.impactParameters()),tracks.versors[:,2],label=label)
     
     ax[0].set_xlabel("IP [mm]")
     ax[0].set_ylabel("$\cos(\eta)$")
@@ -109,7 +83,7 @@ if __name__=="__main__":
             ax.plot(points[:,0],points[:,1],points[:,2],color='black')
     
     # Draw B-meson flight
-    ax.plot(np.row_stack((jet.PV,jet.SV))[:,0],np.row_stack((jet.PV,jet.SV))[:,1],np.row_stack((jet.PV,jet.SV))[:,2],color="gray",linestyle="dashed",label="B meson")
+    ax.plot(np.vstack((jet.PV,jet.SV))[:,0],np.vstack((jet.PV,jet.SV))[:,1],np.vstack((jet.PV,jet.SV))[:,2],color="gray",linestyle="dashed",label="B meson")
     
     # If enabled, draw jet's cone
     if True:
@@ -172,7 +146,7 @@ if __name__=="__main__":
             ax.plot(points[:,0],points[:,1],points[:,2],color=colors[couples[i+delta]])
     
     # Draw B-meson flight
-    ax.plot(np.row_stack((jet.PV,jet.SV))[:,0],np.row_stack((jet.PV,jet.SV))[:,1],np.row_stack((jet.PV,jet.SV))[:,2],color="gray",linestyle="dashed",label="B meson")
+    ax.plot(np.vstack((jet.PV,jet.SV))[:,0],np.vstack((jet.PV,jet.SV))[:,1],np.vstack((jet.PV,jet.SV))[:,2],color="gray",linestyle="dashed",label="B meson")
     
     # If enabled, draw jet's cone
     if True:
@@ -1,25 +1,29 @@
+import argparse
 from modules.JetGenerator import JetGenerator
 from modules.SSVF import SSVF
+from modules.ResultCache import ResultCache
 from matplotlib import pyplot as plt
 import numpy as np
 
 if __name__=="__main__":
-    
-    generator = JetGenerator(100)
-    jets = generator.generate()
 
-    ssvf = SSVF()
-    distances = []
+    parser = argparse.ArgumentParser(description="SSVF errors' histogram on 100 jets")
+    parser.add_argument("--seed",type=int,default=None,help="seed of the jets' generator (default: random sample)")
+    parser.add_argument("--cache",action="store_true",help="read/store the results in the result cache (.ssvfcache)")
+    args = parser.parse_args()
+
+    generator = JetGenerator(100,seed=args.seed)
+    batch = generator.generateBatch()
 
-    for i,jet in enumerate(jets):
-        if i%10==0:
-            print("Working... ", i/len(jets), "...")
-        couples = ssvf.vertexFinder(jet)
-        fittedVertex,_ = ssvf.vertexFitter(couples)
-        if np.any(fittedVertex)==None:
-            continue
-        distances.append(np.linalg.norm(fittedVertex-jet.SV))
-    distances = np.array(distances)
+    ssvf = SSVF()
+    # Reconstruction of all of the jets at once
+    if args.cache:
+        cache = ResultCache()
+        fittedVertices, valid = cache.reconstructBatch(ssvf,batch)
+        print("Result cache:",cache.stats())
+    else:
+        fittedVertices, valid = ssvf.reconstructBatch(batch)
+    distances = np.linalg.norm(fittedVertices[valid]-batch.SV[valid],axis=1)
     fig,(a0,a1) = plt.subplots(2,1,gridspec_kw={'height_ratios': [4, 1]},figsize=(7,6))
     titleStr = "SSVF test on 100 jets" 
     plt.suptitle(titleStr)
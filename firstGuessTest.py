@@ -0,0 +1,51 @@
+from modules.JetGenerator import JetGenerator
+from modules.SSVF import SSVF
+from modules.TrackCollection import TrackCollection
+import numpy as np
+
+if __name__=="__main__":
+
+    generator = JetGenerator(100,seed=1)
+    jets = generator.generate()
+
+    # Fixed first guess, restarting from it after each rejection (original fitter)
+    fixed = SSVF(firstGuess="fixed")
+    # Least squares first guess of the remaining tracks after each rejection (default)
+    analytic = SSVF()
+    fitters = {"fixed":fixed,"analytic":analytic}
+    # Tolerance on the distance between the fitted vertices [mm]
+    tolerance = 1e-5
+
+    iterations = {"fixed":0,"analytic":0}
+    evaluations = {"fixed":0,"analytic":0}
+    differences = []
+    for i,jet in enumerate(jets):
+        if i%10==0:
+            print("Working... ", i/len(jets), "...")
+        couples = fixed.vertexFinder(jet)
+        vertices, selected = {}, {}
+        for name,ssvf in fitters.items():
+            vertices[name],selected[name] = ssvf.vertexFitter(couples)
+            iterations[name] += ssvf.fitStats["iterations"]
+            evaluations[name] += ssvf.fitStats["evaluations"]
+        # Same selected tracks
+        assert (selected["fixed"] is None) == (selected["analytic"] is None), "Different fit validity in jet %d" % i
+        if selected["fixed"] is None:
+            continue
+        assert len(selected["fixed"]) == len(selected["analytic"]) and \
+            all(t1 is t2 for t1,t2 in zip(selected["fixed"],selected["analytic"])), "Different selected tracks in jet %d" % i
+        difference = np.linalg.norm(vertices["fixed"]-vertices["analytic"])
+        differences.append(difference)
+        # Same vertex; with two tracks the chi2 (sum of the distances) is minimum on the whole common
+        # perpendicular of the tracks, whose length is the chi2: the vertices can be anywhere on it
+        chi2 = np.sum(TrackCollection.fromTracks(selected["fixed"]).pointDistances(vertices["fixed"]))
+        allowed = tolerance + (chi2 if len(selected["fixed"]) == 2 else 0.)
+        assert difference <= allowed, "Different vertices in jet %d: %g mm" % (i,difference)
+
+    print("Optimizer iterations: fixed =",iterations["fixed"],", analytic =",iterations["analytic"],
+          ", saved =",iterations["fixed"]-iterations["analytic"])
+    print("Chi2 evaluations: fixed =",evaluations["fixed"],", analytic =",evaluations["analytic"],
+          ", saved =",evaluations["fixed"]-evaluations["analytic"])
+    print("Max distance between the fitted vertices:",np.max(differences),"mm")
+    assert evaluations["analytic"] <= evaluations["fixed"], "The analytic first guess needs more chi2 evaluations"
+    print("Same selected tracks and vertices, with less chi2 evaluations.")
@@ -0,0 +1,35 @@
+from modules.JetGenerator import JetGenerator
+from modules.TrackCollection import TrackCollection
+from scipy.optimize import approx_fprime
+import numpy as np
+
+# Check of the analytic chi2 gradient and hessian against finite differences
+if __name__=="__main__":
+
+    generator = JetGenerator(20,seed=1)
+    jets = generator.generate()
+    rng = np.random.default_rng(1)
+    epsilon = 1e-7
+
+    maxErrorGradient = 0.
+    maxErrorHessian = 0.
+    for jet in jets:
+        tracks = TrackCollection.fromJet(jet)
+        chi2 = lambda vertex: np.sum(tracks.pointDistances(vertex))
+        # Random points around the SV, away from the tracks
+        for vertex in jet.SV + rng.normal(0,0.1,(5,3)):
+            gradient = tracks.sumDistancesGradient(vertex)
+            numericGradient = approx_fprime(vertex,chi2,epsilon)
+            error = np.max(np.abs(gradient-numericGradient))/np.max(np.abs(numericGradient))
+            maxErrorGradient = max(maxErrorGradient,error)
+
+            hessian = tracks.sumDistancesHessian(vertex)
+            numericHessian = np.array([approx_fprime(vertex,lambda v: tracks.sumDistancesGradient(v)[i],epsilon) for i in range(3)])
+            error = np.max(np.abs(hessian-numericHessian))/np.max(np.abs(numericHessian))
+            maxErrorHessian = max(maxErrorHessian,error)
+
+    print("Max relative error of the gradient:",maxErrorGradient)
+    print("Max relative error of the hessian:",maxErrorHessian)
+    assert maxErrorGradient < 1e-4, "Analytic gradient does not match finite differences"
+    assert maxErrorHessian < 1e-4, "Analytic hessian does not match finite differences"
+    print("Analytic derivatives match finite differences.")
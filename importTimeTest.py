@@ -0,0 +1,42 @@
+import argparse
+import subprocess
+import sys
+
+# Modules whose import must stay cheap: the batch workers import them without drawing anything
+coreModules = ["modules.Track","modules.Jet","modules.JetGenerator","modules.SSVF"]
+# Modules that must be imported only when needed
+heavyModules = ["matplotlib","plotly","sklearn","scipy"]
+
+def importTime(statement, repeats):
+    '''
+    Measures the time of an import statement in fresh interpreters.
+    Parameters:
+    @statement: the import statement;
+    @repeats: number of interpreters, the minimum time is returned;
+    Returns:
+    @seconds: import time [s];
+    @loaded: list of the heavy modules loaded by the statement;
+    '''
+    code = ("import sys, time\nstart = time.perf_counter()\n" + statement +
+            "\nprint(time.perf_counter()-start)\nprint(' '.join(m for m in " + repr(heavyModules) + " if m in sys.modules))")
+    times = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable,"-c",code],capture_output=True,text=True,check=True).stdout.split("\n")
+        times.append(float(output[0]))
+    return min(times), output[1].split()
+
+# Import time budget of the core modules, on top of numpy's import time
+if __name__=="__main__":
+
+    parser = argparse.ArgumentParser(description="Import time budget of the core modules")
+    parser.add_argument("--budget",type=float,default=0.15,help="maximum import time on top of numpy [s]")
+    parser.add_argument("--repeats",type=int,default=5,help="number of fresh interpreters per module")
+    args = parser.parse_args()
+
+    numpyTime, _ = importTime("import numpy",args.repeats)
+    print("%-22s %8.1f ms" % ("numpy",1e3*numpyTime))
+    for module in coreModules:
+        seconds, loaded = importTime("import " + module,args.repeats)
+        print("%-22s %8.1f ms (+%.1f ms), heavy modules: %s" % (module,1e3*seconds,1e3*(seconds-numpyTime),loaded))
+        assert len(loaded) == 0, module + " imports " + str(loaded)
+        assert seconds-numpyTime < args.budget, module + " is out of the import time budget"
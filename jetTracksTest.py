@@ -0,0 +1,43 @@
+from modules.JetGenerator import JetGenerator
+from modules.Jet import Jet
+from modules.SSVF import SSVF
+
+def jetTracks(jet):
+    '''
+    Returns the identities of the Track instances of the jet's truth lists.
+    Parameters:
+    @jet: instance of Jet;
+    Returns:
+    @ids: set of the ids of the jet's tracks;
+    '''
+    return {id(t) for t in jet.tracksPV + jet.tracksSV + jet.tracksPileup}
+
+# Check that the tracks returned by the vertex finder and fitter are the Track instances of the jet's lists,
+# so that they can be compared with the truth lists (e.g. "track in jet.tracksSV")
+if __name__=="__main__":
+
+    generator = JetGenerator(20,seed=1)
+    columnarJets = generator.generate()
+    # The same events stored as lists of Track instances
+    listJets = [Jet(jet.PV,jet.SV,list(jet.tracksPV),list(jet.tracksSV),list(jet.tracksPileup)) for jet in columnarJets]
+
+    for name, jets in (("columnar",columnarJets),("list",listJets)):
+        for finder in SSVF.finders:
+            for fitter in SSVF.fitters:
+                ssvf = SSVF(finder=finder,fitter=fitter)
+                nCoupled, nSelected = 0, 0
+                for jet in jets:
+                    ids = jetTracks(jet)
+                    couples = ssvf.vertexFinder(jet)
+                    assert all(id(t) in ids for couple in couples for t in couple), \
+                        "%s jets, %s finder: coupled tracks are not tracks of the jet" % (name,finder)
+                    nCoupled += sum(len(couple) for couple in couples)
+                    vertex, selected = ssvf.vertexFitter(couples)
+                    if selected is None:
+                        continue
+                    assert all(id(t) in ids for t in selected), \
+                        "%s jets, %s fitter: fitted tracks are not tracks of the jet" % (name,fitter)
+                    nSelected += len(selected)
+                print("%-8s jets, %-10s finder, %-11s fitter: %d coupled and %d fitted tracks of the jets"
+                      % (name,finder,fitter,nCoupled,nSelected))
+    print("OK")
@@ -0,0 +1,71 @@
+from modules.JetGenerator import JetGenerator
+from modules.ClusteringSSVF import ClusteringSSVF
+from modules.KMeans import KMeans
+from sklearn.cluster import KMeans as KM
+import numpy as np
+import time
+
+def samePartition(labels1, labels2):
+    '''
+    Checks whether two clusterings are the same up to a permutation of the labels.
+    '''
+    pairs = set(zip(labels1,labels2))
+    return len(pairs) == len(set(labels1)) == len(set(labels2))
+
+# Comparison of the numpy KMeans backend with sklearn on the jets' features
+if __name__=="__main__":
+
+    generator = JetGenerator(500,seed=1)
+    jets = generator.generate()
+    features = [ClusteringSSVF().features(jet) for jet in jets]
+    k = 3
+
+    # Same initial centroids: Lloyd's iterations must give the same clusters (the initial centroids
+    # are distinct points, otherwise the clusters depend on how the ties are broken)
+    km = KMeans(k,seed=1)
+    same = []
+    for X in features:
+        distinct = np.unique(X.round(6),axis=0)
+        initial = distinct[np.random.default_rng(len(same)).choice(len(distinct),k,replace=False)]
+        km.fit(X,initial)
+        reference = KM(k,init=initial,n_init=1,algorithm="lloyd").fit(X)
+        same.append(samePartition(km.labels_,reference.labels_))
+    print("Same clusters as sklearn from the same initial centroids: %.3f" % np.mean(same))
+    assert np.all(same), "The numpy KMeans does not agree with sklearn"
+
+    # Batched clustering of all of the jets: same clusters as the per-jet fits from the same initial centroids
+    batch = generator.generateBatch()
+    batchFeatures, mask = ClusteringSSVF().featuresBatch(batch)
+    initial = batchFeatures[:,:k]
+    start = time.perf_counter()
+    labels, _, nIter = KMeans(k).fitBatch(batchFeatures,mask,initial)
+    elapsed = time.perf_counter()-start
+    same = [np.array_equal(KMeans(k).fit(batchFeatures[b,mask[b]],initial[b]).labels_,labels[b,mask[b]])
+            for b in range(len(batch))]
+    print("Batched KMeans: %.3f ms/event, %.2f iterations/event, same clusters as the per-jet fits: %.3f"
+          % (1e3*elapsed/len(batch),np.mean(nIter),np.mean(same)))
+    assert np.all(same), "The batched KMeans does not agree with the per-jet one"
+
+    # Timing and iterations, different initializations: the clusters can differ in the events with
+    # more local minima, as between two sklearn runs with different random states
+    backends = {"sklearn": lambda: KM(k,max_iter=300,random_state=0),
+                "sklearn (other seed)": lambda: KM(k,max_iter=300,random_state=1),
+                "numpy": lambda: KMeans(k,seed=1),
+                "numpy previous": lambda: KMeans(k,warmStart="previous",seed=1),
+                "numpy average": lambda: KMeans(k,warmStart="average",seed=1)}
+    labels = {}
+    for name, backend in backends.items():
+        # the numpy backends keep the same instance between the events
+        km = backend()
+        labels[name], iterations = [], []
+        start = time.perf_counter()
+        for X in features:
+            if name.startswith("sklearn"):
+                km = backend()
+            km.fit(X)
+            labels[name].append(km.labels_)
+            iterations.append(km.n_iter_)
+        elapsed = time.perf_counter()-start
+        same = np.mean([samePartition(l1,l2) for l1,l2 in zip(labels[name],labels["sklearn"])])
+        print("%-20s %8.3f ms/event, %5.2f iterations/event, same clusters as sklearn: %.3f"
+              % (name,1e3*elapsed/len(jets),np.mean(iterations),same))
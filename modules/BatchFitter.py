@@ -0,0 +1,210 @@
+import numpy as np
+
+class BatchFitter:
+    '''
+    Class that implements the vertex fit of many independent sets of tracks at once: it is the batched
+    counterpart of IncrementalFitter, with the sets stored in padded arrays of shape (nSets,maxTracks,...).
+    Each row b minimizes the sum of the distances of its active tracks from the vertex with over-relaxed
+    IRLS iterations, solving the 3x3 systems of all of the rows together; removing a track downdates
+    the weighted sums of its row in O(1).
+    Public Members:
+    @self.origins: np.array of shape (nSets,maxTracks,3), tracks' origins;
+    @self.versors: np.array of shape (nSets,maxTracks,3), tracks' versors;
+    @self.active: np.array of shape (nSets,maxTracks) of bool, the tracks that are fitted;
+    @self.vertices: np.array of shape (nSets,3), the current fitted vertices;
+    @self.nIterations: np.array of shape (nSets,), number of IRLS iterations of each row;
+    @self.xtol: tolerance on the vertex displacement [mm] under which the IRLS iterations stop;
+    @self.maxIter: maximum number of IRLS iterations per fit;
+    @self.ftol: tolerance on the chi2 decrease [mm] under which the IRLS iterations stop;
+    @self.minDistance: lower bound on the distances used in the weights [mm];
+    @self.relaxation: over-relaxation factor of the IRLS steps;
+
+    Public Methods:
+    @closestPoints(guess): returns np.array of shape (nSets,3), the least squares closest points to the
+        active tracks of each row;
+    @fit(x0,rows): returns np.array of shape (nSets,3), fits the vertices of the selected rows;
+    @remove(rows,indices): returns np.array of shape (nSets,3), removes one track from each selected row
+        and refits their vertices;
+    @chi2s(): returns np.array of shape (nSets,maxTracks), the distances of the active tracks from
+        the vertices (0 for the inactive ones);
+
+    Private Methods:
+    @__distances(rows,vertices): returns the distances of the tracks of the rows from the vertices, and the chi2;
+    @__reweight(rows,distances): evaluates the weights and the weighted sums of the rows;
+    @__solve(S,s): returns the solutions of a stack of 3x3 systems;
+    @__iterate(rows): IRLS iterations on the selected rows;
+    '''
+
+    # lower bound on the distances used in the weights [mm]
+    minDistance = 1e-9
+    # over-relaxation factor of the IRLS steps
+    relaxation = 1.9
+
+    # Constructor
+    def __init__(self, origins, versors, mask, xtol = 1e-9, maxIter = 200, ftol = 0.):
+        '''
+        Constructor of the class.
+        Parameters:
+        @origins: np.array of shape (nSets,maxTracks,3), tracks' origins;
+        @versors: np.array of shape (nSets,maxTracks,3), tracks' versors;
+        @mask: np.array of shape (nSets,maxTracks) of bool, the tracks to be fitted;
+        @xtol: tolerance on the vertex displacement [mm] under which the IRLS iterations stop;
+        @maxIter: maximum number of IRLS iterations per fit;
+        @ftol: tolerance on the chi2 decrease [mm] under which the IRLS iterations stop;
+        '''
+        self.origins = np.asarray(origins,dtype=float)
+        self.versors = np.asarray(versors,dtype=float)
+        self.active = np.array(mask,dtype=bool)
+        self.xtol = xtol
+        self.maxIter = maxIter
+        self.ftol = ftol
+        nSets = self.active.shape[0]
+        self.vertices = np.zeros((nSets,3))
+        self.nIterations = np.zeros(nSets,dtype=int)
+        # Per-track projected origins A_i o_i, with A_i = I - v_i v_i^T
+        self.__projectedOrigins = self.origins - self.versors*np.einsum('bij,bij->bi',self.origins,self.versors)[...,None]
+        self.__weights = np.zeros(self.active.shape)
+        self.__S = np.zeros((nSets,3,3))
+        self.__s = np.zeros((nSets,3))
+
+    def __distances(self,rows,vertices):
+        '''
+        Evaluates the distances of the tracks of the selected rows from the rows' vertices.
+        Parameters:
+        @rows: np.array of shape (nRows,), indices of the rows;
+        @vertices: np.array of shape (nRows,3), the vertices of the rows;
+        Returns:
+        @distances: np.array of shape (nRows,maxTracks);
+        @chi2: np.array of shape (nRows,), the sums of the distances of the active tracks;
+        '''
+        DP = vertices[:,None,:] - self.origins[rows]
+        versors = self.versors[rows]
+        R = DP - versors*np.einsum('bij,bij->bi',DP,versors)[...,None]
+        distances = np.sqrt(np.einsum('bij,bij->bi',R,R))
+        return distances, np.sum(np.where(self.active[rows],distances,0.),axis=1)
+
+    def __reweight(self,rows,distances):
+        '''
+        Evaluates the weights w_i = 1/d_i of the active tracks of the selected rows, and the weighted sums.
+        Parameters:
+        @rows: np.array of shape (nRows,), indices of the rows;
+        @distances: np.array of shape (nRows,maxTracks), the distances from the rows' current vertices;
+        '''
+        weights = np.where(self.active[rows],1./np.maximum(distances,self.minDistance),0.)
+        versors = self.versors[rows]
+        self.__weights[rows] = weights
+        self.__S[rows] = np.sum(weights,axis=1)[:,None,None]*np.eye(3) - np.einsum('bi,bij,bik->bjk',weights,versors,versors)
+        self.__s[rows] = np.einsum('bi,bij->bj',weights,self.__projectedOrigins[rows])
+
+    def __solve(self,S,s):
+        '''
+        Solves a stack of 3x3 linear systems, with the pseudo-inverse if any of them is singular.
+        Parameters:
+        @S: np.array of shape (nRows,3,3);
+        @s: np.array of shape (nRows,3);
+        Returns:
+        @x: np.array of shape (nRows,3);
+        '''
+        try:
+            return np.linalg.solve(S,s[...,None])[...,0]
+        except np.linalg.LinAlgError:
+            return np.einsum('bjk,bk->bj',np.linalg.pinv(S),s)
+
+    def __iterate(self,rows):
+        '''
+        IRLS iterations on the selected rows, until the vertex displacement of each row is below xtol
+        or its chi2 decrease is below ftol.
+        Parameters:
+        @rows: np.array of shape (nRows,), indices of the rows;
+        '''
+        distances, chi2 = self.__distances(rows,self.vertices[rows])
+        for _ in range(self.maxIter):
+            if len(rows)==0:
+                break
+            self.__reweight(rows,distances)
+            vertices = self.__solve(self.__S[rows],self.__s[rows])
+            # Over-relaxed step, taken only if better than the plain step (that never increases the chi2)
+            relaxed = self.vertices[rows] + self.relaxation*(vertices-self.vertices[rows])
+            relaxedDistances, relaxedChi2 = self.__distances(rows,relaxed)
+            previousChi2 = chi2
+            distances, chi2 = self.__distances(rows,vertices)
+            accept = relaxedChi2<chi2
+            vertices[accept] = relaxed[accept]
+            distances[accept], chi2[accept] = relaxedDistances[accept], relaxedChi2[accept]
+            self.nIterations[rows] += 1
+            step = np.linalg.norm(vertices-self.vertices[rows],axis=1)
+            self.vertices[rows] = vertices
+            # Keep iterating on the rows that have not converged
+            keep = (step>=self.xtol) & (previousChi2-chi2>=self.ftol)
+            rows, distances, chi2 = rows[keep], distances[keep], chi2[keep]
+
+    def closestPoints(self,guess):
+        '''
+        Evaluates, for each row, the point that minimizes the sum of the squared distances from the
+        active tracks; rows with less than two active tracks or parallel tracks get the guess.
+        Parameters:
+        @guess: np.array or list of shape (3,), fallback point;
+        Returns:
+        @points: np.array of shape (nSets,3);
+        '''
+        points = np.tile(np.asarray(guess,dtype=float),(self.active.shape[0],1))
+        weights = self.active.astype(float)
+        S = np.sum(weights,axis=1)[:,None,None]*np.eye(3) - np.einsum('bi,bij,bik->bjk',weights,self.versors,self.versors)
+        s = np.einsum('bi,bij->bj',weights,self.__projectedOrigins)
+        # Well defined systems only
+        rows = (np.sum(self.active,axis=1)>=2) & (np.abs(np.linalg.det(S))>1e-12)
+        if np.any(rows):
+            points[rows] = self.__solve(S[rows],s[rows])
+        return points
+
+    def fit(self,x0,rows=None):
+        '''
+        Fits the vertices of the selected rows on their active tracks.
+        Parameters:
+        @x0: np.array of shape (nSets,3), first guesses on the vertices;
+        @rows: np.array of shape (nSets,) of bool or indices, the rows to be fitted (default: all of them);
+        Returns:
+        @vertices: np.array of shape (nSets,3), the fitted vertices;
+        '''
+        rows = np.arange(self.active.shape[0]) if rows is None else np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        self.vertices[rows] = np.asarray(x0,dtype=float)[rows]
+        # Rows without tracks keep the first guess
+        rows = rows[np.any(self.active[rows],axis=1)]
+        self.__iterate(rows)
+        return self.vertices
+
+    def remove(self,rows,indices):
+        '''
+        Removes one track from each selected row, downdating the row's weighted sums, and refits the
+        vertices of the rows starting from the solutions of the downdated systems.
+        Parameters:
+        @rows: np.array of shape (nRows,), indices of the rows;
+        @indices: np.array of shape (nRows,), index of the track to be removed in each row;
+        Returns:
+        @vertices: np.array of shape (nSets,3), the fitted vertices;
+        '''
+        rows, indices = np.asarray(rows,dtype=int), np.asarray(indices,dtype=int)
+        self.active[rows,indices] = False
+        # O(1) downdate of the weighted sums
+        weights = self.__weights[rows,indices]
+        versors = self.versors[rows,indices]
+        self.__S[rows] -= weights[:,None,None]*(np.eye(3) - versors[:,:,None]*versors[:,None,:])
+        self.__s[rows] -= weights[:,None]*self.__projectedOrigins[rows,indices]
+        self.__weights[rows,indices] = 0.
+        rows = rows[np.any(self.active[rows],axis=1)]
+        if len(rows)>0:
+            self.vertices[rows] = self.__solve(self.__S[rows],self.__s[rows])
+            self.__iterate(rows)
+        return self.vertices
+
+    def chi2s(self):
+        '''
+        Evaluates the distances of the active tracks from the current vertices.
+        Returns:
+        @chi2: np.array of shape (nSets,maxTracks), 0 for the inactive tracks;
+        '''
+        rows = np.arange(self.active.shape[0])
+        distances, _ = self.__distances(rows,self.vertices)
+        return np.where(self.active,distances,0.)
@@ -0,0 +1,200 @@
+import numpy as np
+import json
+import platform
+import time
+import scipy
+from datetime import datetime, timezone
+from modules.JetGenerator import JetGenerator
+from modules.ClusteringSSVF import ClusteringSSVF
+
+class Benchmark:
+    '''
+    Class that measures the per-event latency of the vertex finding, of the vertex fitting and of the
+    whole reconstruction of SSVF and C-SSVF, scanning the tracks' multiplicities of the jets.
+    For each algorithm and multiplicity the same jets (fixed seed) are reconstructed: the first warmup
+    jets are reconstructed without timing, then each jet is timed repeats times with time.perf_counter.
+    The results are a JSON serializable dict, that can be saved and compared against a stored baseline.
+    Public Members:
+    @self.algorithms: dict of the algorithms to benchmark (SSVF or ClusteringSSVF instances), by name;
+    @self.multiplicities: list of (nTracksPV,nTracksSV,nTracksPileup) mean multiplicities of the jets;
+    @self.nJets: number of jets per multiplicity;
+    @self.repeats: number of timed reconstructions of each jet;
+    @self.warmup: number of jets reconstructed without timing before each measurement;
+    @self.seed: seed of the jets' generator;
+    @self.percentiles: percentiles of the latencies in the results;
+    @self.stages: names of the timed stages;
+
+    Public Methods:
+    @run(): returns dict, the benchmark results;
+    @save(results,path): writes the results in a JSON file;
+    @load(path): returns dict, the results stored in a JSON file;
+    @compare(results,baseline,tolerance,statistic): returns the list of the measurements slower than
+        the baseline's ones by more than tolerance;
+
+    Private Methods:
+    @__reconstruct(algorithm,jet): returns the finder and fitter times of a jet and the fitted SV;
+    @__statistics(times): returns dict, the statistics of a set of latencies;
+    @__measure(algorithm,jets): returns dict, the latencies and the errors of an algorithm on the jets;
+    '''
+
+    # names of the timed stages
+    stages = ("finder","fitter","total")
+
+    # Constructor
+    def __init__(self, algorithms, multiplicities = ((2,3,1),(4,5,3),(6,7,6),(10,11,10)), nJets = 20,
+                 repeats = 5, warmup = 3, seed = 0, percentiles = (50,90,99)):
+        '''
+        Constructor of the class.
+        Parameters:
+        @algorithms: dict of the algorithms to benchmark (SSVF or ClusteringSSVF instances), by name;
+        @multiplicities: list of (nTracksPV,nTracksSV,nTracksPileup) mean multiplicities of the jets;
+        @nJets: number of jets per multiplicity;
+        @repeats: number of timed reconstructions of each jet;
+        @warmup: number of jets reconstructed without timing before each measurement;
+        @seed: seed of the jets' generator;
+        @percentiles: percentiles of the latencies in the results;
+        '''
+        self.algorithms = dict(algorithms)
+        self.multiplicities = [tuple(int(n) for n in multiplicity) for multiplicity in multiplicities]
+        self.nJets = nJets
+        self.repeats = repeats
+        self.warmup = warmup
+        self.seed = seed
+        self.percentiles = tuple(percentiles)
+
+    def __reconstruct(self,algorithm,jet):
+        '''
+        Reconstructs a jet, timing the vertex finding and the vertex fitting.
+        Parameters:
+        @algorithm: instance of SSVF or ClusteringSSVF;
+        @jet: instance of Jet;
+        Returns:
+        @finder: time of the vertex finding [s];
+        @fitter: time of the vertex fitting [s];
+        @SVfit: np.array of shape (3,), the fitted SV, None if the fit failed;
+        '''
+        start = time.perf_counter()
+        found = algorithm.vertexFinder(jet)
+        middle = time.perf_counter()
+        if isinstance(algorithm,ClusteringSSVF):
+            SVfit = algorithm.vertexFitter(jet,found)
+        else:
+            SVfit, _ = algorithm.vertexFitter(found)
+        end = time.perf_counter()
+        return middle-start, end-middle, SVfit
+
+    def __statistics(self,times):
+        '''
+        Evaluates the statistics of a set of latencies.
+        Parameters:
+        @times: np.array, the latencies [s];
+        Returns:
+        @statistics: dict with the mean, the standard deviation, the minimum, the maximum and the percentiles
+            of the latencies [s];
+        '''
+        statistics = {"mean": float(np.mean(times)), "std": float(np.std(times)),
+                      "min": float(np.min(times)), "max": float(np.max(times))}
+        for q, value in zip(self.percentiles,np.percentile(times,self.percentiles)):
+            statistics["p"+str(q)] = float(value)
+        return statistics
+
+    def __measure(self,algorithm,jets):
+        '''
+        Measures the latencies of an algorithm on a set of jets.
+        Parameters:
+        @algorithm: instance of SSVF or ClusteringSSVF;
+        @jets: list of Jet instances;
+        Returns:
+        @measurement: dict with the statistics of the latencies of each stage, the fraction of valid fits
+            and the mean distance of the fitted SVs from the true ones [mm];
+        '''
+        for jet in jets[:self.warmup]:
+            self.__reconstruct(algorithm,jet)
+        times = np.zeros((len(self.stages),self.repeats,len(jets)))
+        errors = []
+        for r in range(self.repeats):
+            for j,jet in enumerate(jets):
+                finder, fitter, SVfit = self.__reconstruct(algorithm,jet)
+                times[:,r,j] = finder, fitter, finder+fitter
+                if r == 0 and SVfit is not None:
+                    errors.append(np.linalg.norm(SVfit-jet.SV))
+        measurement = {stage: self.__statistics(times[s].reshape(-1)) for s,stage in enumerate(self.stages)}
+        measurement["efficiency"] = len(errors)/len(jets)
+        measurement["meanError"] = float(np.mean(errors)) if len(errors)>0 else None
+        return measurement
+
+    def run(self):
+        '''
+        Runs the benchmark.
+        Returns:
+        @results: dict with the "metadata" of the run (machine, library versions, benchmark parameters)
+            and the list of "measurements", one for each algorithm and multiplicity;
+        '''
+        metadata = {"date": datetime.now(timezone.utc).isoformat(), "platform": platform.platform(),
+                    "processor": platform.processor(), "python": platform.python_version(),
+                    "numpy": np.__version__, "scipy": scipy.__version__, "nJets": self.nJets,
+                    "repeats": self.repeats, "warmup": self.warmup, "seed": self.seed}
+        measurements = []
+        for nTracksPV, nTracksSV, nTracksPileup in self.multiplicities:
+            generator = JetGenerator(self.nJets,nTracksPV=nTracksPV,nTracksSV=nTracksSV,
+                                     nTracksPileup=nTracksPileup,seed=self.seed)
+            jets = generator.generate()
+            for name, algorithm in self.algorithms.items():
+                measurement = {"algorithm": name, "class": type(algorithm).__name__, "config": algorithm.config(),
+                               "nTracksPV": nTracksPV, "nTracksSV": nTracksSV, "nTracksPileup": nTracksPileup,
+                               "meanTracks": float(np.mean([len(jet.collection()) for jet in jets]))}
+                measurement.update(self.__measure(algorithm,jets))
+                measurements.append(measurement)
+        return {"metadata": metadata, "measurements": measurements}
+
+    @staticmethod
+    def save(results,path):
+        '''
+        Writes the results in a JSON file.
+        Parameters:
+        @results: dict, the results of run();
+        @path: path of the file;
+        '''
+        with open(path,"w") as f:
+            json.dump(results,f,indent=2)
+
+    @staticmethod
+    def load(path):
+        '''
+        Reads the results from a JSON file.
+        Parameters:
+        @path: path of the file;
+        Returns:
+        @results: dict;
+        '''
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def compare(results,baseline,tolerance=0.2,statistic="p50"):
+        '''
+        Compares the results with a baseline: the measurements of the same algorithm and multiplicities
+        are matched, and the stages whose latency increased by more than tolerance are reported.
+        Parameters:
+        @results: dict, the results of run();
+        @baseline: dict, the baseline results;
+        @tolerance: maximum relative increase of the latencies;
+        @statistic: statistic of the latencies to be compared (e.g. "mean", "p50", "p90");
+        Returns:
+        @regressions: list of dict with the algorithm, the multiplicities, the stage, the baseline and the
+            current latencies [s] and their ratio;
+        '''
+        key = lambda m: (m["algorithm"],m["nTracksPV"],m["nTracksSV"],m["nTracksPileup"])
+        reference = {key(m): m for m in baseline["measurements"]}
+        regressions = []
+        for measurement in results["measurements"]:
+            if key(measurement) not in reference:
+                continue
+            for stage in Benchmark.stages:
+                old = reference[key(measurement)][stage][statistic]
+                new = measurement[stage][statistic]
+                if new > old*(1.+tolerance):
+                    regressions.append({"algorithm": measurement["algorithm"], "nTracksPV": measurement["nTracksPV"],
+                                        "nTracksSV": measurement["nTracksSV"], "nTracksPileup": measurement["nTracksPileup"],
+                                        "stage": stage, "baseline": old, "current": new, "ratio": new/old})
+        return regressions
@@ -1,139 +1,419 @@
 import numpy as np
 import math as m
-from scipy.optimize import minimize
-from sklearn.cluster import KMeans as KM
+import time
+from modules.TrackCollection import TrackCollection
+from modules.BatchFitter import BatchFitter
+from modules.KMeans import KMeans
+from modules.EventFile import EventFile
 
 class ClusteringSSVF:
     '''
     Class that implements the vertex finding and vertex fitting of the Single Secondary Vertex Finding
     algorithm based on Unsupervised Learning CLustering algorithm (KMeans).
+    sklearn and scipy.optimize are imported only when the "sklearn" clustering backend and the "minimize"
+    fitter are used.
 
     Members:
     @self.k: number of clusters to look for;
     @self.max_iter: max iter for KMeans;
+    @self.backend: clustering backend, "sklearn" (sklearn.cluster.KMeans, default) or "numpy" (KMeans,
+        lightweight for the few tracks of a jet);
+    @self.warmStart: initialization of the centroids of the "numpy" backend: None (k-means++, default),
+        "previous" (previous event's centroids) or "average" (running average of the events' centroids);
     @self.chi2Threshold: chi2 threshold value after which vertex fitting loop stops;
+    @self.method: scipy.optimize.minimize method of the "minimize" vertex fitting, the analytic gradient of
+        the chi2 is always used, the analytic hessian only by the methods that need it;
+    @self.fitter: vertex fitting strategy, "batch" (the vertices of all of the k clusters are fitted together 
+        by a BatchFitter, default) or "minimize" (scipy.optimize.minimize on each cluster);
+    @self.instrumentation: Instrumentation instance to which the per-event stage times and counters
+        are added (None, default: no instrumentation);
 
     Public Methods:
-    @vertexFinder(jet): returns a list of tracks' belonging cluster index;
-    @vertexFitter(couples): return np.array of shape (3,), the fitted SV;
+    @config(): returns dict, the configuration of the algorithm;
+    @features(jet): returns np.array of shape (nTracks,2), the clustering features [|IP|, versor_z] of the tracks;
+    @vertexFinder(jet): returns a list of tracks' belonging cluster index; jet can also be a TrackCollection;
+    @vertexFitter(jet,clusters): return np.array of shape (3,), the fitted SV;
+    @reconstruct(jet): returns np.array of shape (3,), the fitted SV, and np.array, the indices of 
+        the tracks of the selected cluster (None, None if the fit failed);
+    @featuresBatch(batch): returns np.array of shape (nJets,maxTracks,2), the clustering features of the
+        tracks of a JetBatch in its padded layout, and the padding mask;
+    @vertexFinderBatch(batch): returns np.array of shape (nJets,maxTracks), the tracks' belonging cluster
+        index of each jet of a JetBatch (-1 on the padding and for the jets with less than k tracks);
+    @vertexFitterBatch(batch,clusters): returns np.array of shape (nJets,3), the fitted SVs, np.array of
+        shape (nJets,) of bool, the validity mask, and np.array of shape (nJets,maxTracks) of bool,
+        the tracks of the selected clusters;
+    @reconstructBatch(batch): returns the fitted SVs and the validity mask of all of the jets of a JetBatch (or EventFile);
+    @reconstructStream(batches): yields, for each JetBatch of an iterable (e.g. JetGenerator.iterBatches) or EventFile,
+        the batch, its fitted SVs and its validity mask;
 
     Private Methods:
     @__chi2(vertex,tracks): chi2 to be minimized during vertex fitting step;
-    @__evaluateChi2(vfit,tracks): returns the list of the track's chi2 wrt the current fitted vertex;
+    @__chi2Gradient(vertex,tracks): analytic gradient of the chi2;
+    @__chi2Hessian(vertex,tracks): analytic hessian of the chi2;
+    @__minimize(SVfit0,tracks): minimizes the chi2 with the configured method and analytic derivatives;
+    @__evaluateChi2(vfit,tracks): returns the array of the track's chi2 wrt the current fitted vertex;
+    @__batchFit(tracks,clusterMasks): returns the vertices and the chi2 of the clusters, fitted together;
+    @__minimizeFit(tracks,clusterMasks): returns the vertices and the chi2 of the clusters, fitted one at a time;
+    @__fit(tracks,clusters): fits a vertex on each cluster and returns the best one with its tracks' indices;
+    @__record(stage,seconds): adds the time of a stage to the instrumentation;
+    @__clustering(): returns the KMeans instance of the configured backend;
     '''
+    # scipy.optimize.minimize methods that use the hessian
+    hessianMethods = ("Newton-CG","dogleg","trust-ncg","trust-krylov","trust-exact","trust-constr")
+    # Available vertex fitting strategies
+    fitters = ("batch","minimize")
+    # Available clustering backends
+    backends = ("sklearn","numpy")
+    # First guess on the SV: flight length on the z components and non zero x and y
+    fixedGuess = [0.01,0.01,10.,]
+    # Tolerances on the vertex displacement and on the chi2 decrease of the batched fits [mm]
+    xtol = 1e-6
+    ftol = 1e-10
+
     # Constructor
-    def __init__(self, k = 3, max_iter = 300, chi2Threshold = 0.1) -> None:
+    def __init__(self, k = 3, max_iter = 300, chi2Threshold = 0.1, method = "BFGS", fitter = "batch",
+                 backend = "sklearn", warmStart = None, instrumentation = None) -> None:
+        if fitter not in self.fitters:
+            raise ValueError("Unknown fitter '" + str(fitter) + "', available: " + str(self.fitters))
+        if backend not in self.backends:
+            raise ValueError("Unknown backend '" + str(backend) + "', available: " + str(self.backends))
+        if warmStart is not None and backend != "numpy":
+            raise ValueError("warmStart is available only with the numpy backend")
         self.k = k
         self.max_iter = max_iter
         self.chi2Threshold = chi2Threshold
+        self.method = method
+        self.fitter = fitter
+        self.backend = backend
+        self.warmStart = warmStart
+        # numpy KMeans, kept between the events for the warm start
+        self.__kmeans = KMeans(k,max_iter=max_iter,warmStart=warmStart) if backend == "numpy" else None
+        self.instrumentation = instrumentation
+
+    def config(self):
+        '''
+        Returns the configuration of the algorithm.
+        Returns:
+        @config: dict of the constructor's parameters;
+        '''
+        return {"k": self.k, "max_iter": self.max_iter, "chi2Threshold": self.chi2Threshold, "method": self.method,
+                "fitter": self.fitter, "backend": self.backend, "warmStart": self.warmStart}
 
     def __chi2(self,vertex,tracks):
         '''
         Evaluates the chi2 of the current vertex.
         Parameters:
         @vertex: np.array of shape (3,), current fitted secondary vertex;
-        @tracks: current list of tracks supposedly belonging to the secondary vertex;
+        @tracks: TrackCollection of the tracks supposedly belonging to the secondary vertex;
         Returns:
         @chi2: chi2 of the fit, defined as the sum of the distances of the tracks from the vertex;
         '''
-        vertex = np.asarray(vertex)
-        chi2 = 0
-        for t in tracks:
-            chi2 += t.pointDistance(vertex)
-        return chi2
+        return np.sum(tracks.pointDistances(vertex))
+
+    def __chi2Gradient(self,vertex,tracks):
+        '''
+        Evaluates the analytic gradient of the chi2 wrt the vertex.
+        Parameters:
+        @vertex: np.array of shape (3,), current fitted secondary vertex;
+        @tracks: TrackCollection of the tracks supposedly belonging to the secondary vertex;
+        Returns:
+        @gradient: np.array of shape (3,), the gradient of the chi2;
+        '''
+        return tracks.sumDistancesGradient(vertex)
+
+    def __chi2Hessian(self,vertex,tracks):
+        '''
+        Evaluates the analytic hessian of the chi2 wrt the vertex.
+        Parameters:
+        @vertex: np.array of shape (3,), current fitted secondary vertex;
+        @tracks: TrackCollection of the tracks supposedly belonging to the secondary vertex;
+        Returns:
+        @hessian: np.array of shape (3,3), the hessian of the chi2;
+        '''
+        return tracks.sumDistancesHessian(vertex)
+
+    def __minimize(self,SVfit0,tracks):
+        '''
+        Minimizes the chi2 of the tracks with the configured method, using the analytic derivatives.
+        Parameters:
+        @SVfit0: np.array of shape (3,), first guess on the vertex;
+        @tracks: TrackCollection of the tracks supposedly belonging to the secondary vertex;
+        Returns:
+        @result: scipy.optimize.OptimizeResult, the result of the minimization;
+        '''
+        # scipy.optimize is imported only by the "minimize" fitters
+        from scipy.optimize import minimize
+        hess = self.__chi2Hessian if self.method in self.hessianMethods else None
+        return minimize(self.__chi2,x0=SVfit0,args=(tracks,),method=self.method,jac=self.__chi2Gradient,hess=hess)
 
     def __evaluateChi2(self,vfit,tracks):
         '''
         Evaluates the tracks' chi2 from the current vertex.
         Parameters:
         @vfit: np.array of shape (3,), current fitted secondary vertex;
-        @tracks: current list of tracks supposedly belonging to the secondary vertex;
+        @tracks: TrackCollection of the tracks supposedly belonging to the secondary vertex;
         Returns:
         @chi2: np.array, the chi2 of the tracks from the fitted vertex;
         '''
-        chi2 = []
-        for t in tracks:
-            chi2.append(t.pointDistance(vfit))
-        return np.asarray(chi2)
+        return tracks.pointDistances(vfit)
+
+    def __record(self,stage,seconds):
+        '''
+        Adds the time of a stage to the current event of the instrumentation, and to its total time.
+        Parameters:
+        @stage: name of the stage ("finder" or "fitter");
+        @seconds: time of the stage [s];
+        '''
+        self.instrumentation.add(stage+"Time",seconds)
+        self.instrumentation.add("totalTime",seconds)
+
+    def features(self,jet):
+        '''
+        Builds the clustering features of the tracks (read from the jet's cache if it is enabled).
+        Parameters:
+        @jet: instance of Jet or TrackCollection;
+        Returns:
+        @features: np.array of shape (nTracks,2), the absolute impact parameter and the versor's z component
+            of each track;
+        '''
+        tracks = TrackCollection.asCollection(jet)
+        IP = tracks.cached("impactParameters",tracks.impactParameters)
+        return tracks.cached("features",lambda: np.column_stack((np.abs(IP),tracks.versors[:,2])))
+
+    def __clustering(self):
+        '''
+        Returns the KMeans instance of the configured backend.
+        Returns:
+        @km: instance of KMeans (numpy backend, the same at each event) or of sklearn.cluster.KMeans (a new one);
+        '''
+        if self.backend == "numpy":
+            return self.__kmeans
+        from sklearn.cluster import KMeans as KM
+        return KM(self.k, max_iter=self.max_iter)
 
     def vertexFinder(self,jet):
         '''
         Implements the tracks clustering step.
         Parameters:
-        @jet: instance of Jet, the event on which apply SSVF;
+        @jet: instance of Jet or TrackCollection, the event on which apply SSVF;
         Returns:
         @clusters: np.array of shape (nTracks,), the belonging cluster of each track;
         '''
-        jetForClustering = []
-        for t in jet.tracksPV:
-            track = [np.abs(t.IP),t.versor[2]]
-            jetForClustering.append(track)
-        for t in jet.tracksSV:
-            track = [np.abs(t.IP),t.versor[2]]
-            jetForClustering.append(track)
-        for t in jet.tracksPileup:
-            track = [np.abs(t.IP),t.versor[2]]
-            jetForClustering.append(track)
-        
-        jetForClustering = np.asarray(jetForClustering)
-        km = KM(self.k, max_iter=self.max_iter)
+        if self.instrumentation is not None:
+            self.instrumentation.newEvent()
+            start = time.perf_counter()
+        jetForClustering = self.features(jet)
+        km = self.__clustering()
         km.fit(jetForClustering)
         clusters = km.labels_
+        if self.instrumentation is not None:
+            self.instrumentation.add("kmeansIterations",km.n_iter_)
+            self.__record("finder",time.perf_counter()-start)
         return clusters
 
 
+    def __batchFit(self,tracks,clusterMasks):
+        '''
+        Fits the vertices of all of the clusters together: each cluster is a row of a BatchFitter
+        on the jet's tracks, masked by the cluster's membership.
+        Parameters:
+        @tracks: TrackCollection on which the clustering has been executed;
+        @clusterMasks: np.array of shape (k,nTracks) of bool, the tracks of each cluster;
+        Returns:
+        @vertices: np.array of shape (k,3), the fitted vertices of the clusters;
+        @chi2: np.array of shape (k,), the chi2 of the clusters wrt their vertices;
+        '''
+        k, nTracks = clusterMasks.shape
+        fitter = BatchFitter(np.broadcast_to(tracks.origins,(k,nTracks,3)),
+                             np.broadcast_to(tracks.versors,(k,nTracks,3)),clusterMasks,xtol=self.xtol,ftol=self.ftol)
+        vertices = fitter.fit(fitter.closestPoints(self.fixedGuess))
+        if self.instrumentation is not None:
+            self.instrumentation.add("minimizations",k)
+            self.instrumentation.add("iterations",int(np.sum(fitter.nIterations)))
+        return vertices, np.sum(fitter.chi2s(),axis=1)
+
+    def __minimizeFit(self,tracks,clusterMasks):
+        '''
+        Fits the vertices of the clusters one at a time with scipy.optimize.minimize.
+        Parameters:
+        @tracks: TrackCollection on which the clustering has been executed;
+        @clusterMasks: np.array of shape (k,nTracks) of bool, the tracks of each cluster;
+        Returns:
+        @vertices: np.array of shape (k,3), the fitted vertices of the clusters;
+        @chi2: np.array of shape (k,), the chi2 of the clusters wrt their vertices;
+        '''
+        vertices = np.zeros((clusterMasks.shape[0],3))
+        chi2 = np.zeros(clusterMasks.shape[0])
+        for c, mask in enumerate(clusterMasks):
+            clusterTracks = tracks.subset(mask)
+            # Fitting a vertex on each cluster
+            result = self.__minimize(self.fixedGuess,clusterTracks)
+            vertices[c] = result.x
+            if self.instrumentation is not None:
+                self.instrumentation.add("minimizations")
+                self.instrumentation.add("iterations",result.nit)
+                self.instrumentation.add("evaluations",result.nfev)
+            # Evaluate the total chi2 of the cluster wrt its fitted vertex
+            chi2[c] = np.sum(self.__evaluateChi2(vertices[c],clusterTracks))
+        return vertices, chi2
+
+    def __fit(self,tracks,clusters):
+        '''
+        Fits a vertex on each cluster and selects the best one.
+        Parameters:
+        @tracks: TrackCollection on which the clustering has been executed;
+        @clusters: tracks' belonging cluster indices, in [0,k);
+        Returns:
+        @SVfit: np.array of shape (3,), the fitted secondary vertex, None if the fit failed;
+        @selected: np.array, indices of the tracks of the selected cluster, None if the fit failed;
+        '''
+        # create clusters' masks, one row per cluster
+        clusterMasks = np.asarray(clusters)[None,:] == np.arange(self.k)[:,None]
+        if self.fitter == "batch":
+            clusterVertices, chi2Clusters = self.__batchFit(tracks,clusterMasks)
+        else:
+            clusterVertices, chi2Clusters = self.__minimizeFit(tracks,clusterMasks)
+        # Empty clusters can not be selected
+        chi2Clusters[~np.any(clusterMasks,axis=1)] = np.inf
+        # If the chi2 of a cluster is below the threshold, return the respective vertex
+        if np.any(chi2Clusters <= self.chi2Threshold):
+            best = np.argmin(chi2Clusters)
+            return np.array(clusterVertices[best]), np.flatnonzero(clusterMasks[best])
+        # Else, vertex fitting failed
+        else:
+            return None,None
+
     def vertexFitter(self,jet,clusters):
         '''
         Implements the vertex fitting step.
         Parameters:
-        @jet: the jet on which the clustering has been executed;
+        @jet: the jet (or TrackCollection) on which the clustering has been executed;
         @clusters: tracks' belonging cluster indices;
         Returns:
         @SVfit: np.array of shape (3,), the fitted secondary vertex;
         '''
+        if self.instrumentation is not None:
+            start = time.perf_counter()
+        SVfit, _ = self.__fit(TrackCollection.asCollection(jet),clusters)
+        if self.instrumentation is not None:
+            self.__record("fitter",time.perf_counter()-start)
+        return SVfit
 
-        allTracks = []
-        # Flatten the track list
-        for t in jet.tracksPV:
-            allTracks.append(t)        
-        for t in jet.tracksSV:
-            allTracks.append(t)        
-        for t in jet.tracksPileup:
-            allTracks.append(t)
-
-        # create clusters' track lists
-        cluster0Tracks = []
-        cluster1Tracks = []
-        cluster2Tracks = []
-
-        for i,t in enumerate(allTracks):
-            if clusters[i] == 0:
-                cluster0Tracks.append(t)
-            elif clusters[i] == 1:
-                cluster1Tracks.append(t)
-            else:
-                cluster2Tracks.append(t)  
-
-        # First guess on the SV: flight length on the z components and non zero x and y
-        SVfit0 = [0.01,0.01,10.,]
-        # Fitting a vertex on each cluster
-        SVfitC0 = minimize(self.__chi2,x0=SVfit0,args=cluster0Tracks).x
-        SVfitC1 = minimize(self.__chi2,x0=SVfit0,args=cluster1Tracks).x
-        SVfitC2 = minimize(self.__chi2,x0=SVfit0,args=cluster2Tracks).x
-        clusterVertices = np.array([SVfitC0,SVfitC1,SVfitC2])
-
-        # Evaluate the per-track per-cluster chi2 of the current fitted vertices
-        chi2sC0 = self.__evaluateChi2(SVfitC0,cluster0Tracks)
-        chi2sC1 = self.__evaluateChi2(SVfitC1,cluster1Tracks)
-        chi2sC2 = self.__evaluateChi2(SVfitC2,cluster2Tracks)
-        # Evaluate the total chi2 per-cluster
-        chi2sC0 = np.sum(chi2sC0)
-        chi2sC1 = np.sum(chi2sC1)
-        chi2sC2 = np.sum(chi2sC2)
-        chi2Clusters = np.array([chi2sC0,chi2sC1,chi2sC2])
-        # If the chi2 of a cluster is below the threshold, return the respective vertex
-        if np.any(chi2Clusters <= self.chi2Threshold):
-            return np.array(clusterVertices[np.argmin(chi2Clusters)])
-        # Else, vertex fitting failed
+    def reconstruct(self,jet):
+        '''
+        Applies the clustering and the vertex fitting to a jet.
+        Parameters:
+        @jet: instance of Jet or TrackCollection;
+        Returns:
+        @SVfit: np.array of shape (3,), the fitted secondary vertex, None if the fit failed;
+        @selected: np.array, indices of the tracks of the selected cluster among the jet's tracks
+            (PV, SV and pileup, in this order), None if the fit failed;
+        '''
+        tracks = TrackCollection.asCollection(jet)
+        clusters = self.vertexFinder(tracks)
+        if self.instrumentation is not None:
+            start = time.perf_counter()
+        result = self.__fit(tracks,clusters)
+        if self.instrumentation is not None:
+            self.__record("fitter",time.perf_counter()-start)
+        return result
+
+    def featuresBatch(self,batch):
+        '''
+        Builds the clustering features of the tracks of all of the jets of a batch, as in features.
+        Parameters:
+        @batch: instance of JetBatch;
+        Returns:
+        @features: np.array of shape (nJets,maxTracks,2), the absolute impact parameter and the versor's
+            z component of each track, in the padded layout of the batch;
+        @mask: np.array of shape (nJets,maxTracks) of bool, False on the padding;
+        '''
+        origins, versors, mask = batch.padded()
+        features = np.stack((TrackCollection.lineImpactParameters(origins,versors),versors[...,2]),axis=2)
+        return features, mask
+
+    def vertexFinderBatch(self,batch):
+        '''
+        Implements the tracks clustering step on all of the jets of a batch at once: with the "numpy"
+        backend the Lloyd iterations of all of the jets run together (KMeans.fitBatch), with the "sklearn"
+        backend the jets are clustered one at a time. The jets with less than k tracks are not clustered.
+        Parameters:
+        @batch: instance of JetBatch;
+        Returns:
+        @clusters: np.array of shape (nJets,maxTracks), the belonging cluster of each track in the
+            padded layout of the batch, -1 on the padding and for the jets that are not clustered;
+        '''
+        features, mask = self.featuresBatch(batch)
+        clusters = np.full(mask.shape,-1)
+        rows = np.flatnonzero(np.sum(mask,axis=1)>=self.k)
+        if len(rows) == 0:
+            return clusters
+        if self.backend == "numpy":
+            clusters[rows] = self.__kmeans.fitBatch(features[rows],mask[rows])[0]
         else:
-            return None
\ No newline at end of file
+            for b in rows:
+                clusters[b,mask[b]] = self.__clustering().fit(features[b,mask[b]]).labels_
+        return clusters
+
+    def vertexFitterBatch(self,batch,clusters):
+        '''
+        Implements the vertex fitting step on all of the jets of a batch at once: the k clusters of all
+        of the jets are the rows of a single BatchFitter, and the cluster with the lowest chi2 of each jet
+        is selected if its chi2 is below threshold.
+        Parameters:
+        @batch: instance of JetBatch;
+        @clusters: np.array of shape (nJets,maxTracks), result of vertexFinderBatch;
+        Returns:
+        @SVfit: np.array of shape (nJets,3), the fitted secondary vertices (np.nan if not valid);
+        @valid: np.array of shape (nJets,) of bool, False if the fit failed;
+        @selected: np.array of shape (nJets,maxTracks) of bool, the tracks of the selected clusters;
+        '''
+        origins, versors, _ = batch.padded()
+        nJets, maxTracks = clusters.shape
+        # one row per cluster of each jet
+        clusterMasks = clusters[:,None,:] == np.arange(self.k)[None,:,None]
+        shape = (nJets,self.k,maxTracks,3)
+        fitter = BatchFitter(np.broadcast_to(origins[:,None],shape).reshape(-1,maxTracks,3),
+                             np.broadcast_to(versors[:,None],shape).reshape(-1,maxTracks,3),
+                             clusterMasks.reshape(-1,maxTracks),xtol=self.xtol,ftol=self.ftol)
+        vertices = fitter.fit(fitter.closestPoints(self.fixedGuess)).reshape(nJets,self.k,3)
+        chi2Clusters = np.sum(fitter.chi2s(),axis=1).reshape(nJets,self.k)
+        # Empty clusters can not be selected
+        chi2Clusters[~np.any(clusterMasks,axis=2)] = np.inf
+        jets = np.arange(nJets)
+        best = np.argmin(chi2Clusters,axis=1)
+        valid = chi2Clusters[jets,best] <= self.chi2Threshold
+        SVfit = np.where(valid[:,None],vertices[jets,best],np.nan)
+        return SVfit, valid, clusterMasks[jets,best] & valid[:,None]
+
+    def reconstructBatch(self,batch):
+        '''
+        Applies the clustering and the vertex fitting to all of the jets of a batch.
+        Parameters:
+        @batch: instance of JetBatch or EventFile (all of its jets are read at once);
+        Returns:
+        @SVfit: np.array of shape (nJets,3), the fitted secondary vertices (np.nan if not valid);
+        @valid: np.array of shape (nJets,) of bool, False if the fit failed;
+        '''
+        if isinstance(batch,EventFile):
+            batch = batch.batch()
+        SVfit, valid, _ = self.vertexFitterBatch(batch,self.vertexFinderBatch(batch))
+        return SVfit, valid
+
+    def reconstructStream(self,batches):
+        '''
+        Applies the clustering and the vertex fitting to a stream of batches, one batch at a time,
+        so that only the current batch is held in memory.
+        Parameters:
+        @batches: iterable of JetBatch instances, e.g. JetGenerator.iterBatches(chunkSize) or
+            EventFile.iterBatches(chunkSize), or EventFile (read in batches of 10000 jets);
+        Yields:
+        @batch: instance of JetBatch, the current batch;
+        @SVfit: np.array of shape (nJets,3), the fitted secondary vertices (np.nan if not valid);
+        @valid: np.array of shape (nJets,) of bool, False if the fit failed;
+        '''
+        if isinstance(batches,EventFile):
+            batches = batches.iterBatches()
+        for batch in batches:
+            SVfit, valid = self.reconstructBatch(batch)
+            yield batch, SVfit, valid
@@ -0,0 +1,152 @@
+import numpy as np
+import json
+import os
+from modules.JetBatch import JetBatch
+
+class EventFile:
+    '''
+    Class that implements a columnar on-disk format for jets: a directory with one raw binary file per
+    column of JetBatch (track origins, versors and categories, per-event offsets, PV and SV) and a JSON
+    header with the columns' dtypes and shapes. The columns are opened with np.memmap, so that any range
+    of events can be read without loading the file, and many processes can share the same sample.
+    Public Members:
+    @self.path: path of the directory of the file;
+    @self.nJets: number of jets in the file;
+    @self.nTracks: total number of tracks in the file;
+    @self.columns: dict of np.memmap, the columns of the file (read only);
+    @self.headerName: name of the header file in the directory;
+    @self.version: version of the format;
+    @self.dtypes: dict, the on-disk dtype of each column;
+
+    Public Methods:
+    @write(path,batches): returns EventFile, writes a JetBatch, or an iterable of JetBatch instances
+        one at a time, in a new file;
+    @batch(start,stop): returns JetBatch, the jets in [start,stop) whose track arrays are views of the file;
+    @iterBatches(chunkSize,start,stop): yields JetBatch instances of at most chunkSize jets of the file;
+
+    Private Methods:
+    @__open(name): returns np.memmap, the column of the file;
+    '''
+
+    # name of the header file in the directory
+    headerName = "header.json"
+    # version of the format
+    version = 1
+    # on-disk dtype of each column (little endian)
+    dtypes = {"origins":"<f8", "versors":"<f8", "categories":"|i1", "offsets":"<i8", "PV":"<f8", "SV":"<f8"}
+
+    # Constructor
+    def __init__(self, path):
+        '''
+        Opens an existing file.
+        Parameters:
+        @path: path of the directory of the file;
+        '''
+        self.path = str(path)
+        with open(os.path.join(self.path,self.headerName)) as f:
+            self.__header = json.load(f)
+        if self.__header["version"] != self.version:
+            raise ValueError("Unsupported event file version: " + str(self.__header["version"]))
+        self.nJets = self.__header["nJets"]
+        self.nTracks = self.__header["nTracks"]
+        self.columns = {name: self.__open(name) for name in self.dtypes}
+
+    def __open(self,name):
+        '''
+        Opens a column of the file with np.memmap.
+        Parameters:
+        @name: name of the column;
+        Returns:
+        @column: np.memmap (np.array if the column is empty);
+        '''
+        column = self.__header["columns"][name]
+        shape = tuple(column["shape"])
+        # np.memmap can not map empty files
+        if np.prod(shape) == 0:
+            return np.empty(shape,dtype=column["dtype"])
+        return np.memmap(os.path.join(self.path,column["file"]),dtype=column["dtype"],mode="r",shape=shape)
+
+    def __len__(self):
+        return self.nJets
+
+    # Only the path is pickled, the columns are mapped again by the receiving process
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    @classmethod
+    def write(cls, path, batches):
+        '''
+        Writes the jets in a new file, appending the batches to the columns one at a time.
+        Parameters:
+        @path: path of the directory of the file, created if needed;
+        @batches: JetBatch or iterable of JetBatch instances, e.g. JetGenerator.iterBatches(chunkSize);
+        Returns:
+        @file: instance of EventFile, the written file;
+        '''
+        if isinstance(batches,JetBatch):
+            batches = [batches]
+        path = str(path)
+        os.makedirs(path,exist_ok=True)
+        # The header is written last, a partially written file can not be opened
+        header = os.path.join(path,cls.headerName)
+        if os.path.exists(header):
+            os.remove(header)
+        files = {name: open(os.path.join(path,name+".bin"),"wb") for name in cls.dtypes}
+        nJets = 0
+        nTracks = 0
+        try:
+            np.zeros(1,dtype=cls.dtypes["offsets"]).tofile(files["offsets"])
+            for batch in batches:
+                np.asarray(batch.origins,dtype=cls.dtypes["origins"]).tofile(files["origins"])
+                np.asarray(batch.versors,dtype=cls.dtypes["versors"]).tofile(files["versors"])
+                np.asarray(batch.categories,dtype=cls.dtypes["categories"]).tofile(files["categories"])
+                offsets = np.asarray(batch.offsets[1:]-batch.offsets[0]+nTracks,dtype=cls.dtypes["offsets"])
+                offsets.tofile(files["offsets"])
+                np.asarray(batch.PV,dtype=cls.dtypes["PV"]).tofile(files["PV"])
+                np.asarray(batch.SV,dtype=cls.dtypes["SV"]).tofile(files["SV"])
+                nJets += len(batch)
+                nTracks += int(batch.offsets[-1]-batch.offsets[0])
+        finally:
+            for f in files.values():
+                f.close()
+        shapes = {"origins":[nTracks,3], "versors":[nTracks,3], "categories":[nTracks], "offsets":[nJets+1],
+                  "PV":[nJets,3], "SV":[nJets,3]}
+        columns = {name: {"file":name+".bin", "dtype":cls.dtypes[name], "shape":shapes[name]} for name in cls.dtypes}
+        with open(header,"w") as f:
+            json.dump({"version":cls.version, "nJets":nJets, "nTracks":nTracks, "columns":columns},f,indent=2)
+        return cls(path)
+
+    def batch(self,start=0,stop=None):
+        '''
+        Reads the jets in [start,stop): the track arrays of the batch are views of the mapped columns,
+        only the offsets are copied.
+        Parameters:
+        @start: index of the first jet;
+        @stop: index after the last jet (default: the number of jets);
+        Returns:
+        @batch: instance of JetBatch;
+        '''
+        stop = self.nJets if stop is None else min(stop,self.nJets)
+        start = min(start,stop)
+        offsets = np.array(self.columns["offsets"][start:stop+1])
+        first, last = offsets[0], offsets[-1]
+        return JetBatch(self.columns["origins"][first:last],self.columns["versors"][first:last],
+                        self.columns["categories"][first:last],offsets-first,
+                        self.columns["PV"][start:stop],self.columns["SV"][start:stop])
+
+    def iterBatches(self,chunkSize=10000,start=0,stop=None):
+        '''
+        Reads the jets in [start,stop) in chunks.
+        Parameters:
+        @chunkSize: maximum number of jets per batch;
+        @start: index of the first jet;
+        @stop: index after the last jet (default: the number of jets);
+        Yields:
+        @batch: instance of JetBatch;
+        '''
+        stop = self.nJets if stop is None else min(stop,self.nJets)
+        for first in range(start,stop,chunkSize):
+            yield self.batch(first,min(first+chunkSize,stop))
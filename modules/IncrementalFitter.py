@@ -0,0 +1,176 @@
+import numpy as np
+from modules.TrackCollection import TrackCollection
+
+class IncrementalFitter:
+    '''
+    Class that implements an incremental vertex fit of a set of tracks, minimizing the sum of the
+    distances of the tracks from the vertex with iteratively reweighted least squares (IRLS).
+    Each track i keeps its sufficient statistics: the projector A_i = I - v_i v_i^T orthogonal to the track
+    and the projected origin b_i = A_i o_i; given the weights w_i = 1/d_i, the vertex solves the 3x3 system
+    (sum_i w_i A_i) x = sum_i w_i b_i. Removing a track downdates the weighted sums in O(1), and the
+    downdated solution is the first iteration of the refit on the remaining tracks.
+    The IRLS steps are over-relaxed, falling back on the plain step when the over-relaxed one is not better
+    (the same update rule as BatchFitter).
+    Public Members:
+    @self.tracks: TrackCollection, the tracks to be fitted;
+    @self.active: np.array of shape (N,) of bool, the tracks that have not been removed;
+    @self.vertex: np.array of shape (3,), the current fitted vertex;
+    @self.nIterations: number of IRLS iterations since the fitter has been created;
+    @self.nEvaluations: number of evaluations of the tracks' distances since the fitter has been created;
+    @self.xtol: tolerance on the vertex displacement [mm] under which the IRLS iterations stop;
+    @self.maxIter: maximum number of IRLS iterations per fit;
+    @self.ftol: tolerance on the chi2 decrease [mm] under which the IRLS iterations stop;
+    @self.minDistance: lower bound on the distances used in the weights [mm];
+    @self.relaxation: over-relaxation factor of the IRLS steps;
+
+    Public Methods:
+    @fit(x0): returns np.array of shape (3,), fits the vertex on the active tracks starting from x0;
+    @remove(i): returns np.array of shape (3,), removes the i-th track and refits the vertex;
+    @chi2s(): returns np.array, the distances of the active tracks from the current vertex;
+    @activeIndices(): returns np.array, the indices of the active tracks;
+
+    Private Methods:
+    @__reweight(distances): evaluates the weights and the weighted sums from the tracks' distances;
+    @__distances(vertex): returns the tracks' distances from the vertex and the chi2 of the active tracks;
+    @__solve(): returns the solution of the weighted least squares system;
+    @__iterate(): IRLS iterations from the current vertex;
+    '''
+
+    # lower bound on the distances used in the weights [mm]
+    minDistance = 1e-9
+    # over-relaxation factor of the IRLS steps
+    relaxation = 1.9
+
+    # Constructor
+    def __init__(self, tracks, xtol = 1e-9, maxIter = 200, ftol = 0.):
+        '''
+        Constructor of the class.
+        Parameters:
+        @tracks: TrackCollection (or list of Track instances) of the tracks to be fitted;
+        @xtol: tolerance on the vertex displacement [mm] under which the IRLS iterations stop;
+        @maxIter: maximum number of IRLS iterations per fit;
+        @ftol: tolerance on the chi2 decrease [mm] under which the IRLS iterations stop;
+        '''
+        self.tracks = TrackCollection.asCollection(tracks)
+        self.xtol = xtol
+        self.maxIter = maxIter
+        self.ftol = ftol
+        self.nIterations = 0
+        self.nEvaluations = 0
+        self.active = np.ones(len(self.tracks),dtype=bool)
+        self.vertex = np.zeros(3)
+        # Per-track sufficient statistics
+        versors = self.tracks.versors
+        self.__projectors = np.eye(3)[None,:,:] - versors[:,:,None]*versors[:,None,:]
+        self.__projectedOrigins = np.einsum('ijk,ik->ij',self.__projectors,self.tracks.origins)
+        self.__weights = np.zeros(len(self.tracks))
+        self.__S = np.zeros((3,3))
+        self.__s = np.zeros(3)
+
+    def __distances(self,vertex):
+        '''
+        Evaluates the distances of the tracks from the vertex.
+        Parameters:
+        @vertex: np.array of shape (3,);
+        Returns:
+        @distances: np.array of shape (N,), the distances of all of the tracks from the vertex;
+        @chi2: the sum of the distances of the active tracks;
+        '''
+        self.nEvaluations += 1
+        distances = self.tracks.pointDistances(vertex)
+        return distances, np.sum(distances[self.active])
+
+    def __reweight(self,distances):
+        '''
+        Evaluates the weights w_i = 1/d_i of the active tracks and the weighted sums.
+        Parameters:
+        @distances: np.array of shape (N,), the distances of the tracks from the current vertex;
+        '''
+        self.__weights = np.where(self.active,1./np.maximum(distances,self.minDistance),0.)
+        self.__S = np.einsum('i,ijk->jk',self.__weights,self.__projectors)
+        self.__s = self.__weights @ self.__projectedOrigins
+
+    def __solve(self):
+        '''
+        Solves the weighted least squares system with the current weighted sums.
+        Returns:
+        @vertex: np.array of shape (3,), the solution of the system;
+        '''
+        try:
+            return np.linalg.solve(self.__S,self.__s)
+        except np.linalg.LinAlgError:
+            return np.linalg.lstsq(self.__S,self.__s,rcond=None)[0]
+
+    def __iterate(self):
+        '''
+        IRLS iterations from the current vertex, until the vertex displacement is below xtol or the chi2
+        decrease is below ftol.
+        Returns:
+        @vertex: np.array of shape (3,), the fitted vertex;
+        '''
+        distances, chi2 = self.__distances(self.vertex)
+        for _ in range(self.maxIter):
+            self.__reweight(distances)
+            vertex = self.__solve()
+            # Over-relaxed step, taken only if better than the plain step (that never increases the chi2)
+            relaxed = self.vertex + self.relaxation*(vertex-self.vertex)
+            relaxedDistances, relaxedChi2 = self.__distances(relaxed)
+            previousChi2 = chi2
+            distances, chi2 = self.__distances(vertex)
+            if relaxedChi2<chi2:
+                vertex, distances, chi2 = relaxed, relaxedDistances, relaxedChi2
+            self.nIterations += 1
+            step = np.linalg.norm(vertex-self.vertex)
+            self.vertex = vertex
+            if step<self.xtol or previousChi2-chi2<self.ftol:
+                break
+        return self.vertex
+
+    def fit(self,x0):
+        '''
+        Fits the vertex on the active tracks.
+        Parameters:
+        @x0: np.array or list of shape (3,), first guess on the vertex;
+        Returns:
+        @vertex: np.array of shape (3,), the fitted vertex;
+        '''
+        self.vertex = np.array(x0,dtype=float)
+        # No tracks to fit, the first guess is returned
+        if not np.any(self.active):
+            return self.vertex
+        return self.__iterate()
+
+    def remove(self,i):
+        '''
+        Removes the i-th track: the weighted sums are downdated with the track's statistics, and the
+        vertex is refitted starting from the solution of the downdated system.
+        Parameters:
+        @i: index of the track in the fitter's collection;
+        Returns:
+        @vertex: np.array of shape (3,), the refitted vertex;
+        '''
+        self.active[i] = False
+        if not np.any(self.active):
+            return self.vertex
+        # O(1) downdate of the weighted sums
+        self.__S = self.__S - self.__weights[i]*self.__projectors[i]
+        self.__s = self.__s - self.__weights[i]*self.__projectedOrigins[i]
+        self.__weights[i] = 0.
+        self.vertex = self.__solve()
+        return self.__iterate()
+
+    def chi2s(self):
+        '''
+        Evaluates the distances of the active tracks from the current vertex.
+        Returns:
+        @chi2: np.array of shape (nActive,), the tracks' chi2;
+        '''
+        return self.tracks.pointDistances(self.vertex)[self.active]
+
+    def activeIndices(self):
+        '''
+        Returns the indices of the active tracks.
+        Returns:
+        @indices: np.array of shape (nActive,);
+        '''
+        return np.flatnonzero(self.active)
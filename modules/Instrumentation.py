@@ -0,0 +1,121 @@
+import numpy as np
+import json
+
+class Instrumentation:
+    '''
+    Class that collects per-event metrics of the reconstruction algorithms: the algorithms constructed
+    with instrumentation=Instrumentation() add the wall time of their stages ("finderTime", "fitterTime",
+    "totalTime" [s]) and their counters (e.g. "distanceEvaluations", "minimizations", "iterations",
+    "evaluations", "rejections", "kmeansIterations") to the current event, and start a new event at each
+    vertexFinder or reconstruct call. Algorithms without instrumentation (the default) skip all of it.
+    Public Members:
+    @self.events: list of dict, the metrics of each event;
+    @self.percentiles: percentiles of the metrics in the summary;
+
+    Public Methods:
+    @newEvent(): starts a new event;
+    @add(name,value): adds value to the metric name of the current event;
+    @addEvents(name,values): adds the values to the metric name of the last len(values) events (batches of jets);
+    @summary(): returns dict, the statistics of each metric over the events;
+    @slowest(name,n): returns the indices and the metrics of the n events with the largest value of a metric;
+    @text(): returns str, the summary as a table;
+    @json(): returns str, the summary and the per-event metrics in JSON format;
+    @reset(): removes all of the events;
+    '''
+
+    # percentiles of the metrics in the summary
+    percentiles = (50,90,99)
+
+    # Constructor
+    def __init__(self):
+        self.events = []
+
+    def newEvent(self):
+        '''
+        Starts a new event, to which the next metrics are added.
+        '''
+        self.events.append({})
+
+    def add(self,name,value=1):
+        '''
+        Adds a value to a metric of the current event (a new event is started if there are none).
+        Parameters:
+        @name: name of the metric;
+        @value: value to be added;
+        '''
+        if len(self.events) == 0:
+            self.newEvent()
+        event = self.events[-1]
+        event[name] = event.get(name,0) + value
+
+    def addEvents(self,name,values):
+        '''
+        Adds per-event values to a metric of the last len(values) events, e.g. the counters of the jets of
+        a batch reconstructed at once (new events are started if there are fewer).
+        Parameters:
+        @name: name of the metric;
+        @values: list or np.array of shape (nEvents,), the values to be added, one per event;
+        '''
+        values = np.asarray(values).tolist()
+        while len(self.events) < len(values):
+            self.newEvent()
+        for event, value in zip(self.events[len(self.events)-len(values):],values):
+            event[name] = event.get(name,0) + value
+
+    def summary(self):
+        '''
+        Evaluates the statistics of each metric over the events (the events without a metric count as 0).
+        Returns:
+        @summary: dict with, for each metric, the number of events, the total, the mean, the standard
+            deviation, the minimum, the maximum and the percentiles;
+        '''
+        names = sorted({name for event in self.events for name in event})
+        summary = {}
+        for name in names:
+            values = np.array([event.get(name,0) for event in self.events],dtype=float)
+            statistics = {"events": len(values), "total": float(np.sum(values)), "mean": float(np.mean(values)),
+                          "std": float(np.std(values)), "min": float(np.min(values)), "max": float(np.max(values))}
+            for q, value in zip(self.percentiles,np.percentile(values,self.percentiles)):
+                statistics["p"+str(q)] = float(value)
+            summary[name] = statistics
+        return summary
+
+    def slowest(self,name="totalTime",n=10):
+        '''
+        Returns the events with the largest values of a metric, e.g. the events out of the latency budget.
+        Parameters:
+        @name: name of the metric;
+        @n: number of events;
+        Returns:
+        @indices: list of the indices of the events, from the largest value;
+        @events: list of dict, the metrics of the events;
+        '''
+        values = np.array([event.get(name,0) for event in self.events],dtype=float)
+        indices = [int(i) for i in np.argsort(-values,kind="stable")[:n]]
+        return indices, [self.events[i] for i in indices]
+
+    def text(self):
+        '''
+        Formats the summary as a table.
+        Returns:
+        @text: str;
+        '''
+        columns = ["events","mean","std","min","max"] + ["p"+str(q) for q in self.percentiles]
+        lines = ["%-20s" % "metric" + "".join("%12s" % column for column in columns)]
+        for name, statistics in self.summary().items():
+            lines.append("%-20s" % name + "".join("%12.4g" % statistics[column] for column in columns))
+        return "\n".join(lines)
+
+    def json(self):
+        '''
+        Formats the summary and the per-event metrics in JSON format.
+        Returns:
+        @json: str;
+        '''
+        return json.dumps({"summary": self.summary(), "events": self.events},indent=2)
+
+    def reset(self):
+        '''
+        Removes all of the events.
+        '''
+        self.events = []
@@ -1,41 +1,233 @@
 import numpy as np
-import math as m
-from matplotlib import pyplot as plt
-#import plotly.express as px
-#import plotly.graph_objects as go
 from modules.Track import Track
+from modules.TrackCollection import TrackCollection
+from modules.JetCache import JetCache
 
 class Jet:
     '''
     Class that implements the representation of a jet event, with PV and SV and tracks originating from both points,
-    and pileup tracks.
+    and pileup tracks. The tracks are stored either as three lists of Track instances, or in columnar form
+    (fromArrays): the origins and the versors of all of the tracks in two contiguous arrays, ordered by truth
+    category, with a category column. Columnar jets build the lists of Track instances only when they are
+    accessed (the tracks are views of the arrays), and share a single TrackCollection of all of their tracks.
     Public Members:
     @self.PV: array of shape (3,), jet's primary vertex coordinates;
     @self.SV: array of shape (3,), jet's secondary vertex coordinates;
     @self.tracksPV: list of Track instances, tracks originating from the PV;
     @self.tracksSV: list of Track instances, tracks originating from the SV;
     @self.tracksPileup: list of Track instances, tracks belonging to pileup events;
+    @self.origins: np.array of shape (nTracks,3), origins of the tracks in the order PV, SV, pileup
+        (None if the tracks are stored as lists);
+    @self.versors: np.array of shape (nTracks,3), versors of the tracks (None if the tracks are stored as lists);
+    @self.categories: np.array of shape (nTracks,), truth category of each track (None if the tracks are
+        stored as lists);
+    @self.cache: JetCache instance, the quantities derived from the tracks shared by the algorithms run on
+        the jet (None, default: no cache);
     @self.thetaMaxJet: maximum jet aperture [rad];
     @self.colors: list of colors for the coupled tracks;
+    @self.categoryPV, self.categorySV, self.categoryPileup: truth category labels of the tracks;
 
     Public Methods:
+    @fromArrays(PV,SV,origins,versors,categories): returns Jet, builds a columnar jet;
+    @collection(category): returns TrackCollection, the tracks of a category or all of the tracks
+        (PV, SV and pileup, in this order);
+    @trackCategories(): returns np.array of shape (nTracks,), the truth category of each track;
+    @enableCache(): returns JetCache, enables the cache of the quantities derived from the tracks;
+    @disableCache(): disables the cache;
+    @invalidateCache(): empties the cache, to be called after the tracks are modified;
     @print(): prints the event details: PV and SV coordinates, and tracks details;
-    @draw(): draws the event in a matplotlib figure: if parameters "couples" and "fittedTracks" 
+    @draw(): draws the event in a matplotlib figure (JetDisplay): if parameters "couples" and "fittedTracks"
         are not specified it only draws the event; if they are specified, it also draws the 
         event with coupled tracks and the fitted vertex and fitted tracks;
+
+    Private Methods:
+    @__bounds(category): returns the first and the last+1 indices of the tracks of a category in the columns;
+    @__categoryTracks(category): returns the list of Track instances of a category;
+    @__setTracks(category,tracks): replaces the tracks of a category with a list of Track instances;
     '''
 
     # jets' cone maximum aperture [rad]
     thetaMaxJet = 0.4
     colors = ["blue","orange","green","red","purple","brown","pink","gray","olive","cyan"]
+    # tracks' truth categories
+    categoryPV = 0
+    categorySV = 1
+    categoryPileup = 2
 
     # Constructor
     def __init__(self, PV = [], SV = [], tracksPV = [], tracksSV = [], tracksPileup = []):
         self.PV = np.asarray(PV)
         self.SV = np.asarray(SV)
-        self.tracksPV = tracksPV
-        self.tracksSV = tracksSV
-        self.tracksPileup = tracksPileup
+        self.origins = None
+        self.versors = None
+        self.categories = None
+        self.cache = None
+        # Lists of Track instances of each category (None: not built yet from the columns)
+        self.__tracks = [tracksPV, tracksSV, tracksPileup]
+        # TrackCollection of all of the tracks of a columnar jet (or of a jet with cache)
+        self.__collection = None
+
+    @classmethod
+    def fromArrays(cls, PV, SV, origins, versors, categories):
+        '''
+        Builds a jet with columnar storage of the tracks. The arrays are not copied (e.g. they can be views
+        of the arrays of a JetBatch) if they are already ordered by category.
+        Parameters:
+        @PV: array of shape (3,), jet's primary vertex coordinates;
+        @SV: array of shape (3,), jet's secondary vertex coordinates;
+        @origins: np.array of shape (nTracks,3), origins of the tracks;
+        @versors: np.array of shape (nTracks,3), versors of the tracks;
+        @categories: np.array of shape (nTracks,), truth category of each track;
+        Returns:
+        @jet: instance of Jet;
+        '''
+        origins = np.ascontiguousarray(origins,dtype=float).reshape(-1,3)
+        versors = np.ascontiguousarray(versors,dtype=float).reshape(-1,3)
+        categories = np.asarray(categories)
+        if np.any(np.diff(categories)<0):
+            order = np.argsort(categories,kind="stable")
+            origins, versors, categories = origins[order], versors[order], categories[order]
+        jet = cls(PV,SV)
+        jet.origins = origins
+        jet.versors = versors
+        jet.categories = categories
+        jet.__tracks = [None,None,None]
+        return jet
+
+    def __bounds(self,category):
+        '''
+        Finds the tracks of a category in the columns.
+        Parameters:
+        @category: truth category;
+        Returns:
+        @start, stop: the tracks of the category are the rows start:stop of the columns;
+        '''
+        start, stop = np.searchsorted(self.categories,[category,category+1])
+        return int(start), int(stop)
+
+    def __categoryTracks(self,category):
+        '''
+        Returns the tracks of a category, building them (as views of the columns) at the first access.
+        Parameters:
+        @category: truth category;
+        Returns:
+        @tracks: list of Track instances;
+        '''
+        if self.__tracks[category] is None:
+            start, stop = self.__bounds(category)
+            self.__tracks[category] = [Track(self.origins[i],self.versors[i]) for i in range(start,stop)]
+        return self.__tracks[category]
+
+    def __setTracks(self,category,tracks):
+        '''
+        Replaces the tracks of a category: a columnar jet is converted to lists of Track instances,
+        and the cache is emptied.
+        Parameters:
+        @category: truth category;
+        @tracks: list of Track instances;
+        '''
+        if self.origins is not None:
+            self.__tracks = [self.__categoryTracks(c) for c in range(3)]
+            self.origins = self.versors = self.categories = None
+        self.__collection = None
+        if self.cache is not None:
+            self.cache.invalidate()
+        self.__tracks[category] = tracks
+
+    @property
+    def tracksPV(self):
+        return self.__categoryTracks(self.categoryPV)
+
+    @tracksPV.setter
+    def tracksPV(self, tracks):
+        self.__setTracks(self.categoryPV,tracks)
+
+    @property
+    def tracksSV(self):
+        return self.__categoryTracks(self.categorySV)
+
+    @tracksSV.setter
+    def tracksSV(self, tracks):
+        self.__setTracks(self.categorySV,tracks)
+
+    @property
+    def tracksPileup(self):
+        return self.__categoryTracks(self.categoryPileup)
+
+    @tracksPileup.setter
+    def tracksPileup(self, tracks):
+        self.__setTracks(self.categoryPileup,tracks)
+
+    def collection(self,category=None):
+        '''
+        Returns the tracks of the jet as a TrackCollection. For a columnar jet the arrays of the collection
+        are views of the columns, and the collection of all of the tracks is built once and shared by all of
+        its users (e.g. the reconstruction algorithms); otherwise it is built from the lists at each call,
+        unless the cache is enabled. The collection of all of the tracks carries the jet's cache.
+        In both cases the tracks of the collection (TrackCollection.track) are the Track instances of the
+        jet's lists, so that the tracks returned by the algorithms can be compared with the truth lists.
+        Parameters:
+        @category: truth category of the tracks, None for all of the tracks (PV, SV and pileup, in this order);
+        Returns:
+        @tracks: instance of TrackCollection;
+        '''
+        if category is None:
+            collection = self.__collection
+            if collection is None:
+                if self.origins is None:
+                    collection = TrackCollection.fromTracks(self.tracksPV + self.tracksSV + self.tracksPileup)
+                else:
+                    collection = TrackCollection(self.origins,self.versors,
+                                                 self.tracksPV + self.tracksSV + self.tracksPileup)
+                if self.origins is not None or self.cache is not None:
+                    self.__collection = collection
+            collection.cache = self.cache
+            return collection
+        if self.origins is None:
+            return TrackCollection.fromTracks(self.__tracks[category])
+        start, stop = self.__bounds(category)
+        return TrackCollection(self.origins[start:stop],self.versors[start:stop],self.__categoryTracks(category))
+
+    def enableCache(self):
+        '''
+        Enables the cache of the quantities derived from the tracks (see JetCache): the algorithms run on
+        the jet evaluate each of them only once. The cache is emptied when the lists of tracks are replaced;
+        if the tracks are modified in place, invalidateCache must be called.
+        Returns:
+        @cache: instance of JetCache;
+        '''
+        if self.cache is None:
+            self.cache = JetCache()
+        return self.cache
+
+    def disableCache(self):
+        '''
+        Disables the cache of the quantities derived from the tracks, removing the cached quantities.
+        '''
+        self.cache = None
+        if self.origins is None:
+            self.__collection = None
+
+    def invalidateCache(self):
+        '''
+        Empties the cache of the quantities derived from the tracks: to be called after the tracks
+        (or their Track instances) are modified.
+        '''
+        if self.cache is not None:
+            self.cache.invalidate()
+        if self.origins is None:
+            self.__collection = None
+
+    def trackCategories(self):
+        '''
+        Returns the truth category of each track, in the order PV, SV, pileup.
+        Returns:
+        @categories: np.array of shape (nTracks,);
+        '''
+        if self.categories is not None:
+            return self.categories
+        return np.repeat(np.array([self.categoryPV,self.categorySV,self.categoryPileup],dtype=np.int8),
+                         [len(self.tracksPV),len(self.tracksSV),len(self.tracksPileup)])
 
     def print(self):
         '''Prints the event details: PV and SV coordinates, and tracks details;'''
@@ -55,253 +247,16 @@ class Jet:
 
     def draw(self, couples = [], fittedSV = [], fittedTracks = [], drawJetCone = False, plotly = False):
         '''
-        Draws the event in a matplotlib figure: if parameters "couples" and "fittedTracks" 
-        are not specified it only draws the event; if they are specified, it also draws the 
-        event with coupled tracks and the fitted vertex and fitted tracks.
+        Draws the event in a matplotlib figure with JetDisplay (imported here, so that matplotlib is
+        imported only when drawing): if parameters "couples" and "fittedTracks" are not specified it
+        only draws the event; if they are specified, it also draws the event with coupled tracks and
+        the fitted vertex and fitted tracks.
         Parameters:
         @couples: list of lists of Track instances, result of ssvf.vertexFinder;
         @fittedSV: np.array of shape (3,), fitted SV result of ssvf.vertexFitter;
         @fittedTracks: list of Track instances, SV tracks selected in the fit result of ssvf.vertexFitter;
         @drawJetCone: enables/disables the drawing of the cone of maximum aperture of the jet;
+        @plotly: if True, the fitted SV and the fitted tracks are also drawn in a plotly figure;
         '''
-
-        # If jet has been fed to vertex finder
-        if couples != []:
-            fig = plt.figure()
-            ax = fig.add_subplot(1,3,1,projection='3d')
-            # Draw PV and SV
-            ax.scatter(self.PV[0],self.PV[1],self.PV[2],color='blue',label='PV')
-            ax.scatter(self.SV[0],self.SV[1],self.SV[2],color='red',label='SV')
-            # Draw PV's tracks
-            label=False
-            for track in self.tracksPV:
-                points = []
-                for t in np.linspace(0,20,10):
-                    points.append(track.evaluate(t))
-                points = np.asarray(points)
-                if not label:
-                    ax.plot(points[:,0],points[:,1],points[:,2],color='orange',label="PV tracks")
-                    label = True
-                else:
-                    ax.plot(points[:,0],points[:,1],points[:,2],color='orange')
-            
-            # Draw SV's tracks
-            label = False
-            for track in self.tracksSV:
-                points = []
-                for t in np.linspace(0,20,10):
-                    points.append(track.evaluate(t))
-                points = np.asarray(points)
-                if not label:
-                    ax.plot(points[:,0],points[:,1],points[:,2],color='green',label="SV tracks")
-                    label=True
-                else:
-                    ax.plot(points[:,0],points[:,1],points[:,2],color='green')
-            
-            # Draw pileup tracks
-            label = False
-            for track in self.tracksPileup:
-                points = []
-                for t in np.linspace(-20,20,10):
-                    points.append(track.evaluate(t))
-                points = np.asarray(points)
-                if not label:
-                    ax.plot(points[:,0],points[:,1],points[:,2],color='black',label="pile-up")
-                    label=True
-                else:
-                    ax.plot(points[:,0],points[:,1],points[:,2],color='black')
-            
-            # Draw B-meson flight
-            ax.plot(np.row_stack((self.PV,self.SV))[:,0],np.row_stack((self.PV,self.SV))[:,1],np.row_stack((self.PV,self.SV))[:,2],color="gray",linestyle="dashed",label="B meson")
-            
-            # If enabled, draw jet's cone
-            if drawJetCone:
-                u, v = np.mgrid[0:2*m.pi:100j, 0:m.pi:80j]
-                x = 10*np.cos(u)*np.sin(v)
-                y = 10*np.sin(u)*np.sin(v)
-                z = np.sqrt(x**2 + y**2)/m.tan(self.thetaMaxJet)
-                ax.plot_surface(x, y, z,alpha = 0.1)
-            
-            # legend and axis labels
-            plt.legend(loc='best')
-            plt.title("Jet Event Display")
-            ax.set_xlabel("x [mm]")
-            ax.set_ylabel("y [mm]")
-            ax.set_zlabel("z [mm]")
-
-            # plotting coupled tracks
-            ax = fig.add_subplot(1,3,2,projection='3d')
-            # Draw PV and SV
-            ax.scatter(self.PV[0],self.PV[1],self.PV[2],color='blue',label='PV')
-            ax.scatter(self.SV[0],self.SV[1],self.SV[2],color='red',label='SV')
-            
-            # draw coupled tracks
-            for i,c in enumerate(couples):
-                label = False
-                for track in c:
-                    points = []
-                    for t in np.linspace(0,20,10):
-                        points.append(track.evaluate(t))
-                    points = np.asarray(points)
-                    if not label:
-                        labelStr = "couple: " + str(i)
-                        ax.plot(points[:,0],points[:,1],points[:,2],color=self.colors[i],label=labelStr)
-                        label = True
-                    else:
-                        ax.plot(points[:,0],points[:,1],points[:,2],color=self.colors[i])
-            
-            # Draw B-meson flight
-            ax.plot(np.row_stack((self.PV,self.SV))[:,0],np.row_stack((self.PV,self.SV))[:,1],np.row_stack((self.PV,self.SV))[:,2],color="gray",linestyle="dashed",label="B meson")
-            
-            # If enabled, draw jet's cone
-            if drawJetCone:
-                u, v = np.mgrid[0:2*m.pi:100j, 0:m.pi:80j]
-                x = 10*np.cos(u)*np.sin(v)
-                y = 10*np.sin(u)*np.sin(v)
-                z = np.sqrt(x**2 + y**2)/m.tan(self.thetaMaxJet)
-                ax.plot_surface(x, y, z,alpha = 0.1)
-            
-            # legend and axis labels
-            plt.legend(loc='best')
-            plt.title("After Vertex Finding")
-            ax.set_xlabel("x [mm]")
-            ax.set_ylabel("y [mm]")
-            ax.set_zlabel("z [mm]")
-
-            # If jet has been fed to vertex fitter
-            if fittedTracks != []:
-                ax = fig.add_subplot(1,3,3,projection='3d')
-                # Draw PV and SV
-                ax.scatter(self.PV[0],self.PV[1],self.PV[2],color='blue',label='PV')
-                ax.scatter(self.SV[0],self.SV[1],self.SV[2],color='red',label='SV')
-                # Draw fitted Vertex
-                ax.scatter(fittedSV[0],fittedSV[1],fittedSV[2],color='orange',label='Fitted SV')
-                # Draw B-meson flight
-                ax.plot(np.row_stack((self.PV,self.SV))[:,0],np.row_stack((self.PV,self.SV))[:,1],np.row_stack((self.PV,self.SV))[:,2],color="gray",linestyle="dashed",label="B meson")
-                
-                # Draw fitted tracks
-                label = False
-                for track in fittedTracks:
-                    points = []
-                    for t in np.linspace(0,20,10):
-                        points.append(track.evaluate(t))
-                    points = np.asarray(points)
-                    if not label:
-                        ax.plot(points[:,0],points[:,1],points[:,2],color='orange',label="Tracks selected\n$\chi^2<\chi^2_{threshold}$")
-                        label = True
-                    else:
-                        ax.plot(points[:,0],points[:,1],points[:,2],color='orange')
-                # If enabled, draw jet's cone
-                if drawJetCone:
-                    u, v = np.mgrid[0:2*m.pi:100j, 0:m.pi:80j]
-                    x = 10*np.cos(u)*np.sin(v)
-                    y = 10*np.sin(u)*np.sin(v)
-                    z = np.sqrt(x**2 + y**2)/m.tan(self.thetaMaxJet)
-                    ax.plot_surface(x, y, z,alpha = 0.1)
-                # legend and axis labels
-                plt.legend(loc='best')
-                plt.title("After Vertex Fitting")
-                ax.set_xlabel("x [mm]")
-                ax.set_ylabel("y [mm]")
-                ax.set_zlabel("z [mm]")
-            
-            # If plotly, make plot
-            if plotly:
-                # Drawing PV,SV,fittedSV
-                points = np.row_stack((self.PV,self.SV,fittedSV))
-                colorsPlotly = ["blue","red","orange"]
-                fig = go.Figure(go.Scatter3d(
-                        x = points[:,0], y = points[:,1], z = points[:,2],
-                        marker=dict(
-                            size=2,
-                            color=colorsPlotly
-                        ),
-                            line=dict(
-                            color='grey',
-                            width=2
-                        ),
-                    )
-                )
-
-                # Drawing only fitted tracks
-                for track in fittedTracks:
-                    points = []
-                    for t in np.linspace(0,20,10):
-                        points.append(track.evaluate(t))
-                    points = np.asarray(points)
-                    fig.add_trace(
-                            go.Scatter3d(
-                            x = points[:,0], y = points[:,1], z = points[:,2],
-                            marker=dict(
-                                size=0.1,
-                            ),
-                            line=dict(
-                                color='darkblue',
-                                width=2,
-                            ),
-                        )
-                    )
-                fig.show()
-    
-        # If jet has not been fed in SSVF algorithms
-        else:
-            fig = plt.figure()
-            ax = fig.add_subplot(projection='3d')
-            # Draw PV and SV
-            ax.scatter(self.PV[0],self.PV[1],self.PV[2],color='blue',label='PV')
-            ax.scatter(self.SV[0],self.SV[1],self.SV[2],color='red',label='SV')
-            # Draw PV's tracks
-            label=False
-            for track in self.tracksPV:
-                points = []
-                for t in np.linspace(0,20,10):
-                    points.append(track.evaluate(t))
-                points = np.asarray(points)
-                if not label:
-                    ax.plot(points[:,0],points[:,1],points[:,2],color='orange',label="PV tracks")
-                    label = True
-                else:
-                    ax.plot(points[:,0],points[:,1],points[:,2],color='orange')
-            
-            # Draw SV's tracks
-            label = False
-            for track in self.tracksSV:
-                points = []
-                for t in np.linspace(0,20,10):
-                    points.append(track.evaluate(t))
-                points = np.asarray(points)
-                if not label:
-                    ax.plot(points[:,0],points[:,1],points[:,2],color='green',label="SV tracks")
-                    label=True
-                else:
-                    ax.plot(points[:,0],points[:,1],points[:,2],color='green')
-            
-            # Draw pileup tracks
-            label = False
-            for track in self.tracksPileup:
-                points = []
-                for t in np.linspace(-10,20,10):
-                    points.append(track.evaluate(t))
-                points = np.asarray(points)
-                if not label:
-                    ax.plot(points[:,0],points[:,1],points[:,2],color='black',label="pile-up")
-                    label=True
-                else:
-                    ax.plot(points[:,0],points[:,1],points[:,2],color='black')
-            
-            # Draw B-meson flight
-            ax.plot(np.row_stack((self.PV,self.SV))[:,0],np.row_stack((self.PV,self.SV))[:,1],np.row_stack((self.PV,self.SV))[:,2],color="gray",linestyle="dashed",label="B meson")
-            
-            # If enabled, draw jet's cone
-            if drawJetCone:
-                u, v = np.mgrid[0:2*m.pi:100j, 0:m.pi:80j]
-                x = 10*np.cos(u)*np.sin(v)
-                y = 10*np.sin(u)*np.sin(v)
-                z = np.sqrt(x**2 + y**2)/m.tan(self.thetaMaxJet)
-                ax.plot_surface(x, y, z,alpha = 0.1)
-            # legend and axis labels
-            plt.legend(loc='best')
-            plt.title("Jet Event Display")
-            ax.set_xlabel("x [mm]")
-            ax.set_ylabel("y [mm]")
-            ax.set_zlabel("z [mm]")
\ No newline at end of file
+        from modules.JetDisplay import JetDisplay
+        JetDisplay(self).draw(couples,fittedSV,fittedTracks,drawJetCone,plotly)
@@ -0,0 +1,193 @@
+import numpy as np
+from modules.Jet import Jet
+from modules.TrackCollection import TrackCollection
+
+class JetBatch:
+    '''
+    Class that implements a batch of jets stored as flat track arrays with per-jet offsets (CSR layout):
+    the tracks of jet b are the rows offsets[b]:offsets[b+1] of the track arrays, in the order PV, SV, pileup.
+    Public Members:
+    @self.origins: np.array of shape (nTracks,3), origins of the tracks of all of the jets;
+    @self.versors: np.array of shape (nTracks,3), versors of the tracks of all of the jets;
+    @self.categories: np.array of shape (nTracks,), truth category of each track (Jet.categoryPV,
+        Jet.categorySV or Jet.categoryPileup);
+    @self.offsets: np.array of shape (nJets+1,), offsets of the jets' tracks in the track arrays;
+    @self.PV: np.array of shape (nJets,3), jets' primary vertices;
+    @self.SV: np.array of shape (nJets,3), jets' secondary vertices;
+
+    Public Methods:
+    @fromJets(jets): returns JetBatch, builds the batch from a list of Jet instances;
+    @concatenate(batches): returns JetBatch, joins a list of batches;
+    @nTracks(): returns np.array of shape (nJets,), the number of tracks of each jet;
+    @tracks(b): returns TrackCollection, the tracks of the b-th jet (views of the batch arrays);
+    @jet(b): returns Jet, the b-th jet;
+    @jets(): returns the list of all of the jets as Jet instances;
+    @slice(start,stop): returns JetBatch, the batch of the jets in [start,stop);
+    @padded(): returns the tracks in padded arrays of shape (nJets,maxTracks,...) and the padding mask;
+    @distanceMatrices(): returns np.array of shape (nJets,maxTracks,maxTracks), the per-jet
+        track-track distance matrices;
+    '''
+
+    # Constructor
+    def __init__(self, origins, versors, categories, offsets, PV, SV):
+        '''
+        Constructor of the class.
+        Parameters:
+        @origins: np.array of shape (nTracks,3), origins of the tracks;
+        @versors: np.array of shape (nTracks,3), versors of the tracks, normalized if they are not unit vectors;
+        @categories: np.array of shape (nTracks,), truth category of each track;
+        @offsets: np.array of shape (nJets+1,), offsets of the jets' tracks;
+        @PV: np.array of shape (nJets,3), jets' primary vertices;
+        @SV: np.array of shape (nJets,3), jets' secondary vertices;
+        '''
+        self.origins = np.asarray(origins)
+        self.versors = TrackCollection.unitVersors(np.asarray(versors,dtype=float).reshape(-1,3))
+        self.categories = np.asarray(categories)
+        self.offsets = np.asarray(offsets)
+        self.PV = np.asarray(PV)
+        self.SV = np.asarray(SV)
+        self.__padded = None
+
+    @classmethod
+    def fromJets(cls, jets):
+        '''
+        Builds the batch from a list of jets.
+        Parameters:
+        @jets: list of Jet instances;
+        Returns:
+        @batch: instance of JetBatch;
+        '''
+        collections = [jet.collection() for jet in jets]
+        offsets = np.zeros(len(jets)+1,dtype=np.int64)
+        offsets[1:] = np.cumsum([len(collection) for collection in collections])
+        PV = np.array([jet.PV for jet in jets],dtype=float).reshape(-1,3)
+        SV = np.array([jet.SV for jet in jets],dtype=float).reshape(-1,3)
+        if len(jets) == 0:
+            return cls(np.empty((0,3)),np.empty((0,3)),np.empty(0,dtype=np.int8),offsets,PV,SV)
+        return cls(np.concatenate([collection.origins for collection in collections]),
+                   np.concatenate([collection.versors for collection in collections]),
+                   np.concatenate([jet.trackCategories() for jet in jets]).astype(np.int8),offsets,PV,SV)
+
+    @classmethod
+    def concatenate(cls, batches):
+        '''
+        Joins a list of batches in a single batch.
+        Parameters:
+        @batches: list of JetBatch instances;
+        Returns:
+        @batch: instance of JetBatch;
+        '''
+        if len(batches) == 0:
+            return cls(np.empty((0,3)),np.empty((0,3)),np.empty(0,dtype=np.int8),np.zeros(1,dtype=np.int64),
+                       np.empty((0,3)),np.empty((0,3)))
+        offsets = [np.zeros(1,dtype=np.int64)]
+        for batch in batches:
+            offsets.append(batch.offsets[1:]-batch.offsets[0]+offsets[-1][-1])
+        return cls(np.concatenate([batch.origins for batch in batches]),
+                   np.concatenate([batch.versors for batch in batches]),
+                   np.concatenate([batch.categories for batch in batches]),
+                   np.concatenate(offsets),
+                   np.concatenate([batch.PV for batch in batches]),
+                   np.concatenate([batch.SV for batch in batches]))
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def nTracks(self):
+        '''
+        Returns the number of tracks of each jet.
+        Returns:
+        @nTracks: np.array of shape (nJets,);
+        '''
+        return np.diff(self.offsets)
+
+    def tracks(self, b):
+        '''
+        Returns the tracks of the b-th jet, as views of the batch arrays.
+        Parameters:
+        @b: index of the jet;
+        Returns:
+        @tracks: instance of TrackCollection;
+        '''
+        start, stop = self.offsets[b], self.offsets[b+1]
+        return TrackCollection(self.origins[start:stop],self.versors[start:stop])
+
+    def jet(self, b):
+        '''
+        Builds the b-th jet, in columnar form: its arrays are views of the batch arrays.
+        Parameters:
+        @b: index of the jet;
+        Returns:
+        @jet: instance of Jet;
+        '''
+        start, stop = self.offsets[b], self.offsets[b+1]
+        return Jet.fromArrays(self.PV[b],self.SV[b],self.origins[start:stop],self.versors[start:stop],
+                              self.categories[start:stop])
+
+    def jets(self):
+        '''
+        Builds all of the jets of the batch.
+        Returns:
+        @jets: list of Jet instances;
+        '''
+        return [self.jet(b) for b in range(len(self))]
+
+    def slice(self, start, stop):
+        '''
+        Returns the batch of the jets in [start,stop), whose arrays are views of the current ones.
+        Parameters:
+        @start: index of the first jet;
+        @stop: index after the last jet;
+        Returns:
+        @batch: instance of JetBatch;
+        '''
+        offsets = self.offsets[start:stop+1]
+        first, last = offsets[0], offsets[-1]
+        return JetBatch(self.origins[first:last],self.versors[first:last],self.categories[first:last],
+                        offsets-first,self.PV[start:stop],self.SV[start:stop])
+
+    def padded(self):
+        '''
+        Returns the tracks of the jets in padded arrays: row b contains the tracks of the b-th jet,
+        followed by padding up to the maximum number of tracks per jet.
+        Returns:
+        @origins: np.array of shape (nJets,maxTracks,3);
+        @versors: np.array of shape (nJets,maxTracks,3);
+        @mask: np.array of shape (nJets,maxTracks) of bool, False on the padding;
+        '''
+        if self.__padded is None:
+            nTracks = self.nTracks()
+            maxTracks = int(np.max(nTracks)) if len(self)>0 else 0
+            rows = np.repeat(np.arange(len(self)),nTracks)
+            columns = np.arange(self.offsets[-1]-self.offsets[0]) - np.repeat(self.offsets[:-1]-self.offsets[0],nTracks)
+            origins = np.zeros((len(self),maxTracks,3))
+            # padding versors are valid unit vectors, so that padded kernels stay finite
+            versors = np.zeros((len(self),maxTracks,3))
+            versors[...,2] = 1.
+            mask = np.zeros((len(self),maxTracks),dtype=bool)
+            origins[rows,columns] = self.origins
+            versors[rows,columns] = self.versors
+            mask[rows,columns] = True
+            self.__padded = (origins,versors,mask)
+        return self.__padded
+
+    def distanceMatrices(self):
+        '''
+        Evaluates the track-track distance matrices of all of the jets, with the definition of
+        Track.trackDistance: entry (b,i,j) is the distance of track i from track j of the b-th jet.
+        Entries involving padding are set to np.inf.
+        Returns:
+        @distances: np.array of shape (nJets,maxTracks,maxTracks);
+        '''
+        origins, versors, mask = self.padded()
+        # Components of origin_i×versor_j - moment_j, with the moments origin_j×versor_j
+        moments = np.cross(origins,versors)
+        Ox, Oy, Oz = (origins[:,:,None,c] for c in range(3))
+        Vx, Vy, Vz = (versors[:,None,:,c] for c in range(3))
+        Mx, My, Mz = (moments[:,None,:,c] for c in range(3))
+        Wx = Oy*Vz - Oz*Vy - Mx
+        Wy = Oz*Vx - Ox*Vz - My
+        Wz = Ox*Vy - Oy*Vx - Mz
+        distances = np.sqrt(Wx*Wx + Wy*Wy + Wz*Wz)
+        distances[~(mask[:,:,None] & mask[:,None,:])] = np.inf
+        return distances
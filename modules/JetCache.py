@@ -0,0 +1,65 @@
+import numpy as np
+
+class JetCache:
+    '''
+    Class that implements the memoization of the quantities derived from a jet's tracks (e.g. the track-track
+    distance matrix, the clustering features and the impact parameters), so that several algorithms, or
+    configurations of an algorithm, run on the same event evaluate each of them only once.
+    The cache is enabled on a jet with Jet.enableCache, and it is consulted by the algorithms through the
+    jet's TrackCollection (TrackCollection.cached). The cache does not know when the tracks change: it must
+    be invalidated explicitly (Jet.invalidateCache) after the tracks of the jet are modified.
+    The cached arrays are read-only, so that the users cannot modify them by mistake.
+    Public Members:
+    @self.values: dict, the cached quantities by name;
+    @self.hits: number of requests answered by the cache;
+    @self.misses: number of requests that evaluated the quantity;
+
+    Public Methods:
+    @get(name,compute): returns the cached quantity name, evaluating it with compute() at the first request;
+    @invalidate(name): removes a quantity (all of them if name is None) from the cache;
+    @stats(): returns dict, the counters of the cache;
+    '''
+
+    # Constructor
+    def __init__(self):
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self,name,compute):
+        '''
+        Returns a cached quantity, evaluating it at the first request.
+        Parameters:
+        @name: name of the quantity;
+        @compute: function without parameters that evaluates the quantity;
+        Returns:
+        @value: the quantity (np.array are returned read-only);
+        '''
+        if name in self.values:
+            self.hits += 1
+            return self.values[name]
+        self.misses += 1
+        value = compute()
+        if isinstance(value,np.ndarray):
+            value.flags.writeable = False
+        self.values[name] = value
+        return value
+
+    def invalidate(self,name=None):
+        '''
+        Removes a quantity from the cache.
+        Parameters:
+        @name: name of the quantity, None to remove all of them;
+        '''
+        if name is None:
+            self.values.clear()
+        else:
+            self.values.pop(name,None)
+
+    def stats(self):
+        '''
+        Returns the counters of the cache.
+        Returns:
+        @stats: dict with the numbers of cached quantities, hits and misses;
+        '''
+        return {"quantities": len(self.values), "hits": self.hits, "misses": self.misses}
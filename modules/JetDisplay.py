@@ -0,0 +1,184 @@
+import numpy as np
+import math as m
+
+class JetDisplay:
+    '''
+    Class that implements the event display of a jet, with matplotlib (and plotly for the fitted tracks).
+    matplotlib and plotly are imported only when something is drawn, so that the reconstruction modules
+    can be imported without them.
+    Public Members:
+    @self.jet: instance of Jet, the event to be drawn;
+
+    Public Methods:
+    @draw(): draws the event in a matplotlib figure: if parameters "couples" and "fittedTracks"
+        are not specified it only draws the event; if they are specified, it also draws the
+        event with coupled tracks and the fitted vertex and fitted tracks;
+
+    Private Methods:
+    @__drawTracks(ax,tracks,tRange,color,label): draws the tracks as segments in the range of the parameter t;
+    @__drawVertices(ax): draws the PV and the SV;
+    @__drawFlight(ax): draws the B meson flight from the PV to the SV;
+    @__drawCone(ax): draws the cone of maximum aperture of the jet;
+    @__decorate(ax,plt,title): draws the legend, the title and the axis labels;
+    @__drawEvent(ax,tPileup,drawJetCone): draws the PV, SV and pileup tracks of the event;
+    @__drawPlotly(fittedSV,fittedTracks): draws the vertices and the fitted tracks in a plotly figure;
+    '''
+
+    # Constructor
+    def __init__(self, jet):
+        '''
+        Constructor of the class.
+        Parameters:
+        @jet: instance of Jet, the event to be drawn;
+        '''
+        self.jet = jet
+
+    def __drawTracks(self,ax,tracks,tRange,color,label=None):
+        '''
+        Draws the tracks as segments, with a single legend entry.
+        Parameters:
+        @ax: matplotlib 3d axes;
+        @tracks: list of Track instances;
+        @tRange: (tMin,tMax), range of the tracks' parameter t;
+        @color: color of the tracks;
+        @label: legend label of the tracks;
+        '''
+        for i,track in enumerate(tracks):
+            points = np.asarray([track.evaluate(t) for t in np.linspace(tRange[0],tRange[1],10)])
+            ax.plot(points[:,0],points[:,1],points[:,2],color=color,label=label if i==0 else None)
+
+    def __drawVertices(self,ax):
+        '''
+        Draws the PV and the SV.
+        Parameters:
+        @ax: matplotlib 3d axes;
+        '''
+        ax.scatter(self.jet.PV[0],self.jet.PV[1],self.jet.PV[2],color='blue',label='PV')
+        ax.scatter(self.jet.SV[0],self.jet.SV[1],self.jet.SV[2],color='red',label='SV')
+
+    def __drawFlight(self,ax):
+        '''
+        Draws the B meson flight from the PV to the SV.
+        Parameters:
+        @ax: matplotlib 3d axes;
+        '''
+        flight = np.vstack((self.jet.PV,self.jet.SV))
+        ax.plot(flight[:,0],flight[:,1],flight[:,2],color="gray",linestyle="dashed",label="B meson")
+
+    def __drawCone(self,ax):
+        '''
+        Draws the cone of maximum aperture of the jet.
+        Parameters:
+        @ax: matplotlib 3d axes;
+        '''
+        u, v = np.mgrid[0:2*m.pi:100j, 0:m.pi:80j]
+        x = 10*np.cos(u)*np.sin(v)
+        y = 10*np.sin(u)*np.sin(v)
+        z = np.sqrt(x**2 + y**2)/m.tan(self.jet.thetaMaxJet)
+        ax.plot_surface(x, y, z,alpha = 0.1)
+
+    def __decorate(self,ax,plt,title):
+        '''
+        Draws the legend, the title and the axis labels.
+        Parameters:
+        @ax: matplotlib 3d axes;
+        @plt: matplotlib.pyplot module;
+        @title: title of the plot;
+        '''
+        plt.legend(loc='best')
+        plt.title(title)
+        ax.set_xlabel("x [mm]")
+        ax.set_ylabel("y [mm]")
+        ax.set_zlabel("z [mm]")
+
+    def __drawEvent(self,ax,tPileup,drawJetCone):
+        '''
+        Draws the PV, SV and pileup tracks of the event, the vertices, the B meson flight and the jet's cone.
+        Parameters:
+        @ax: matplotlib 3d axes;
+        @tPileup: (tMin,tMax), range of the pileup tracks' parameter t;
+        @drawJetCone: enables/disables the drawing of the cone of maximum aperture of the jet;
+        '''
+        self.__drawVertices(ax)
+        self.__drawTracks(ax,self.jet.tracksPV,(0,20),'orange',"PV tracks")
+        self.__drawTracks(ax,self.jet.tracksSV,(0,20),'green',"SV tracks")
+        self.__drawTracks(ax,self.jet.tracksPileup,tPileup,'black',"pile-up")
+        self.__drawFlight(ax)
+        if drawJetCone:
+            self.__drawCone(ax)
+
+    def __drawPlotly(self,fittedSV,fittedTracks):
+        '''
+        Draws the PV, the SV, the fitted SV and the fitted tracks in a plotly figure.
+        Parameters:
+        @fittedSV: np.array of shape (3,), fitted SV;
+        @fittedTracks: list of Track instances, SV tracks selected in the fit;
+        '''
+        import plotly.graph_objects as go
+        # Drawing PV,SV,fittedSV
+        points = np.vstack((self.jet.PV,self.jet.SV,fittedSV))
+        colorsPlotly = ["blue","red","orange"]
+        fig = go.Figure(go.Scatter3d(x = points[:,0], y = points[:,1], z = points[:,2],
+                                     marker=dict(size=2,color=colorsPlotly),
+                                     line=dict(color='grey',width=2)))
+        # Drawing only fitted tracks
+        for track in fittedTracks:
+            points = np.asarray([track.evaluate(t) for t in np.linspace(0,20,10)])
+            fig.add_trace(go.Scatter3d(x = points[:,0], y = points[:,1], z = points[:,2],
+                                       marker=dict(size=0.1),
+                                       line=dict(color='darkblue',width=2)))
+        fig.show()
+
+    def draw(self, couples = [], fittedSV = [], fittedTracks = [], drawJetCone = False, plotly = False):
+        '''
+        Draws the event in a matplotlib figure: if parameters "couples" and "fittedTracks"
+        are not specified it only draws the event; if they are specified, it also draws the
+        event with coupled tracks and the fitted vertex and fitted tracks.
+        Parameters:
+        @couples: list of lists of Track instances, result of ssvf.vertexFinder;
+        @fittedSV: np.array of shape (3,), fitted SV result of ssvf.vertexFitter;
+        @fittedTracks: list of Track instances, SV tracks selected in the fit result of ssvf.vertexFitter;
+        @drawJetCone: enables/disables the drawing of the cone of maximum aperture of the jet;
+        @plotly: if True, the fitted SV and the fitted tracks are also drawn in a plotly figure;
+        '''
+        from matplotlib import pyplot as plt
+
+        # If jet has not been fed in SSVF algorithms
+        if couples == []:
+            fig = plt.figure()
+            ax = fig.add_subplot(projection='3d')
+            self.__drawEvent(ax,(-10,20),drawJetCone)
+            self.__decorate(ax,plt,"Jet Event Display")
+            return
+
+        # If jet has been fed to vertex finder
+        fig = plt.figure()
+        ax = fig.add_subplot(1,3,1,projection='3d')
+        self.__drawEvent(ax,(-20,20),drawJetCone)
+        self.__decorate(ax,plt,"Jet Event Display")
+
+        # plotting coupled tracks
+        ax = fig.add_subplot(1,3,2,projection='3d')
+        self.__drawVertices(ax)
+        for i,c in enumerate(couples):
+            self.__drawTracks(ax,c,(0,20),self.jet.colors[i],"couple: " + str(i))
+        self.__drawFlight(ax)
+        if drawJetCone:
+            self.__drawCone(ax)
+        self.__decorate(ax,plt,"After Vertex Finding")
+
+        # If jet has been fed to vertex fitter
+        if fittedTracks != []:
+            ax = fig.add_subplot(1,3,3,projection='3d')
+            self.__drawVertices(ax)
+            # Draw fitted Vertex
+            ax.scatter(fittedSV[0],fittedSV[1],fittedSV[2],color='orange',label='Fitted SV')
+            self.__drawFlight(ax)
+            self.__drawTracks(ax,fittedTracks,(0,20),'orange',"Tracks selected\n$\\chi^2<\\chi^2_{threshold}$")
+            if drawJetCone:
+                self.__drawCone(ax)
+            self.__decorate(ax,plt,"After Vertex Fitting")
+
+        # If plotly, make plot
+        if plotly:
+            self.__drawPlotly(fittedSV,fittedTracks)
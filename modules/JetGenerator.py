@@ -1,7 +1,7 @@
 import numpy as np
 import math as m
-from modules.Track import Track
 from modules.Jet import Jet
+from modules.JetBatch import JetBatch
 
 class JetGenerator:
     '''
@@ -17,9 +17,31 @@ class JetGenerator:
     @self.thetaMaxJet: maximum angle of aperture of the jet [rad];
     @self.sigmaCoord: smearing on the coordinates of the tracks [mm];
     @self.nTracksRange: width of the interval in which nTracks numbers are uniformly sampled;
+    @self.seed: entropy of the generator's np.random.SeedSequence (drawn from the OS if no seed is given);
+    @self.blockSize: number of events generated by each independent random stream;
 
     Public Methods:
+    Random numbers are drawn from np.random.Generator instances: the events are grouped in blocks of
+    blockSize events, and each random quantity q of block k (see streams) is drawn, in the order of the
+    events, from its own stream spawned from the seed with key (k,q). Event i is thus the same whatever
+    range, chunking or process it is generated in, and the first events of a block can be generated
+    without the others.
     @generate: returns list of nEvents jet, generates the jets;
+    @generateBatch(start,stop): returns JetBatch, generates the jets in [start,stop) (default: all of the
+        nEvents jets) at once in columnar form; the Jet instances are built only on request, with JetBatch.jet(i);
+    @iterBatches(chunkSize): yields JetBatch instances of at most chunkSize jets, until nEvents jets have 
+        been generated; only one chunk is held in memory at a time;
+    @iterJets(chunkSize): yields the nEvents jets one at a time as Jet instances, generating them in chunks;
+
+    Private Methods:
+    @__rng(block,quantity): returns np.random.Generator, the random stream of a quantity of a block of events;
+    @__generateBlock(block,nEvents): returns JetBatch, the first nEvents jets of a block;
+    @__generateRange(start,stop,held): returns JetBatch, the jets in [start,stop), reusing a block held
+        between the calls;
+    @__multiplicities(rng,nTracks,nEvents): returns the random numbers of tracks of a type of production;
+    @__versors(theta,phi): returns the versors of the given angles;
+    @__smearedTracks(block,production,vertices): returns the origins and versors of tracks produced in the
+        given vertices;
     '''
 
     # Physical constants
@@ -41,10 +63,15 @@ class JetGenerator:
     # width of the range of the per-vertex random number of tracks
     nTracksRange = 2
 
+    # number of events per block of independent random streams
+    blockSize = 1024
+    # random quantities of a block, each one drawn from its own stream
+    streams = ("nPV","nSV","nPileup","rSV","thetaSV","phiSV","smearingPV","thetaTracksPV","phiTracksPV",
+               "smearingSV","thetaTracksSV","phiTracksSV","phiPileup")
+
     # Constructor
     def __init__(self,nEvents=1, nTracksPV = 4, nTracksSV = 5, nTracksPileup = 3,seed = None):
-        if seed:
-            np.random.seed(seed)
+        self.seed = np.random.SeedSequence(seed).entropy
         self.nEvents = nEvents
         self.nTracksPV = nTracksPV
         self.nTracksSV = nTracksSV
@@ -56,93 +83,179 @@ class JetGenerator:
         Returns:
         @jets: list of nEvents Jet instances, the generated jets.
         '''
-        # Primary vertex is in the origin of the reference frame
-        PV = np.zeros(3)
-        jets = []
-        generatedEvents = 0
-        # Generation loop
-        while generatedEvents<self.nEvents:
-            # Random number of tracks per type of production
-            nPV = np.random.randint(self.nTracksPV-self.nTracksRange if self.nTracksPV>self.nTracksRange else 1, self.nTracksPV+self.nTracksRange)
-            nSV = np.random.randint(self.nTracksSV-self.nTracksRange if self.nTracksSV>self.nTracksRange else 1, self.nTracksSV+self.nTracksRange)
-            nPileup = np.random.randint(self.nTracksPileup-self.nTracksRange if self.nTracksPileup>self.nTracksRange else 1, self.nTracksPileup+self.nTracksRange)
-
-            # Random secondary vertex generation, spherical coordinates
-            # Random distance of the SV from the origin, normally distributed
-            rSV = self.flightLength  + np.random.normal(0,self.sigmaFlight)
-
-            # SV theta, normally distributed around 0
-            thetaSV = np.random.normal(0,self.sigmaTheta)
-            if thetaSV > self.thetaMaxSV:
-                thetaSV = 0.
-            
-            # SV phi, uniformly distributed in [0,2pi]
-            phiSV = np.random.uniform(0,2*m.pi)
-
-            # Conversion to cartesian coordinates
-            xSV = rSV*m.sin(thetaSV)*m.cos(phiSV)
-            ySV = rSV*m.sin(thetaSV)*m.sin(phiSV)
-            zSV = rSV*m.cos(thetaSV)
-            SV = np.asarray([xSV,ySV,zSV])
-
-            # generating PV tracks
-            tracksPV = []
-            generatedTracks = 0
-            while generatedTracks<nPV:
-                # generating track's origin starting from the origin of the sdr (the PV)
-                # and applying gaussian smearing
-                origin = np.zeros(3) + np.random.normal(0,self.sigmaCoord,3)
-                # Track's theta, normally distributed
-                theta = np.random.normal(0,self.sigmaTheta*2)
-                if theta>self.thetaMaxJet:
-                    theta = self.thetaMaxJet
-                # Track's phi, uniformly distributed in [0,2pi]
-                phi = np.random.uniform(0,2*m.pi)
-                # Building track's versor
-                versor = [m.sin(theta)*m.cos(phi),m.sin(theta)*m.sin(phi),m.cos(theta)]
-                # Adding track to the set
-                tracksPV.append(Track(origin,versor))
-                generatedTracks += 1
-            
-            # generating SV tracks
-            tracksSV = []
-            generatedTracks = 0
-            while generatedTracks<nSV:
-                # generating track's origin starting from the SV
-                # and applying gaussian smearing
-                origin = SV + np.random.normal(0,self.sigmaCoord,3)
-                # Track's theta, normally distributed
-                theta = np.random.normal(0,self.sigmaTheta*2)
-                if theta>self.thetaMaxJet:
-                    theta = self.thetaMaxJet
-                # Track's phi, uniformly distributed in [0,2pi]
-                phi = np.random.uniform(0,2*m.pi)
-                # Building track's versor
-                versor = [m.sin(theta)*m.cos(phi),m.sin(theta)*m.sin(phi),m.cos(theta)]
-                # Adding track to the set
-                tracksSV.append(Track(origin,versor))
-                generatedTracks += 1
-
-            # generating Pileup tracks
-            tracksPileup = []
-            generatedTracks = 0
-            while generatedTracks<nPileup:
-                # generating pileup tracks
-                z = 0.5*self.flightLength
-                theta = 0.5*self.thetaMaxJet
-                phi = np.random.uniform(0,2*m.pi)
-                # making sure pileup does not cross PV
-                r = (z+2)/m.cos(theta)
-                x = r*m.sin(theta)*m.cos(phi)
-                y = r*m.sin(theta)*m.sin(phi)
-                origin = [x,y,z]
-                versor = [m.sin(theta)*m.cos(phi),m.sin(theta)*m.sin(phi),m.cos(theta)]
-                # Adding track to the set
-                tracksPileup.append(Track(origin,versor))
-                generatedTracks += 1
-            # building event and storing it
-            jet = Jet(PV,SV,tracksPV,tracksSV,tracksPileup)
-            jets.append(jet)
-            generatedEvents += 1
-        
-        return jets
\ No newline at end of file
+        return self.generateBatch().jets()
+
+    def __rng(self,block,quantity):
+        '''
+        Returns the random stream of a quantity of a block of events, spawned from the generator's seed.
+        Parameters:
+        @block: index of the block;
+        @quantity: name of the random quantity, in streams;
+        Returns:
+        @rng: instance of np.random.Generator;
+        '''
+        return np.random.default_rng(np.random.SeedSequence(self.seed,spawn_key=(block,self.streams.index(quantity))))
+
+    def __multiplicities(self,rng,nTracks,nEvents):
+        '''
+        Draws the random numbers of tracks of a type of production, as in generate.
+        Parameters:
+        @rng: instance of np.random.Generator;
+        @nTracks: mean number of tracks;
+        @nEvents: number of events;
+        Returns:
+        @n: np.array of shape (nEvents,), the numbers of tracks per event;
+        '''
+        low = nTracks-self.nTracksRange if nTracks>self.nTracksRange else 1
+        return rng.integers(low, nTracks+self.nTracksRange, nEvents)
+
+    def __versors(self,theta,phi):
+        '''
+        Builds the versors of the given angles.
+        Parameters:
+        @theta: np.array of shape (n,), angles with the z axis;
+        @phi: np.array of shape (n,), azimuthal angles;
+        Returns:
+        @versors: np.array of shape (n,3);
+        '''
+        return np.column_stack((np.sin(theta)*np.cos(phi),np.sin(theta)*np.sin(phi),np.cos(theta)))
+
+    def __smearedTracks(self,block,production,vertices):
+        '''
+        Generates one track from each of the given vertices, as the PV and SV tracks of generate:
+        smeared origin, normally distributed theta (clipped at thetaMaxJet) and uniformly distributed phi.
+        Parameters:
+        @block: index of the block;
+        @production: "PV" or "SV", the streams of the tracks' quantities;
+        @vertices: np.array of shape (n,3), the production vertex of each track;
+        Returns:
+        @origins: np.array of shape (n,3);
+        @versors: np.array of shape (n,3);
+        '''
+        n = vertices.shape[0]
+        origins = vertices + self.__rng(block,"smearing"+production).normal(0,self.sigmaCoord,(n,3))
+        theta = np.minimum(self.__rng(block,"thetaTracks"+production).normal(0,self.sigmaTheta*2,n),self.thetaMaxJet)
+        phi = self.__rng(block,"phiTracks"+production).uniform(0,2*m.pi,n)
+        return origins, self.__versors(theta,phi)
+
+    def __generateBlock(self,block,nEvents=None):
+        '''
+        Generates the first jets of a block at once: multiplicities, vertices, angles and smearings of all
+        of the events are drawn from the block's random streams with a few array calls. Each stream is
+        drawn in the order of the events, so the jets are the first ones of the whole block.
+        Parameters:
+        @block: index of the block;
+        @nEvents: number of jets, default blockSize;
+        Returns:
+        @batch: instance of JetBatch with the first nEvents jets of the block.
+        '''
+        nEvents = self.blockSize if nEvents is None else nEvents
+        # Random number of tracks per type of production
+        nPV = self.__multiplicities(self.__rng(block,"nPV"),self.nTracksPV,nEvents)
+        nSV = self.__multiplicities(self.__rng(block,"nSV"),self.nTracksSV,nEvents)
+        nPileup = self.__multiplicities(self.__rng(block,"nPileup"),self.nTracksPileup,nEvents)
+
+        # Primary vertices are in the origin of the reference frame
+        PV = np.zeros((nEvents,3))
+        # Random secondary vertices, spherical coordinates
+        rSV = self.flightLength + self.__rng(block,"rSV").normal(0,self.sigmaFlight,nEvents)
+        thetaSV = self.__rng(block,"thetaSV").normal(0,self.sigmaTheta,nEvents)
+        thetaSV[thetaSV>self.thetaMaxSV] = 0.
+        phiSV = self.__rng(block,"phiSV").uniform(0,2*m.pi,nEvents)
+        SV = rSV[:,None]*self.__versors(thetaSV,phiSV)
+
+        # PV and SV tracks
+        originsPV, versorsPV = self.__smearedTracks(block,"PV",np.repeat(PV,nPV,axis=0))
+        originsSV, versorsSV = self.__smearedTracks(block,"SV",np.repeat(SV,nSV,axis=0))
+
+        # Pileup tracks, not crossing the PV
+        phi = self.__rng(block,"phiPileup").uniform(0,2*m.pi,np.sum(nPileup))
+        z = 0.5*self.flightLength
+        theta = np.full(phi.shape,0.5*self.thetaMaxJet)
+        versorsPileup = self.__versors(theta,phi)
+        r = (z+2)/m.cos(0.5*self.thetaMaxJet)
+        originsPileup = r*versorsPileup
+        originsPileup[:,2] = z
+
+        # Tracks in CSR layout: for each event PV, SV and pileup tracks
+        nTracks = nPV+nSV+nPileup
+        offsets = np.zeros(nEvents+1,dtype=np.int64)
+        offsets[1:] = np.cumsum(nTracks)
+        origins = np.empty((offsets[-1],3))
+        versors = np.empty((offsets[-1],3))
+        categories = np.empty(offsets[-1],dtype=np.int8)
+        start = offsets[:-1]
+        for category,n,first,o,v in ((Jet.categoryPV,nPV,start,originsPV,versorsPV),
+                                     (Jet.categorySV,nSV,start+nPV,originsSV,versorsSV),
+                                     (Jet.categoryPileup,nPileup,start+nPV+nSV,originsPileup,versorsPileup)):
+            # position of each track: first index of its category in the event, plus its index in the category
+            rows = np.repeat(first,n) + np.arange(np.sum(n)) - np.repeat(np.cumsum(n)-n,n)
+            origins[rows] = o
+            versors[rows] = v
+            categories[rows] = category
+        return JetBatch(origins,versors,categories,offsets,PV,SV)
+
+    def generateBatch(self,start=0,stop=None):
+        '''
+        Generates the jets in [start,stop) at once in columnar form.
+        Parameters:
+        @start: index of the first jet;
+        @stop: index after the last jet, default nEvents;
+        Returns:
+        @batch: instance of JetBatch with the generated jets.
+        '''
+        stop = self.nEvents if stop is None else stop
+        return self.__generateRange(start,stop)
+
+    def __generateRange(self,start,stop,held=None):
+        '''
+        Generates the jets in [start,stop): for each block that contains part of the range, only the
+        jets of the block up to the end of the range (or up to nEvents, if a block is held) are generated.
+        Parameters:
+        @start: index of the first jet;
+        @stop: index after the last jet;
+        @held: list [block,batch], the last generated block, reused and updated between the calls
+            (None: no block is held);
+        Returns:
+        @batch: instance of JetBatch with the generated jets.
+        '''
+        if stop<=start:
+            return JetBatch.concatenate([])
+        parts = []
+        for block in range(start//self.blockSize,(stop-1)//self.blockSize+1):
+            first = block*self.blockSize
+            if held is not None and held[0] == block:
+                batch = held[1]
+            elif held is not None:
+                # The held block is generated up to the last jet of the sample, for the next calls
+                batch = self.__generateBlock(block,min(self.blockSize,self.nEvents-first))
+                held[0], held[1] = block, batch
+            else:
+                batch = self.__generateBlock(block,min(self.blockSize,stop-first))
+            parts.append(batch.slice(max(start,first)-first,min(stop,first+self.blockSize)-first))
+        return parts[0] if len(parts) == 1 else JetBatch.concatenate(parts)
+
+    def iterBatches(self,chunkSize=10000):
+        '''
+        Generates the nEvents jets in chunks, so that memory does not grow with the sample size.
+        Parameters:
+        @chunkSize: maximum number of jets per chunk;
+        Yields:
+        @batch: instance of JetBatch, the next chunk of jets;
+        '''
+        # Block held between the chunks, generated once
+        held = [None,None]
+        for start in range(0,self.nEvents,chunkSize):
+            yield self.__generateRange(start,min(start+chunkSize,self.nEvents),held)
+
+    def iterJets(self,chunkSize=10000):
+        '''
+        Generates the nEvents jets in chunks, and yields them one at a time.
+        Parameters:
+        @chunkSize: number of jets generated at once;
+        Yields:
+        @jet: instance of Jet, the next jet;
+        '''
+        for batch in self.iterBatches(chunkSize):
+            for b in range(len(batch)):
+                yield batch.jet(b)
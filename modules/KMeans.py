@@ -0,0 +1,303 @@
+import numpy as np
+
+class KMeans:
+    '''
+    Class that implements a lightweight KMeans (Lloyd's algorithm) for the few points of a jet, with
+    the same interface of sklearn.cluster.KMeans used by ClusteringSSVF (fit, labels_, cluster_centers_,
+    n_iter_, inertia_). The centroids can be warm-started from the ones of the previous fit or from their
+    running average, since the clusters in the features' space are stable from event to event; otherwise
+    they are initialized with k-means++.
+    Public Members:
+    @self.k: number of clusters;
+    @self.max_iter: maximum number of Lloyd iterations;
+    @self.tol: tolerance on the centroids' squared displacement, relative to the mean variance of the features;
+    @self.warmStart: initialization of the centroids, None (k-means++ at each fit, default), "previous"
+        (centroids of the previous fit) or "average" (running average of the previous fits' centroids);
+    @self.momentum: weight of the last fit in the running average of the centroids;
+    @self.labels_: np.array of shape (N,), cluster of each point of the last fit;
+    @self.cluster_centers_: np.array of shape (k,d), centroids of the last fit;
+    @self.n_iter_: number of Lloyd iterations of the last fit;
+    @self.inertia_: sum of the squared distances of the points from their centroids in the last fit;
+    @self.warmStarts: available initializations of the centroids;
+
+    Public Methods:
+    @fit(X,centroids): returns self, clusters the points X, optionally starting from the given centroids;
+    @fitBatch(X,mask,centroids): returns the labels, the centroids and the iterations of many padded sets
+        of points, clustered at once;
+    @reset(): forgets the centroids of the previous fits;
+
+    Private Methods:
+    @__initialCentroids(X): returns np.array of shape (k,d), the k-means++ centroids;
+    @__lloyd(X,centroids): runs Lloyd's iterations from the given centroids;
+    @__initialCentroidsBatch(X,mask): returns np.array of shape (B,k,d), the k-means++ centroids of each set;
+    @__lloydBatch(X,mask,centroids): runs Lloyd's iterations on all of the sets, with per-set convergence;
+    @__warmCentroids(): returns the warm-start centroids, None if not available;
+    @__update(centroids): updates the warm-start centroids with the fitted ones;
+    '''
+
+    # Available initializations of the centroids
+    warmStarts = (None,"previous","average")
+
+    # Constructor
+    def __init__(self, k = 3, max_iter = 300, tol = 1e-4, warmStart = None, momentum = 0.1, seed = None):
+        '''
+        Constructor of the class.
+        Parameters:
+        @k: number of clusters;
+        @max_iter: maximum number of Lloyd iterations;
+        @tol: tolerance on the centroids' squared displacement, relative to the mean variance of the features;
+        @warmStart: None, "previous" or "average", initialization of the centroids;
+        @momentum: weight of the last fit in the running average of the centroids;
+        @seed: seed of the k-means++ initialization;
+        '''
+        if warmStart not in self.warmStarts:
+            raise ValueError("Unknown warm start '" + str(warmStart) + "', available: " + str(self.warmStarts))
+        self.k = k
+        self.max_iter = max_iter
+        self.tol = tol
+        self.warmStart = warmStart
+        self.momentum = momentum
+        self.labels_ = None
+        self.cluster_centers_ = None
+        self.n_iter_ = 0
+        self.inertia_ = None
+        self.__rng = np.random.default_rng(seed)
+        self.__previous = None
+        self.__average = None
+
+    def reset(self):
+        '''
+        Forgets the centroids of the previous fits: the next fit is initialized with k-means++.
+        '''
+        self.__previous = None
+        self.__average = None
+
+    def __initialCentroids(self,X):
+        '''
+        Chooses the initial centroids with k-means++: each centroid is drawn among the points with
+        probability proportional to the squared distance from the closest centroid already chosen.
+        Parameters:
+        @X: np.array of shape (N,d), the points;
+        Returns:
+        @centroids: np.array of shape (k,d);
+        '''
+        centroids = np.empty((self.k,X.shape[1]))
+        centroids[0] = X[self.__rng.integers(len(X))]
+        d2 = np.sum((X-centroids[0])**2,axis=1)
+        for c in range(1,self.k):
+            total = np.sum(d2)
+            i = self.__rng.choice(len(X),p=d2/total) if total>0 else self.__rng.integers(len(X))
+            centroids[c] = X[i]
+            d2 = np.minimum(d2,np.sum((X-centroids[c])**2,axis=1))
+        return centroids
+
+    def __lloyd(self,X,centroids):
+        '''
+        Runs Lloyd's iterations: each point is assigned to the closest centroid and the centroids are moved
+        to the mean of their points, until the labels do not change or the centroids' squared displacement
+        is below the tolerance. An empty cluster takes the point farthest from its centroid, as in sklearn.
+        Parameters:
+        @X: np.array of shape (N,d), the points;
+        @centroids: np.array of shape (k,d), the initial centroids;
+        Returns:
+        @labels: np.array of shape (N,);
+        @centroids: np.array of shape (k,d);
+        @nIter: number of iterations;
+        '''
+        tol = self.tol*np.mean(np.var(X,axis=0))
+        labels = None
+        nIter = 0
+        for nIter in range(1,self.max_iter+1):
+            d2 = np.sum((X[:,None,:]-centroids[None,:,:])**2,axis=2)
+            newLabels = np.argmin(d2,axis=1)
+            if labels is not None and np.array_equal(newLabels,labels):
+                break
+            labels = newLabels
+            counts = np.bincount(labels,minlength=self.k)
+            sums = np.zeros(centroids.shape)
+            np.add.at(sums,labels,X)
+            empty = np.flatnonzero(counts==0)
+            if len(empty) > 0:
+                # the empty clusters take the points farthest from their centroids, which leave their clusters
+                farthest = np.argsort(-d2[np.arange(len(X)),labels],kind="stable")[:len(empty)]
+                for c, i in zip(empty,farthest):
+                    sums[labels[i]] -= X[i]
+                    counts[labels[i]] -= 1
+                    sums[c] = X[i]
+                    counts[c] = 1
+            newCentroids = centroids.copy()
+            filled = counts>0
+            newCentroids[filled] = sums[filled]/counts[filled,None]
+            shift = np.sum((newCentroids-centroids)**2)
+            centroids = newCentroids
+            if shift<=tol:
+                # Final assignment to the converged centroids
+                labels = np.argmin(np.sum((X[:,None,:]-centroids[None,:,:])**2,axis=2),axis=1)
+                break
+        return labels, centroids, nIter
+
+    def __initialCentroidsBatch(self,X,mask):
+        '''
+        Chooses the initial centroids of each set of points with k-means++, for all of the sets together.
+        Parameters:
+        @X: np.array of shape (B,N,d), the points;
+        @mask: np.array of shape (B,N) of bool, False on the padding;
+        Returns:
+        @centroids: np.array of shape (B,k,d);
+        '''
+        B = X.shape[0]
+        sets = np.arange(B)
+        centroids = np.empty((B,self.k,X.shape[2]))
+        # the first centroid is drawn uniformly, then from the squared distances (uniformly if they are all 0)
+        weights = mask.astype(float)
+        d2 = None
+        for c in range(self.k):
+            if d2 is not None:
+                weights = np.where(np.sum(d2,axis=1)[:,None]>0,d2,weights)
+            cumulative = np.cumsum(weights,axis=1)
+            u = self.__rng.random(B)*cumulative[:,-1]
+            i = np.minimum(np.sum(cumulative<=u[:,None],axis=1),X.shape[1]-1)
+            centroids[:,c] = X[sets,i]
+            distances = np.where(mask,np.sum((X-centroids[:,c,None,:])**2,axis=2),0.)
+            d2 = distances if d2 is None else np.minimum(d2,distances)
+        return centroids
+
+    def __lloydBatch(self,X,mask,centroids):
+        '''
+        Runs Lloyd's iterations on all of the sets of points together, as in __lloyd: a set stops iterating
+        when its labels do not change or its centroids' squared displacement is below its tolerance, while
+        the other sets go on.
+        Parameters:
+        @X: np.array of shape (B,N,d), the points;
+        @mask: np.array of shape (B,N) of bool, False on the padding;
+        @centroids: np.array of shape (B,k,d), the initial centroids;
+        Returns:
+        @labels: np.array of shape (B,N), -1 on the padding;
+        @centroids: np.array of shape (B,k,d);
+        @nIter: np.array of shape (B,), number of iterations of each set;
+        '''
+        B, N, d = X.shape
+        counts = np.sum(mask,axis=1)
+        # tolerance relative to the mean variance of the features of each set
+        means = np.sum(np.where(mask[...,None],X,0.),axis=1)/counts[:,None]
+        variances = np.sum(np.where(mask[...,None],(X-means[:,None,:])**2,0.),axis=1)/counts[:,None]
+        tol = self.tol*np.mean(variances,axis=1)
+        labels = np.full((B,N),-1)
+        nIter = np.zeros(B,dtype=int)
+        # Sets still iterating
+        pending = np.arange(B)
+        for iteration in range(1,self.max_iter+1):
+            if len(pending) == 0:
+                break
+            nIter[pending] = iteration
+            Xp, maskp, Cp = X[pending], mask[pending], centroids[pending]
+            d2 = np.sum((Xp[:,:,None,:]-Cp[:,None,:,:])**2,axis=3)
+            newLabels = np.where(maskp,np.argmin(d2,axis=2),-1)
+            # Sets whose labels did not change are converged
+            changed = np.any(newLabels!=labels[pending],axis=1)
+            labels[pending] = newLabels
+            pending, Xp, maskp, Cp, d2, newLabels = (pending[changed], Xp[changed], maskp[changed], Cp[changed],
+                                                     d2[changed], newLabels[changed])
+            members = newLabels[:,:,None] == np.arange(self.k)
+            clusterCounts = np.sum(members,axis=1)
+            sums = np.einsum('bnk,bnd->bkd',members.astype(float),Xp)
+            for b in np.flatnonzero(np.any(clusterCounts==0,axis=1)):
+                # the empty clusters take the points farthest from their centroids, which leave their clusters
+                empty = np.flatnonzero(clusterCounts[b]==0)
+                own = np.where(maskp[b],d2[b,np.arange(N),newLabels[b]],-np.inf)
+                for c, i in zip(empty,np.argsort(-own,kind="stable")[:len(empty)]):
+                    sums[b,newLabels[b,i]] -= Xp[b,i]
+                    clusterCounts[b,newLabels[b,i]] -= 1
+                    sums[b,c] = Xp[b,i]
+                    clusterCounts[b,c] = 1
+            newCentroids = np.where(clusterCounts[...,None]>0,sums/np.maximum(clusterCounts,1)[...,None],Cp)
+            shift = np.sum((newCentroids-Cp)**2,axis=(1,2))
+            centroids[pending] = newCentroids
+            converged = shift<=tol[pending]
+            if np.any(converged):
+                # Final assignment to the converged centroids
+                rows = pending[converged]
+                d2 = np.sum((X[rows][:,:,None,:]-newCentroids[converged][:,None,:,:])**2,axis=3)
+                labels[rows] = np.where(mask[rows],np.argmin(d2,axis=2),-1)
+                pending = pending[~converged]
+        return labels, centroids, nIter
+
+    def __warmCentroids(self):
+        '''
+        Returns the warm-start centroids, None if they are not available.
+        Returns:
+        @centroids: np.array of shape (k,d), or None;
+        '''
+        if self.warmStart == "previous":
+            return self.__previous
+        if self.warmStart == "average":
+            return self.__average
+        return None
+
+    def fitBatch(self,X,mask=None,centroids=None):
+        '''
+        Clusters many independent sets of points at once (e.g. the features of the jets of a JetBatch, in its
+        padded layout). The warm-start centroids, if available, initialize all of the sets; the sets are then
+        used to update them as if they were fitted one after the other.
+        Parameters:
+        @X: np.array of shape (B,N,d), the points, padded;
+        @mask: np.array of shape (B,N) of bool, False on the padding (default: no padding); each set needs
+            at least k points;
+        @centroids: np.array of shape (B,k,d) or (k,d), initial centroids (default: given by warmStart);
+        Returns:
+        @labels: np.array of shape (B,N), cluster of each point, -1 on the padding;
+        @centroids: np.array of shape (B,k,d), the centroids of each set;
+        @nIter: np.array of shape (B,), number of Lloyd iterations of each set;
+        '''
+        X = np.asarray(X,dtype=float)
+        mask = np.ones(X.shape[:2],dtype=bool) if mask is None else np.asarray(mask,dtype=bool)
+        counts = np.sum(mask,axis=1)
+        if np.any(counts < self.k):
+            raise ValueError("n_samples=" + str(int(np.min(counts))) + " should be >= n_clusters=" + str(self.k))
+        if centroids is None:
+            centroids = self.__warmCentroids()
+        if centroids is None:
+            centroids = self.__initialCentroidsBatch(X,mask)
+        centroids = np.array(np.broadcast_to(centroids,(X.shape[0],self.k,X.shape[2])),dtype=float)
+        labels, centroids, nIter = self.__lloydBatch(X,mask,centroids)
+        self.__update(centroids)
+        return labels, centroids, nIter
+
+    def __update(self,centroids):
+        '''
+        Updates the warm-start centroids with the centroids of the fitted sets, in order.
+        Parameters:
+        @centroids: np.array of shape (B,k,d), the fitted centroids;
+        '''
+        if len(centroids) == 0:
+            return
+        self.__previous = centroids[-1]
+        weights = self.momentum*(1.-self.momentum)**np.arange(len(centroids)-1,-1,-1)
+        if self.__average is None:
+            weights[0] = (1.-self.momentum)**(len(centroids)-1)
+            self.__average = np.einsum('b,bkd->kd',weights,centroids)
+        else:
+            self.__average = (1.-self.momentum)**len(centroids)*self.__average + np.einsum('b,bkd->kd',weights,centroids)
+
+    def fit(self,X,centroids=None):
+        '''
+        Clusters the points.
+        Parameters:
+        @X: np.array of shape (N,d), the points, N>=k;
+        @centroids: np.array of shape (k,d), initial centroids (default: given by warmStart);
+        Returns:
+        @self: the fitted instance, with labels_, cluster_centers_, n_iter_ and inertia_;
+        '''
+        X = np.asarray(X,dtype=float)
+        if len(X) < self.k:
+            raise ValueError("n_samples=" + str(len(X)) + " should be >= n_clusters=" + str(self.k))
+        if centroids is None:
+            centroids = self.__warmCentroids()
+        if centroids is None:
+            centroids = self.__initialCentroids(X)
+        labels, centroids, self.n_iter_ = self.__lloyd(X,np.array(centroids,dtype=float))
+        self.labels_ = labels
+        self.cluster_centers_ = centroids
+        self.inertia_ = float(np.sum((X-centroids[labels])**2))
+        self.__update(centroids[None])
+        return self
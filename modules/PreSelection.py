@@ -0,0 +1,149 @@
+import numpy as np
+from modules.TrackCollection import TrackCollection
+
+class PreSelection:
+    '''
+    Class that implements a vectorized pre-selection of the tracks in front of the vertex finding:
+    the tracks are kept if their impact parameter (distance from the origin, i.e. from the PV), their
+    versor's z component (cosine of the polar angle) and the z of their point of closest approach to the
+    beam line (the z axis) are inside the configured ranges. Removing the prompt PV tracks (small IP)
+    reduces the number of tracks of the vertex finding and of the vertex fitting.
+    Public Members:
+    @self.minIP, self.maxIP: range of the impact parameter [mm] (None: no cut);
+    @self.minVersorZ, self.maxVersorZ: range of the versor's z component (None: no cut);
+    @self.minZ, self.maxZ: range of the z of closest approach to the beam line [mm] (None: no cut);
+    @self.nTracks: number of tracks submitted to the pre-selection;
+    @self.nRemoved: number of tracks removed by the pre-selection;
+    @self.nRemovedIP, self.nRemovedVersorZ, self.nRemovedZ: number of tracks failing each cut
+        (a track can fail more than one cut);
+
+    Public Methods:
+    @select(origins,versors,mask): returns np.array of bool, the tracks that pass the pre-selection;
+    @impactParameters(origins,versors): returns np.array, the tracks' distances from the origin;
+    @beamLineZ(origins,versors): returns np.array, the z of the tracks' points of closest approach to the beam line;
+    @config(): returns dict, the cuts of the pre-selection;
+    @stats(): returns dict, the counters of the pre-selection;
+    @reset(): sets the counters to 0;
+
+    Private Methods:
+    @__inRange(values,low,high): returns np.array of bool, the values inside [low,high];
+    '''
+
+    # Constructor
+    def __init__(self, minIP = None, maxIP = None, minVersorZ = None, maxVersorZ = None, minZ = None, maxZ = None):
+        '''
+        Constructor of the class.
+        Parameters:
+        @minIP, maxIP: range of the impact parameter [mm] (None: no cut);
+        @minVersorZ, maxVersorZ: range of the versor's z component (None: no cut);
+        @minZ, maxZ: range of the z of closest approach to the beam line [mm] (None: no cut);
+        '''
+        self.minIP = minIP
+        self.maxIP = maxIP
+        self.minVersorZ = minVersorZ
+        self.maxVersorZ = maxVersorZ
+        self.minZ = minZ
+        self.maxZ = maxZ
+        self.reset()
+
+    def __inRange(self,values,low,high):
+        '''
+        Checks whether the values are inside a range.
+        Parameters:
+        @values: np.array;
+        @low, high: bounds of the range (None: no bound);
+        Returns:
+        @inside: np.array of bool, same shape of values;
+        '''
+        inside = np.ones(values.shape,dtype=bool)
+        if low is not None:
+            inside &= values >= low
+        if high is not None:
+            inside &= values <= high
+        return inside
+
+    def impactParameters(self,origins,versors):
+        '''
+        Evaluates the distances of the tracks from the origin, with TrackCollection.lineImpactParameters.
+        Parameters:
+        @origins: np.array of shape (...,3), tracks' origins;
+        @versors: np.array of shape (...,3), tracks' versors;
+        Returns:
+        @IP: np.array of shape (...), the tracks' impact parameters;
+        '''
+        return TrackCollection.lineImpactParameters(origins,versors)
+
+    def beamLineZ(self,origins,versors):
+        '''
+        Evaluates the z of the tracks' points of closest approach to the beam line (the z axis);
+        the origin's z is used for the tracks parallel to the beam line.
+        Parameters:
+        @origins: np.array of shape (...,3), tracks' origins;
+        @versors: np.array of shape (...,3), tracks' versors;
+        Returns:
+        @z: np.array of shape (...);
+        '''
+        transverse = versors[...,0]**2 + versors[...,1]**2
+        parallel = transverse < 1e-12
+        tstar = -(origins[...,0]*versors[...,0] + origins[...,1]*versors[...,1])/np.where(parallel,1.,transverse)
+        return origins[...,2] + np.where(parallel,0.,tstar)*versors[...,2]
+
+    def select(self,origins,versors,mask=None):
+        '''
+        Applies the pre-selection to the tracks and updates the counters.
+        Parameters:
+        @origins: np.array of shape (...,3), tracks' origins (e.g. TrackCollection.origins, or the padded
+            origins of a JetBatch);
+        @versors: np.array of shape (...,3), tracks' versors;
+        @mask: np.array of shape (...) of bool, the tracks to be considered (default: all of them);
+            the other ones are not selected and not counted;
+        Returns:
+        @selected: np.array of shape (...) of bool, the tracks that pass the pre-selection;
+        '''
+        origins = np.asarray(origins,dtype=float)
+        versors = np.asarray(versors,dtype=float)
+        mask = np.ones(origins.shape[:-1],dtype=bool) if mask is None else np.asarray(mask,dtype=bool)
+        selected = mask.copy()
+        if self.minIP is not None or self.maxIP is not None:
+            passIP = self.__inRange(self.impactParameters(origins,versors),self.minIP,self.maxIP)
+            self.nRemovedIP += int(np.sum(mask & ~passIP))
+            selected &= passIP
+        if self.minVersorZ is not None or self.maxVersorZ is not None:
+            passVersorZ = self.__inRange(versors[...,2],self.minVersorZ,self.maxVersorZ)
+            self.nRemovedVersorZ += int(np.sum(mask & ~passVersorZ))
+            selected &= passVersorZ
+        if self.minZ is not None or self.maxZ is not None:
+            passZ = self.__inRange(self.beamLineZ(origins,versors),self.minZ,self.maxZ)
+            self.nRemovedZ += int(np.sum(mask & ~passZ))
+            selected &= passZ
+        self.nTracks += int(np.sum(mask))
+        self.nRemoved += int(np.sum(mask & ~selected))
+        return selected
+
+    def config(self):
+        '''
+        Returns the cuts of the pre-selection.
+        Returns:
+        @config: dict of the constructor's parameters;
+        '''
+        return {"minIP": self.minIP, "maxIP": self.maxIP, "minVersorZ": self.minVersorZ,
+                "maxVersorZ": self.maxVersorZ, "minZ": self.minZ, "maxZ": self.maxZ}
+
+    def stats(self):
+        '''
+        Returns the counters of the pre-selection.
+        Returns:
+        @stats: dict with the numbers of submitted and removed tracks, and of tracks failing each cut;
+        '''
+        return {"tracks": self.nTracks, "removed": self.nRemoved, "removedIP": self.nRemovedIP,
+                "removedVersorZ": self.nRemovedVersorZ, "removedZ": self.nRemovedZ}
+
+    def reset(self):
+        '''
+        Sets the counters to 0.
+        '''
+        self.nTracks = 0
+        self.nRemoved = 0
+        self.nRemovedIP = 0
+        self.nRemovedVersorZ = 0
+        self.nRemovedZ = 0
@@ -0,0 +1,148 @@
+import numpy as np
+import copy
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from modules.JetBatch import JetBatch
+from modules.EventFile import EventFile
+from modules.Instrumentation import Instrumentation
+
+def reconstructChunk(algorithm, jets):
+    '''
+    Reconstructs a chunk of jets in the current process; it is a module level function so that
+    it can be sent to the worker processes.
+    Parameters:
+    @algorithm: instance of SSVF or ClusteringSSVF, the reconstruction algorithm;
+    @jets: list of Jet instances or JetBatch, the chunk of jets, or tuple (EventFile,start,stop) of the
+        range of jets of a file, that are read by the worker;
+    Returns:
+    @results: list of (SVfit, selected, time) tuples, one for each jet of the chunk, with the
+        fitted SV (None if the fit failed), the indices of the selected tracks and the reconstruction
+        time [s];
+    @events: list of dict, the events added to the algorithm's instrumentation by the chunk (None if the
+        algorithm has no instrumentation);
+    '''
+    if isinstance(jets,tuple):
+        eventFile, start, stop = jets
+        jets = eventFile.batch(start,stop)
+    if isinstance(jets,JetBatch):
+        jets = [jets.tracks(b) for b in range(len(jets))]
+    instrumentation = algorithm.instrumentation
+    if instrumentation is not None:
+        first = len(instrumentation.events)
+    results = []
+    for jet in jets:
+        start = time.perf_counter()
+        SVfit, selected = algorithm.reconstruct(jet)
+        results.append((SVfit,selected,time.perf_counter()-start))
+    if instrumentation is None:
+        return results, None
+    return results, instrumentation.events[first:]
+
+class ReconstructionRunner:
+    '''
+    Class that distributes the reconstruction of many jets over a pool of processes: the jets are
+    split in chunks, each chunk is reconstructed by a worker process with a copy of the algorithm,
+    and the results are collected in the order of the input jets. The jets of an EventFile are not
+    sent to the workers: each worker maps the file and reads its own range of jets.
+    If the algorithm has an Instrumentation, the workers fill an empty copy of it, and the events of
+    each chunk are added to the algorithm's instrumentation in the order of the input jets, as when
+    the jets are reconstructed in the current process.
+    Public Members:
+    @self.algorithm: instance of SSVF or ClusteringSSVF (with its configuration), the reconstruction algorithm;
+    @self.chunkSize: number of jets sent to a worker at once;
+    @self.maxWorkers: number of worker processes (None: number of cores, 1: no pool, the jets are
+        reconstructed in the current process);
+
+    Public Methods:
+    @run(jets,start,stop): returns the fitted SVs, their validity, the selected tracks' indices and the
+        per-event reconstruction times;
+
+    Private Methods:
+    @__chunks(jets,start,stop): returns the list of chunks of jets;
+    '''
+
+    # Constructor
+    def __init__(self, algorithm, chunkSize = 100, maxWorkers = None):
+        '''
+        Constructor of the class.
+        Parameters:
+        @algorithm: instance of SSVF or ClusteringSSVF, the reconstruction algorithm;
+        @chunkSize: number of jets sent to a worker at once;
+        @maxWorkers: number of worker processes (None: number of cores, 1: no pool);
+        '''
+        if chunkSize < 1:
+            raise ValueError("chunkSize must be positive, got " + str(chunkSize))
+        self.algorithm = algorithm
+        self.chunkSize = chunkSize
+        self.maxWorkers = maxWorkers
+
+    def __chunks(self,jets,start,stop):
+        '''
+        Splits the jets in [start,stop) in chunks of chunkSize jets.
+        Parameters:
+        @jets: list of Jet instances, JetBatch or EventFile;
+        @start: index of the first jet;
+        @stop: index after the last jet;
+        Returns:
+        @chunks: list of lists of Jet instances, of JetBatch instances or of (EventFile,start,stop) tuples;
+        '''
+        bounds = [(first,min(first+self.chunkSize,stop)) for first in range(start,stop,self.chunkSize)]
+        if isinstance(jets,EventFile):
+            return [(jets,first,last) for first,last in bounds]
+        if isinstance(jets,JetBatch):
+            return [jets.slice(first,last) for first,last in bounds]
+        return [jets[first:last] for first,last in bounds]
+
+    def run(self,jets,start=0,stop=None):
+        '''
+        Reconstructs the jets in [start,stop).
+        Parameters:
+        @jets: list of Jet instances, JetBatch, EventFile or path of an EventFile;
+        @start: index of the first jet;
+        @stop: index after the last jet (default: the number of jets);
+        Returns:
+        nJets is the number of jets in [start,stop);
+        @SVfit: np.array of shape (nJets,3), the fitted SVs, np.nan where the fit failed;
+        @valid: np.array of shape (nJets,) of bool, whether the fit succeeded;
+        @selected: list of nJets np.array, the indices of the selected tracks of each jet among
+            its tracks (PV, SV and pileup, in this order), None where the fit failed;
+        @times: np.array of shape (nJets,), per-event reconstruction times [s];
+        '''
+        if isinstance(jets,(str,os.PathLike)):
+            jets = EventFile(jets)
+        stop = len(jets) if stop is None else min(stop,len(jets))
+        start = min(start,stop)
+        chunks = self.__chunks(jets,start,stop)
+        nJets = stop-start
+        if self.maxWorkers == 1:
+            # The events are added to the algorithm's instrumentation directly
+            results = [reconstructChunk(self.algorithm,chunk)[0] for chunk in chunks]
+        else:
+            # The workers fill a copy of the instrumentation, instead of the events collected so far
+            algorithm = self.algorithm
+            if algorithm.instrumentation is not None:
+                algorithm = copy.copy(algorithm)
+                algorithm.instrumentation = Instrumentation()
+            with ProcessPoolExecutor(max_workers=self.maxWorkers) as executor:
+                # map preserves the order of the chunks
+                outputs = list(executor.map(reconstructChunk,[algorithm]*len(chunks),chunks))
+            results = [chunkResults for chunkResults, _ in outputs]
+            if self.algorithm.instrumentation is not None:
+                for _, events in outputs:
+                    self.algorithm.instrumentation.events.extend(events)
+
+        SVfit = np.full((nJets,3),np.nan)
+        valid = np.zeros(nJets,dtype=bool)
+        selected = []
+        times = np.zeros(nJets)
+        i = 0
+        for chunk in results:
+            for vertex, indices, t in chunk:
+                if vertex is not None:
+                    SVfit[i] = vertex
+                    valid[i] = True
+                selected.append(indices)
+                times[i] = t
+                i += 1
+        return SVfit, valid, selected, times
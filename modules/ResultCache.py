@@ -0,0 +1,235 @@
+import numpy as np
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from modules.TrackCollection import TrackCollection
+
+class ResultCache:
+    '''
+    Class that implements a persistent on-disk cache of the reconstruction results: the result of
+    algorithm.reconstruct(jet) is stored in a .npz file named after the sha256 hash of the cache's version,
+    of the jet's tracks (origins and versors), of the algorithm's class and of its configuration
+    (algorithm.config()). The results of algorithm.reconstructBatch(batch) are cached in the same way,
+    with the hash of all of the batch's tracks and of its offsets.
+    When the total size of the cache exceeds maxBytes the least recently used results are removed: the
+    recency order is kept in memory, and persisted as the files' modification times (refreshed on each hit).
+    Public Members:
+    @self.directory: directory of the cache, created if needed;
+    @self.maxBytes: maximum total size of the cached results [bytes];
+    @self.hits: number of results read from the cache;
+    @self.misses: number of results that had to be reconstructed;
+    @self.evictions: number of results removed from the cache;
+    @self.extension: extension of the result files;
+    @self.version: version of the results, part of the hash: it must be increased whenever a change of the
+        algorithms (or of the files' format) can change the reconstruction results, so that the results
+        cached before the change are not used;
+
+    Public Methods:
+    @key(algorithm,jet): returns str, the hash of the jet and of the algorithm's configuration;
+    @batchKey(algorithm,batch): returns str, the hash of the batch and of the algorithm's configuration;
+    @reconstruct(algorithm,jet): returns the fitted SV and the selected tracks' indices, like
+        algorithm.reconstruct(jet), reading them from the cache when possible;
+    @reconstructBatch(algorithm,batch): returns the fitted SVs and the validity mask, like
+        algorithm.reconstructBatch(batch), reading them from the cache when possible;
+    @stats(): returns dict, the hits, misses and evictions counts, and the cache's size;
+    @clear(): removes all of the cached results;
+
+    Private Methods:
+    @__path(key): returns the path of the result file of a key;
+    @__hash(algorithm,tracks): returns the sha256 hash of the version, of the algorithm and of the tracks;
+    @__load(key): returns the cached arrays of a key, None if it is not in the cache;
+    @__store(key,arrays): writes the arrays of a result in the cache;
+    @__evict(): removes the least recently used results until the cache fits in maxBytes;
+    '''
+
+    # extension of the result files
+    extension = ".npz"
+    # version of the results: increase it whenever the reconstruction results can change
+    version = 2
+
+    # Constructor
+    def __init__(self, directory = ".ssvfcache", maxBytes = 100*2**20):
+        '''
+        Constructor of the class.
+        Parameters:
+        @directory: directory of the cache, created if needed;
+        @maxBytes: maximum total size of the cached results [bytes];
+        '''
+        self.directory = str(directory)
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.directory,exist_ok=True)
+        # sizes of the cached results, from the least to the most recently used
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.extension):
+                stat = os.stat(os.path.join(self.directory,name))
+                entries.append((stat.st_mtime,name[:-len(self.extension)],stat.st_size))
+        self.__sizes = OrderedDict((key,size) for _,key,size in sorted(entries))
+        self.__size = sum(self.__sizes.values())
+
+    def key(self,algorithm,jet):
+        '''
+        Evaluates the key of a result.
+        Parameters:
+        @algorithm: instance of SSVF or ClusteringSSVF;
+        @jet: instance of Jet or TrackCollection;
+        Returns:
+        @key: str, hex digest of the sha256 hash;
+        '''
+        return self.__hash(algorithm,TrackCollection.asCollection(jet)).hexdigest()
+
+    def batchKey(self,algorithm,batch):
+        '''
+        Evaluates the key of the results of a batch.
+        Parameters:
+        @algorithm: instance of SSVF or ClusteringSSVF;
+        @batch: instance of JetBatch;
+        Returns:
+        @key: str, hex digest of the sha256 hash;
+        '''
+        h = self.__hash(algorithm,batch)
+        h.update(b"batch")
+        h.update(np.ascontiguousarray(batch.offsets,dtype="<i8").tobytes())
+        return h.hexdigest()
+
+    def __hash(self,algorithm,tracks):
+        '''
+        Hashes the version of the cache, the algorithm's class and configuration, and the tracks.
+        Parameters:
+        @algorithm: instance of SSVF or ClusteringSSVF;
+        @tracks: instance of TrackCollection or JetBatch;
+        Returns:
+        @h: hashlib sha256 object;
+        '''
+        h = hashlib.sha256()
+        h.update(("version "+str(self.version)).encode())
+        h.update(type(algorithm).__name__.encode())
+        h.update(json.dumps(algorithm.config(),sort_keys=True).encode())
+        h.update(np.ascontiguousarray(tracks.origins,dtype="<f8").tobytes())
+        h.update(np.ascontiguousarray(tracks.versors,dtype="<f8").tobytes())
+        return h
+
+    def __path(self,key):
+        return os.path.join(self.directory,key+self.extension)
+
+    def __load(self,key):
+        '''
+        Reads a result from the cache, and marks it as recently used.
+        Parameters:
+        @key: key of the result;
+        Returns:
+        @result: dict of the result's arrays, None if the result is not in the cache;
+        '''
+        if key not in self.__sizes:
+            return None
+        path = self.__path(key)
+        try:
+            with np.load(path) as data:
+                result = {name: data[name] for name in data.files}
+            os.utime(path)
+        except (OSError,KeyError,ValueError):
+            # removed by another process or corrupted
+            self.__size -= self.__sizes.pop(key)
+            return None
+        self.__sizes.move_to_end(key)
+        return result
+
+    def __store(self,key,arrays):
+        '''
+        Writes a result in the cache, atomically.
+        Parameters:
+        @key: key of the result;
+        @arrays: dict of the result's arrays;
+        '''
+        fd, tmp = tempfile.mkstemp(dir=self.directory,suffix=".tmp")
+        with os.fdopen(fd,"wb") as f:
+            np.savez(f,**arrays)
+        os.replace(tmp,self.__path(key))
+        size = os.path.getsize(self.__path(key))
+        self.__size += size - self.__sizes.pop(key,0)
+        self.__sizes[key] = size
+        self.__evict()
+
+    def __evict(self):
+        '''
+        Removes the least recently used results until the total size of the cache is below maxBytes.
+        '''
+        while self.__size > self.maxBytes and len(self.__sizes) > 0:
+            key, size = self.__sizes.popitem(last=False)
+            try:
+                os.remove(self.__path(key))
+            except OSError:
+                pass
+            self.__size -= size
+            self.evictions += 1
+
+    def reconstruct(self,algorithm,jet):
+        '''
+        Returns the result of algorithm.reconstruct(jet), from the cache if present.
+        Parameters:
+        @algorithm: instance of SSVF or ClusteringSSVF;
+        @jet: instance of Jet or TrackCollection;
+        Returns:
+        @SVfit: np.array of shape (3,), the fitted secondary vertex, None if the fit failed;
+        @selected: np.array, indices of the selected tracks, None if the fit failed;
+        '''
+        key = self.key(algorithm,jet)
+        result = self.__load(key)
+        if result is not None:
+            self.hits += 1
+            if not bool(result["valid"]):
+                return None, None
+            return result["SVfit"], result["selected"]
+        self.misses += 1
+        SVfit, selected = algorithm.reconstruct(jet)
+        valid = SVfit is not None
+        self.__store(key,{"valid": valid, "SVfit": SVfit if valid else np.full(3,np.nan),
+                          "selected": selected if valid else np.empty(0,dtype=int)})
+        return SVfit, selected
+
+    def reconstructBatch(self,algorithm,batch):
+        '''
+        Returns the result of algorithm.reconstructBatch(batch), from the cache if present.
+        Parameters:
+        @algorithm: instance of SSVF or ClusteringSSVF;
+        @batch: instance of JetBatch;
+        Returns:
+        @SVfit: np.array of shape (nJets,3), the fitted secondary vertices (NaN if the fit failed);
+        @valid: np.array of shape (nJets,) of bool, the validity mask of the fits;
+        '''
+        key = self.batchKey(algorithm,batch)
+        result = self.__load(key)
+        if result is not None:
+            self.hits += 1
+            return result["SVfit"], result["valid"]
+        self.misses += 1
+        SVfit, valid = algorithm.reconstructBatch(batch)
+        self.__store(key,{"SVfit": SVfit, "valid": valid})
+        return SVfit, valid
+
+    def stats(self):
+        '''
+        Returns the statistics of the cache.
+        Returns:
+        @stats: dict with the numbers of hits, misses and evictions, the number of cached
+            results and their total size [bytes];
+        '''
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self.__sizes), "bytes": self.__size}
+
+    def clear(self):
+        '''
+        Removes all of the cached results.
+        '''
+        for key in list(self.__sizes):
+            try:
+                os.remove(self.__path(key))
+            except OSError:
+                pass
+        self.__sizes = OrderedDict()
+        self.__size = 0
@@ -1,107 +1,491 @@
 import numpy as np
 import math as m
-from scipy.optimize import minimize
+import time
+from modules.TrackCollection import TrackCollection
+from modules.IncrementalFitter import IncrementalFitter
+from modules.BatchFitter import BatchFitter
+from modules.EventFile import EventFile
 
 class SSVF:
     '''
     Class that implements the vertex finding and vertex fitting of the Single Secondary Vertex Finding
-    algorithm.
+    algorithm. scipy is imported only by the "minimize" fitter and by the "index" finder.
 
     Members:
     @self.dThreshold: distance threshold under which tracks are coupled in vertex finding step;
     @self.chi2Threshold: chi2 threshold value after which vertex fitting loop stops;
+    @self.finder: vertex finding strategy, "matrix" (distance matrix evaluated once, default),
+        "sequential" (distances evaluated for each popped track) or "index" (only the distances of the
+        pairs that can be below dThreshold, found with a KD-tree, for jets with many tracks);
+    @self.firstGuess: first guess of the vertex fitting, "analytic" (least squares closest point 
+        to the selected tracks, default) or "fixed" (the fixed point [0.01,0.01,10.]);
+    @self.warmStart: if True, after each track rejection the fit restarts from the previous solution; if False
+        (default) from the first guess of the remaining tracks: the previous solution lies on a kink of the chi2,
+        from which BFGS needs more chi2 evaluations;
+    @self.method: scipy.optimize.minimize method of the vertex fitting, the analytic gradient of the chi2
+        is always used, the analytic hessian only by the methods that need it;
+    @self.fitter: vertex fitting strategy, "minimize" (scipy.optimize.minimize on the remaining tracks
+        after each rejection, default) or "incremental" (IncrementalFitter, IRLS with O(1) track removal);
+    @self.fitStats: dictionary with the number of minimizations, optimizer iterations, 
+        chi2 evaluations and rejected tracks of the last vertexFitter call (summed over the jets
+        for vertexFitterBatch);
+    @self.preSelection: PreSelection instance applied to the jets' tracks before the vertex finding
+        (None, default: all of the tracks are used);
+    @self.instrumentation: Instrumentation instance to which the per-event stage times and counters
+        are added (None, default: no instrumentation);
 
     Public Methods:
+    @config(): returns dict, the configuration of the algorithm;
     @vertexFinder(jet): returns list of lists of Track instances, the tracks
-        coupled during the vertex finding step;
+        coupled during the vertex finding step; jet can also be a TrackCollection;
     @vertexFitter(couples): return np.array of shape (3,), the fitted SV, and a list of 
         Track instances, the tracks that have been fitted to the SV.
+    @reconstruct(jet): returns np.array of shape (3,), the fitted SV, and np.array, the indices of 
+        the tracks fitted to the SV among the jet's tracks (None, None if the fit failed);
+    @coupleIndices(jet): returns np.array, the indices of the coupled tracks among the jet's tracks
+        (the vertex finding step of reconstruct);
+    @rejectionPath(tracks): returns the fitted vertices, the chi2 and the fitted tracks after each rejection
+        of the vertex fitting loop, run until less than two tracks are left (chi2Threshold is not used);
+    @vertexFinderBatch(batch): returns np.array of shape (nJets,maxTracks) of bool, the coupled tracks of
+        each jet of a JetBatch, in its padded layout;
+    @vertexFitterBatch(batch,coupled): returns np.array of shape (nJets,3), the fitted SVs, np.array of
+        shape (nJets,) of bool, the validity mask, and np.array of shape (nJets,maxTracks) of bool,
+        the tracks fitted to each SV (the jets are fitted at once only with fitter = "incremental");
+    @reconstructBatch(batch): returns the fitted SVs and the validity mask of all of the jets of a JetBatch (or EventFile);
+    @reconstructStream(batches): yields, for each JetBatch of an iterable (e.g. JetGenerator.iterBatches) or EventFile,
+        the batch, its fitted SVs and its validity mask;
 
     Private Methods:
-    @__distances(t,tracks): returns the array of distances between the track t and all of the tracks in the list;
+    @__distances(t,tracks): returns the array of distances between the track t and all of the tracks in the collection;
     @__chi2(vertex,tracks): chi2 to be minimized during vertex fitting step;
-    @__evaluateChi2(vfit,tracks): returns the list of the track's chi2 wrt the current fitted vertex;
+    @__chi2Gradient(vertex,tracks): analytic gradient of the chi2;
+    @__chi2Hessian(vertex,tracks): analytic hessian of the chi2;
+    @__minimize(SVfit0,tracks): minimizes the chi2 with the configured method and analytic derivatives;
+    @__evaluateChi2(vfit,tracks): returns the array of the track's chi2 wrt the current fitted vertex;
+    @__sequentialCouples(tracks): returns the list of the coupled tracks' indices, evaluating the distances
+        of each popped track from the remaining ones;
+    @__matrixCouples(distances): returns the list of the coupled tracks' indices, given the matrix of 
+        the track-track distances;
+    @__indexCouples(i,j): returns the list of the coupled tracks' indices, given the pairs of 
+        tracks closer than dThreshold sorted by first track, distance and second track;
+    @__distanceMatrix(tracks): returns the track-track distance matrix, counting the distance evaluations;
+    @__couples(tracks): returns the list of the coupled tracks' indices, with the configured finder;
+        the distance matrix is read from the jet's cache if it is enabled;
+    @__preSelect(tracks): returns the indices of the tracks that pass the pre-selection;
+    @__guess(tracks): returns the first guess of the vertex fitting;
+    @__incrementalFit(tracks,path): vertex fitting loop with the IncrementalFitter;
+    @__minimizeFit(tracks,path): vertex fitting loop with scipy.optimize.minimize;
+    @__fit(tracks,path): vertex fitting loop with the configured fitter;
+    @__recordFitStats(): adds the counters of the last fit to the instrumentation;
+    @__fitJets(batch,coupled): vertex fitting loop with the configured fitter on each jet of a batch;
+    @__batchFit(batch,coupled): vertex fitting loop on all of the jets of a batch at once (BatchFitter);
+    @__record(stage,seconds): adds the time of a stage to the instrumentation;
+    @__recordBatch(stage,seconds,nJets): adds the time of a stage of a batch to the instrumentation;
     '''
 
+    # Available vertex finding strategies
+    finders = ("matrix","sequential","index")
+    # Available first guesses of the vertex fitting
+    firstGuesses = ("analytic","fixed")
+    # Fixed first guess on the SV: flight length on the z components and non zero x and y
+    fixedGuess = [0.01,0.01,10.,]
+    # Available vertex fitting strategies
+    fitters = ("minimize","incremental")
+    # scipy.optimize.minimize methods that use the hessian
+    hessianMethods = ("Newton-CG","dogleg","trust-ncg","trust-krylov","trust-exact","trust-constr")
+
     # Constructor
-    def __init__(self, dThreshold = 6*0.001, chi2Threshold = 0.1) -> None:
+    def __init__(self, dThreshold = 6*0.001, chi2Threshold = 0.1, finder = "matrix",
+                 firstGuess = "analytic", warmStart = False, method = "BFGS", fitter = "minimize",
+                 preSelection = None, instrumentation = None) -> None:
+        if finder not in self.finders:
+            raise ValueError("Unknown finder '" + str(finder) + "', available: " + str(self.finders))
+        if fitter not in self.fitters:
+            raise ValueError("Unknown fitter '" + str(fitter) + "', available: " + str(self.fitters))
+        if firstGuess not in self.firstGuesses:
+            raise ValueError("Unknown first guess '" + str(firstGuess) + "', available: " + str(self.firstGuesses))
         self.dThreshold = dThreshold
         self.chi2Threshold = chi2Threshold
+        self.finder = finder
+        self.firstGuess = firstGuess
+        self.warmStart = warmStart
+        self.method = method
+        self.fitter = fitter
+        self.fitStats = {"minimizations": 0, "iterations": 0, "evaluations": 0, "rejections": 0}
+        self.preSelection = preSelection
+        self.instrumentation = instrumentation
+
+    def config(self):
+        '''
+        Returns the configuration of the algorithm.
+        Returns:
+        @config: dict of the constructor's parameters;
+        '''
+        return {"dThreshold": self.dThreshold, "chi2Threshold": self.chi2Threshold, "finder": self.finder,
+                "firstGuess": self.firstGuess, "warmStart": self.warmStart, "method": self.method,
+                "fitter": self.fitter,
+                "preSelection": self.preSelection.config() if self.preSelection is not None else None}
 
     def __distances(self,t,tracks):
         '''
-        Returns the array of distances between the track t and all of the tracks in the list.
+        Returns the array of distances between the track t and all of the tracks in the collection.
         Parameters:
         @t: current track;
-        @tracks: list of tracks from which evaluate the distances;
+        @tracks: TrackCollection of the tracks from which evaluate the distances;
         Returns:
-        @distances: np.array of the distances of track t from all of the tracks in the list;
+        @distances: np.array of the distances of track t from all of the tracks in the collection;
         '''
-        distances = []
-        for ts in tracks:
-            distances.append(t.trackDistance(ts))     
-        return np.asarray(distances)
+        return tracks.trackDistances(t)
 
     def __chi2(self,vertex,tracks):
         '''
         Evaluates the chi2 of the current vertex.
         Parameters:
         @vertex: np.array of shape (3,), current fitted secondary vertex;
-        @tracks: current list of tracks supposedly belonging to the secondary vertex;
+        @tracks: TrackCollection of the tracks supposedly belonging to the secondary vertex;
         Returns:
         @chi2: chi2 of the fit, defined as the sum of the distances of the tracks from the vertex;
         '''
-        vertex = np.asarray(vertex)
-        chi2 = 0
-        for t in tracks:
-            chi2 += t.pointDistance(vertex)
-        return chi2
+        return np.sum(tracks.pointDistances(vertex))
+
+    def __chi2Gradient(self,vertex,tracks):
+        '''
+        Evaluates the analytic gradient of the chi2 wrt the vertex.
+        Parameters:
+        @vertex: np.array of shape (3,), current fitted secondary vertex;
+        @tracks: TrackCollection of the tracks supposedly belonging to the secondary vertex;
+        Returns:
+        @gradient: np.array of shape (3,), the gradient of the chi2;
+        '''
+        return tracks.sumDistancesGradient(vertex)
+
+    def __chi2Hessian(self,vertex,tracks):
+        '''
+        Evaluates the analytic hessian of the chi2 wrt the vertex.
+        Parameters:
+        @vertex: np.array of shape (3,), current fitted secondary vertex;
+        @tracks: TrackCollection of the tracks supposedly belonging to the secondary vertex;
+        Returns:
+        @hessian: np.array of shape (3,3), the hessian of the chi2;
+        '''
+        return tracks.sumDistancesHessian(vertex)
+
+    def __minimize(self,SVfit0,tracks):
+        '''
+        Minimizes the chi2 of the tracks with the configured method, using the analytic derivatives.
+        Parameters:
+        @SVfit0: np.array of shape (3,), first guess on the vertex;
+        @tracks: TrackCollection of the tracks supposedly belonging to the secondary vertex;
+        Returns:
+        @result: scipy.optimize.OptimizeResult, the result of the minimization;
+        '''
+        # scipy.optimize is imported only by the "minimize" fitters
+        from scipy.optimize import minimize
+        hess = self.__chi2Hessian if self.method in self.hessianMethods else None
+        return minimize(self.__chi2,x0=SVfit0,args=(tracks,),method=self.method,jac=self.__chi2Gradient,hess=hess)
 
     def __evaluateChi2(self,vfit,tracks):
         '''
         Evaluates the tracks' chi2 from the current vertex.
         Parameters:
         @vfit: np.array of shape (3,), current fitted secondary vertex;
-        @tracks: current list of tracks supposedly belonging to the secondary vertex;
+        @tracks: TrackCollection of the tracks supposedly belonging to the secondary vertex;
         Returns:
         @chi2: np.array, the chi2 of the tracks from the fitted vertex;
         '''
-        chi2 = []
-        for t in tracks:
-            chi2.append(t.pointDistance(vfit))
-        return np.asarray(chi2)
+        return tracks.pointDistances(vfit)
 
-    def vertexFinder(self,jet):
+    def __sequentialCouples(self,tracks):
         '''
-        Implements the vertex finding step.
+        Couples the tracks evaluating, for each popped track, the distances from all of the remaining ones.
         Parameters:
-        @jet: instance of Jet, the event on which apply SSVF;
+        @tracks: TrackCollection of the jet's tracks;
         Returns:
-        @couples: list of lists of Track, where the entry i is the i-th couple of tracks found
-            by the algorithm;
+        @couples: list of couples of indices of the coupled tracks;
         '''
         couples = []
-        # Joining all the jets' track
-        tracks = jet.tracksPV + jet.tracksSV + jet.tracksPileup
         # Track indices
         indices = [i for i in range(len(tracks))]
         # Coupling loop
-        while len(tracks)>1:
+        while len(indices)>1:
             # Pop the current track that will be coupled
-            i,t = indices.pop(0),tracks.pop(0)
+            i = indices.pop(0)
             # Evaluate the distances wrt all of the other tracks
-            distances = self.__distances(t,tracks)
+            distances = self.__distances(tracks.track(i),tracks.subset(indices))
+            if self.instrumentation is not None:
+                self.instrumentation.add("distanceEvaluations",len(indices))
             # Find the closest track
             jt = np.argmin(distances)
             # If the track are close enough, couple them
             if distances[jt]<self.dThreshold:
-                j = indices[jt]
-                tj = tracks.pop(jt)
-                couples.append([t,tj])
+                couples.append([i,indices.pop(jt)])
+        return couples
+
+    def __matrixCouples(self,distances):
+        '''
+        Couples the tracks with the same greedy strategy of __sequentialCouples, 
+        reading the distances from the precomputed track-track distance matrix.
+        Parameters:
+        @distances: np.array of shape (N,N), distances[i,j] is the distance of track i from track j;
+        Returns:
+        @couples: list of couples of indices of the coupled tracks;
+        '''
+        couples = []
+        # Tracks that have not been popped or coupled yet
+        available = np.ones(distances.shape[0],dtype=bool)
+        for i in range(distances.shape[0]):
+            if not available[i]:
+                continue
+            available[i] = False
+            # Distances from the remaining tracks, masking the unavailable ones
+            di = np.where(available,distances[i],np.inf)
+            j = np.argmin(di)
+            # If the track are close enough, couple them
+            if di[j]<self.dThreshold:
+                available[j] = False
+                couples.append([i,j])
+        return couples
+
+    def __indexCouples(self,i,j):
+        '''
+        Couples the tracks with the same greedy strategy of __sequentialCouples, reading the candidates 
+        from the pairs closer than dThreshold: for each popped track, the closest available track among 
+        its pairs is the one __matrixCouples would find.
+        Parameters:
+        @i: np.array, first tracks of the pairs closer than dThreshold, sorted;
+        @j: np.array, second tracks of the pairs, sorted by distance (then index) for each first track;
+        Returns:
+        @couples: list of couples of indices of the coupled tracks;
+        '''
+        couples = []
+        # The tracks before the popped one have already been popped
+        upper = j>i
+        i, j = i[upper], j[upper]
+        coupled = set()
+        # First pair of each popped track
+        starts = np.flatnonzero(np.r_[True,i[1:]!=i[:-1]]) if len(i)>0 else []
+        stops = np.r_[starts[1:],len(i)] if len(i)>0 else []
+        for start, stop in zip(starts,stops):
+            if i[start] in coupled:
+                continue
+            for k in range(start,stop):
+                if j[k] not in coupled:
+                    coupled.add(j[k])
+                    couples.append([int(i[start]),int(j[k])])
+                    break
+        return couples
 
+    def __distanceMatrix(self,tracks):
+        '''
+        Evaluates the track-track distance matrix, counting the distance evaluations.
+        Parameters:
+        @tracks: TrackCollection of the jet's tracks;
+        Returns:
+        @distances: np.array of shape (N,N), result of tracks.distanceMatrix();
+        '''
+        if self.instrumentation is not None:
+            self.instrumentation.add("distanceEvaluations",len(tracks)**2)
+        return tracks.distanceMatrix()
+
+    def __couples(self,tracks):
+        '''
+        Couples the tracks with the configured finder.
+        Parameters:
+        @tracks: TrackCollection of the jet's tracks;
+        Returns:
+        @couples: list of couples of indices of the coupled tracks;
+        '''
+        if self.finder == "matrix":
+            return self.__matrixCouples(tracks.cached("distanceMatrix",lambda: self.__distanceMatrix(tracks)))
+        if self.finder == "index":
+            i, j, _ = tracks.closePairs(self.dThreshold)
+            return self.__indexCouples(i,j)
+        return self.__sequentialCouples(tracks)
+
+    def __record(self,stage,seconds):
+        '''
+        Adds the time of a stage to the current event of the instrumentation, and to its total time.
+        Parameters:
+        @stage: name of the stage ("finder" or "fitter");
+        @seconds: time of the stage [s];
+        '''
+        self.instrumentation.add(stage+"Time",seconds)
+        self.instrumentation.add("totalTime",seconds)
+
+    def __recordBatch(self,stage,seconds,nJets):
+        '''
+        Adds the time of a stage of a batch to the last nJets events of the instrumentation, shared equally
+        by the jets, and to their total times.
+        Parameters:
+        @stage: name of the stage ("finder" or "fitter");
+        @seconds: time of the stage on the whole batch [s];
+        @nJets: number of jets of the batch;
+        '''
+        times = np.full(nJets,seconds/max(nJets,1))
+        self.instrumentation.addEvents(stage+"Time",times)
+        self.instrumentation.addEvents("totalTime",times)
+
+    def __preSelect(self,tracks):
+        '''
+        Applies the pre-selection to the tracks.
+        Parameters:
+        @tracks: TrackCollection of the jet's tracks;
+        Returns:
+        @selected: np.array, indices of the tracks that pass the pre-selection (all of them if
+            there is no pre-selection);
+        '''
+        if self.preSelection is None:
+            return np.arange(len(tracks))
+        selected = self.preSelection.select(tracks.origins,tracks.versors)
+        if self.instrumentation is not None:
+            self.instrumentation.add("preSelectionRemoved",len(tracks)-np.sum(selected))
+        return np.flatnonzero(selected)
+
+    def vertexFinder(self,jet):
+        '''
+        Implements the vertex finding step.
+        Parameters:
+        @jet: instance of Jet or TrackCollection, the event on which apply SSVF;
+        Returns:
+        @couples: list of lists of Track, where the entry i is the i-th couple of tracks found
+            by the algorithm;
+        '''
+        if self.instrumentation is not None:
+            self.instrumentation.newEvent()
+            start = time.perf_counter()
+        # Joining all the jets' track
+        tracks = TrackCollection.asCollection(jet)
+        if self.preSelection is not None:
+            tracks = tracks.subset(self.__preSelect(tracks))
+        couples = [[tracks.track(i),tracks.track(j)] for i,j in self.__couples(tracks)]
+        if self.instrumentation is not None:
+            self.__record("finder",time.perf_counter()-start)
         return couples
 
 
+    def __guess(self,tracks):
+        '''
+        Returns the first guess of the vertex fitting.
+        Parameters:
+        @tracks: TrackCollection of the selected tracks;
+        Returns:
+        @SVfit0: np.array of shape (3,), the first guess on the SV;
+        '''
+        if self.firstGuess == "analytic":
+            try:
+                return tracks.closestPoint()
+            except np.linalg.LinAlgError:
+                # Degenerate tracks' configuration, fall back on the fixed guess
+                pass
+        return np.array(self.fixedGuess)
+
+    def __incrementalFit(self,tracks,path=None):
+        '''
+        Vertex fitting loop with the IncrementalFitter: the rejected tracks are removed from the 
+        fitter's weighted sums instead of refitting the remaining tracks from scratch.
+        Parameters:
+        @tracks: TrackCollection of the coupled tracks;
+        @path: list to which the fitted vertex, the chi2 and the fitted tracks of each step are appended;
+            if it is given, the loop does not stop at chi2Threshold (None, default);
+        Returns:
+        @SVfit: np.array of shape (3,), the fitted secondary vertex;
+        @selected: np.array, indices of the tracks supposed to belong to the fitted SV;
+        '''
+        chi2Threshold = self.chi2Threshold if path is None else -np.inf
+        fitter = IncrementalFitter(tracks)
+        SVfit = fitter.fit(self.__guess(tracks))
+        self.fitStats["minimizations"] += 1
+        # Fitting loop
+        while True:
+            # Evaluate the per-track chi2 of the current fitted vertex
+            chi2s = fitter.chi2s()
+            if path is not None:
+                path.append((np.array(SVfit),np.sum(chi2s),fitter.activeIndices()))
+            # If the chi2 is below the threshold (or there are no tracks), stop
+            if np.sum(chi2s)< chi2Threshold or len(chi2s)==0:
+                break
+            # Else, reject the worst track
+            i = fitter.activeIndices()[np.argmax(chi2s)]
+            self.fitStats["rejections"] += 1
+            # If no more couples are there, stop and return invalid results
+            if len(chi2s)-1<2:
+                SVfit = None
+                break
+            SVfit = fitter.remove(i)
+            self.fitStats["minimizations"] += 1
+        self.fitStats["iterations"] = fitter.nIterations
+        self.fitStats["evaluations"] = fitter.nEvaluations
+        if SVfit is None:
+            return None,None
+        return SVfit, fitter.activeIndices()
+
+    def __minimizeFit(self,tracks,path=None):
+        '''
+        Vertex fitting loop with scipy.optimize.minimize: after each rejection the chi2 of the 
+        remaining tracks is minimized again.
+        Parameters:
+        @tracks: TrackCollection of the coupled tracks;
+        @path: list to which the fitted vertex, the chi2 and the fitted tracks of each step are appended;
+            if it is given, the loop does not stop at chi2Threshold (None, default);
+        Returns:
+        @SVfit: np.array of shape (3,), the fitted secondary vertex;
+        @selected: np.array, indices of the tracks supposed to belong to the fitted SV;
+        '''
+        chi2Threshold = self.chi2Threshold if path is None else -np.inf
+        selected = np.arange(len(tracks))
+        # First guess on the SV
+        SVfit0 = self.__guess(tracks)
+        # Fitting loop
+        while True:
+            # Minimize the chi2 with the current tracks
+            result = self.__minimize(SVfit0,tracks)
+            SVfit = result.x
+            self.fitStats["minimizations"] += 1
+            self.fitStats["iterations"] += result.nit
+            self.fitStats["evaluations"] += result.nfev
+            # Evaluate the per-track chi2 of the current fitted vertex
+            chi2s = self.__evaluateChi2(SVfit,tracks)
+            # Evaluate the total chi2
+            currentChi2 = np.sum(chi2s)
+            if path is not None:
+                path.append((np.array(SVfit),currentChi2,selected))
+            # If the chi2 is below the threshold (or there are no tracks), stop
+            if currentChi2< chi2Threshold or len(chi2s)==0:
+                break
+            # Else, reject the worst track
+            i = np.argmax(chi2s)
+            selected = np.delete(selected,i)
+            tracks = tracks.subset(np.arange(len(tracks))!=i)
+            self.fitStats["rejections"] += 1
+            # If no more couples are there, stop and return invalid results
+            if len(selected)<2:
+                return None,None
+            # Next first guess: previous solution or new guess on the remaining tracks
+            SVfit0 = SVfit if self.warmStart else self.__guess(tracks)
+        return SVfit, selected
+
+    def __fit(self,tracks,path=None):
+        '''
+        Vertex fitting loop with the configured fitter.
+        Parameters:
+        @tracks: TrackCollection of the coupled tracks;
+        @path: list to which the steps of the loop are appended, see rejectionPath (None, default);
+        Returns:
+        @SVfit: np.array of shape (3,), the fitted secondary vertex, None if the fit failed;
+        @selected: np.array, indices of the tracks supposed to belong to the fitted SV, None if the fit failed;
+        '''
+        self.fitStats = {"minimizations": 0, "iterations": 0, "evaluations": 0, "rejections": 0}
+        if self.fitter == "incremental":
+            return self.__incrementalFit(tracks,path)
+        return self.__minimizeFit(tracks,path)
+
+    def __recordFitStats(self):
+        '''
+        Adds the counters of the last fit (fitStats) to the current event of the instrumentation.
+        '''
+        for name, value in self.fitStats.items():
+            self.instrumentation.add(name,value)
+
     def vertexFitter(self,couples):
         '''
         Implements the vertex fitting step.
@@ -113,29 +497,269 @@ class SSVF:
         @selectedTracks: list of Track instances, the tracks supposed to belong to the fitted SV;
         '''
 
+        if self.instrumentation is not None:
+            start = time.perf_counter()
         selectedTracks = []
         # Flatten the coupled track list
         for c in couples:
             for t in c:
                 selectedTracks.append(t)
-        chi2 = 10000.
-        # First guess on the SV: flight length on the z components and non zero x and y
-        SVfit0 = [0.01,0.01,10.,]
-        # Fitting loop
-        while True:
-            # Minimize the chi2 with the current tracks
-            SVfit = minimize(self.__chi2,x0=SVfit0,args=selectedTracks).x
-            # Evaluate the per-track chi2 of the current fitted vertex
-            chi2s = self.__evaluateChi2(SVfit,selectedTracks)
-            # Evaluate the total chi2
-            currentChi2 = np.sum(chi2s)
+        SVfit, selected = self.__fit(TrackCollection.fromTracks(selectedTracks))
+        if self.instrumentation is not None:
+            self.__recordFitStats()
+            self.__record("fitter",time.perf_counter()-start)
+        if SVfit is None:
+            return None,None
+        return SVfit, [selectedTracks[i] for i in selected]
+
+    def reconstruct(self,jet):
+        '''
+        Applies vertex finding and vertex fitting to a jet.
+        Parameters:
+        @jet: instance of Jet or TrackCollection;
+        Returns:
+        @SVfit: np.array of shape (3,), the fitted secondary vertex, None if the fit failed;
+        @selected: np.array, indices of the tracks supposed to belong to the fitted SV among the jet's
+            tracks (PV, SV and pileup, in this order), None if the fit failed;
+        '''
+        if self.instrumentation is not None:
+            self.instrumentation.newEvent()
+            start = time.perf_counter()
+        tracks = TrackCollection.asCollection(jet)
+        coupled = self.coupleIndices(tracks)
+        if self.instrumentation is not None:
+            middle = time.perf_counter()
+            self.__record("finder",middle-start)
+        SVfit, selected = self.__fit(tracks.subset(coupled))
+        if self.instrumentation is not None:
+            self.__recordFitStats()
+            self.__record("fitter",time.perf_counter()-middle)
+        if SVfit is None:
+            return None,None
+        return SVfit, coupled[selected]
+
+    def coupleIndices(self,jet):
+        '''
+        Implements the vertex finding step of reconstruct.
+        Parameters:
+        @jet: instance of Jet or TrackCollection;
+        Returns:
+        @coupled: np.array, indices of the coupled tracks among the jet's tracks (PV, SV and pileup,
+            in this order), the two tracks of each couple one after the other;
+        '''
+        tracks = TrackCollection.asCollection(jet)
+        # Indices of the pre-selected tracks among the jet's tracks
+        preSelected = self.__preSelect(tracks)
+        if self.preSelection is not None:
+            tracks = tracks.subset(preSelected)
+        # Flatten the couples' indices
+        coupled = np.array(self.__couples(tracks),dtype=int).reshape(-1)
+        return preSelected[coupled]
+
+    def rejectionPath(self,tracks):
+        '''
+        Runs the vertex fitting loop until less than two tracks are left, without stopping at chi2Threshold:
+        the fit with any chi2Threshold stops at the first step whose chi2 is below the threshold (and fails if
+        there is none), so the results of all of the thresholds can be read from the path.
+        Parameters:
+        @tracks: TrackCollection (or list of Track instances) of the coupled tracks;
+        Returns:
+        @vertices: np.array of shape (nSteps,3), the fitted vertex of each step;
+        @chi2: np.array of shape (nSteps,), the chi2 of each step;
+        @selected: list of nSteps np.array, the indices of the tracks fitted at each step;
+        '''
+        path = []
+        self.__fit(TrackCollection.asCollection(tracks),path)
+        if self.instrumentation is not None:
+            self.__recordFitStats()
+        vertices = np.array([vertex for vertex,_,_ in path]).reshape(-1,3)
+        chi2 = np.array([chi2 for _,chi2,_ in path])
+        return vertices, chi2, [selected for _,_,selected in path]
+
+    def vertexFinderBatch(self,batch):
+        '''
+        Implements the vertex finding step on all of the jets of a batch at once: the greedy coupling
+        of vertexFinder runs on the stacked distance matrices, one track index at a time for all of the jets.
+        A new event of the instrumentation is started for each jet, and the finding time is shared equally
+        by the jets.
+        Parameters:
+        @batch: instance of JetBatch;
+        Returns:
+        @coupled: np.array of shape (nJets,maxTracks) of bool, the coupled tracks of each jet
+            in the padded layout of the batch;
+        '''
+        if self.instrumentation is not None:
+            start = time.perf_counter()
+        distances = batch.distanceMatrices()
+        origins, versors, mask = batch.padded()
+        nJets, maxTracks = mask.shape
+        jets = np.arange(nJets)
+        # Tracks that have not been popped or coupled yet
+        available = mask.copy()
+        if self.preSelection is not None:
+            available = self.preSelection.select(origins,versors,mask)
+        nSelected = np.sum(available,axis=1)
+        coupled = np.zeros(mask.shape,dtype=bool)
+        for i in range(maxTracks):
+            popped = available[:,i].copy()
+            available[:,i] = False
+            # Distances from the remaining tracks, masking the unavailable ones
+            di = np.where(available,distances[:,i,:],np.inf)
+            j = np.argmin(di,axis=1)
+            # If the track are close enough, couple them
+            couple = popped & (di[jets,j]<self.dThreshold)
+            coupled[couple,i] = True
+            coupled[jets[couple],j[couple]] = True
+            available[jets[couple],j[couple]] = False
+        if self.instrumentation is not None:
+            # One event per jet, as vertexFinder
+            for _ in range(nJets):
+                self.instrumentation.newEvent()
+            nTracks = np.sum(mask,axis=1)
+            self.instrumentation.addEvents("distanceEvaluations",nTracks**2)
+            if self.preSelection is not None:
+                self.instrumentation.addEvents("preSelectionRemoved",nTracks-nSelected)
+            self.__recordBatch("finder",time.perf_counter()-start,nJets)
+        return coupled
+
+    def __fitJets(self,batch,coupled):
+        '''
+        Vertex fitting loop of the configured fitter on each jet of a batch, one jet at a time.
+        Parameters:
+        @batch: instance of JetBatch;
+        @coupled: np.array of shape (nJets,maxTracks) of bool, result of vertexFinderBatch;
+        Returns:
+        @SVfit: np.array of shape (nJets,3), the fitted secondary vertices (np.nan if not valid);
+        @valid: np.array of shape (nJets,) of bool, False if the fit failed;
+        @selected: np.array of shape (nJets,maxTracks) of bool, the tracks supposed to belong to the SVs;
+        @stats: dict of np.array of shape (nJets,), the fitStats of each jet;
+        '''
+        nJets = len(batch)
+        SVfit = np.full((nJets,3),np.nan)
+        valid = np.zeros(nJets,dtype=bool)
+        selected = np.zeros(coupled.shape,dtype=bool)
+        stats = {name: np.zeros(nJets,dtype=int) for name in self.fitStats}
+        for b in range(nJets):
+            indices = np.flatnonzero(coupled[b])
+            tracks = batch.tracks(b).subset(indices)
+            # Couples' order of vertexFinder: each track is coupled to the closest of the coupled tracks
+            order = np.array(self.__matrixCouples(tracks.distanceMatrix()),dtype=int).reshape(-1)
+            if len(order) == len(indices):
+                indices, tracks = indices[order], tracks.subset(order)
+            vertex, fitted = self.__fit(tracks)
+            for name, value in self.fitStats.items():
+                stats[name][b] = value
+            if vertex is not None:
+                SVfit[b], valid[b] = vertex, True
+                selected[b,indices[fitted]] = True
+        return SVfit, valid, selected, stats
+
+    def __batchFit(self,batch,coupled):
+        '''
+        Vertex fitting loop on all of the jets of a batch at once, with the BatchFitter: at each step the
+        jets whose chi2 is above threshold reject their worst track and are refitted. The rejected tracks
+        are removed incrementally with the same IRLS iterations of the IncrementalFitter.
+        Parameters:
+        @batch: instance of JetBatch;
+        @coupled: np.array of shape (nJets,maxTracks) of bool, result of vertexFinderBatch;
+        Returns:
+        @SVfit: np.array of shape (nJets,3), the fitted secondary vertices (np.nan if not valid);
+        @valid: np.array of shape (nJets,) of bool, False if the fit failed;
+        @selected: np.array of shape (nJets,maxTracks) of bool, the tracks supposed to belong to the SVs;
+        @stats: dict of np.array of shape (nJets,), the fitStats of each jet;
+        '''
+        origins, versors, _ = batch.padded()
+        fitter = BatchFitter(origins,versors,coupled)
+        if self.firstGuess == "analytic":
+            SVfit0 = fitter.closestPoints(self.fixedGuess)
+        else:
+            SVfit0 = np.tile(np.asarray(self.fixedGuess,dtype=float),(len(batch),1))
+        fitter.fit(SVfit0)
+        nJets = len(batch)
+        valid = np.zeros(nJets,dtype=bool)
+        minimizations = np.ones(nJets,dtype=int)
+        rejections = np.zeros(nJets,dtype=int)
+        # Jets still in the fitting loop
+        pending = np.ones(nJets,dtype=bool)
+        while np.any(pending):
+            # Evaluate the per-track chi2 of the current fitted vertices
+            chi2s = fitter.chi2s()
             # If the chi2 is below the threshold, stop
-            if currentChi2< self.chi2Threshold:
-                break
+            converged = pending & (np.sum(chi2s,axis=1)<self.chi2Threshold)
+            valid |= converged
+            pending &= ~converged
             # Else, reject the worst track
-            i = np.argmax(chi2s)
-            selectedTracks.pop(i)
+            rows = np.flatnonzero(pending)
+            worst = np.argmax(np.where(fitter.active[rows],chi2s[rows],-np.inf),axis=1)
+            rejections[rows] += 1
             # If no more couples are there, stop and return invalid results
-            if len(selectedTracks)<2:
-                return None,None
-        return SVfit, selectedTracks
\ No newline at end of file
+            failed = np.sum(fitter.active[rows],axis=1)-1<2
+            pending[rows[failed]] = False
+            minimizations[rows[~failed]] += 1
+            fitter.remove(rows[~failed],worst[~failed])
+        SVfit = np.where(valid[:,None],fitter.vertices,np.nan)
+        # The distances are evaluated once at the start of each refit and twice per iteration
+        evaluations = np.where(np.any(coupled,axis=1),minimizations,0) + 2*fitter.nIterations
+        stats = {"minimizations": minimizations, "iterations": fitter.nIterations,
+                 "evaluations": evaluations, "rejections": rejections}
+        return SVfit, valid, fitter.active & valid[:,None], stats
+
+    def vertexFitterBatch(self,batch,coupled):
+        '''
+        Implements the vertex fitting step on all of the jets of a batch. With fitter = "incremental" all
+        of the jets are fitted at once with the BatchFitter; with fitter = "minimize" the jets are fitted one
+        at a time with the configured method, first guess and warm start, as in reconstruct.
+        The fitStats are the sums over the jets of the batch, and the counters and the fitting time (shared
+        equally by the jets) are added to the last nJets events of the instrumentation (see vertexFinderBatch).
+        Parameters:
+        @batch: instance of JetBatch;
+        @coupled: np.array of shape (nJets,maxTracks) of bool, result of vertexFinderBatch;
+        Returns:
+        @SVfit: np.array of shape (nJets,3), the fitted secondary vertices (np.nan if not valid);
+        @valid: np.array of shape (nJets,) of bool, False if the fit failed;
+        @selected: np.array of shape (nJets,maxTracks) of bool, the tracks supposed to belong to the SVs;
+        '''
+        if self.instrumentation is not None:
+            start = time.perf_counter()
+        if self.fitter == "incremental":
+            SVfit, valid, selected, stats = self.__batchFit(batch,coupled)
+        else:
+            SVfit, valid, selected, stats = self.__fitJets(batch,coupled)
+        self.fitStats = {name: int(np.sum(values)) for name, values in stats.items()}
+        if self.instrumentation is not None:
+            for name, values in stats.items():
+                self.instrumentation.addEvents(name,values)
+            self.__recordBatch("fitter",time.perf_counter()-start,len(batch))
+        return SVfit, valid, selected
+
+    def reconstructBatch(self,batch):
+        '''
+        Applies vertex finding and vertex fitting to all of the jets of a batch.
+        Parameters:
+        @batch: instance of JetBatch or EventFile (all of its jets are read at once);
+        Returns:
+        @SVfit: np.array of shape (nJets,3), the fitted secondary vertices (np.nan if not valid);
+        @valid: np.array of shape (nJets,) of bool, False if the fit failed;
+        '''
+        if isinstance(batch,EventFile):
+            batch = batch.batch()
+        SVfit, valid, _ = self.vertexFitterBatch(batch,self.vertexFinderBatch(batch))
+        return SVfit, valid
+
+    def reconstructStream(self,batches):
+        '''
+        Applies vertex finding and vertex fitting to a stream of batches, one batch at a time,
+        so that only the current batch is held in memory.
+        Parameters:
+        @batches: iterable of JetBatch instances, e.g. JetGenerator.iterBatches(chunkSize) or
+            EventFile.iterBatches(chunkSize), or EventFile (read in batches of 10000 jets);
+        Yields:
+        @batch: instance of JetBatch, the current batch;
+        @SVfit: np.array of shape (nJets,3), the fitted secondary vertices (np.nan if not valid);
+        @valid: np.array of shape (nJets,) of bool, False if the fit failed;
+        '''
+        if isinstance(batches,EventFile):
+            batches = batches.iterBatches()
+        for batch in batches:
+            SVfit, valid = self.reconstructBatch(batch)
+            yield batch, SVfit, valid
@@ -0,0 +1,137 @@
+import numpy as np
+import copy
+from modules.TrackCollection import TrackCollection
+from modules.JetCache import JetCache
+from modules.SSVF import SSVF
+
+class ThresholdScan:
+    '''
+    Class that implements the scan of the SSVF thresholds (dThreshold, chi2Threshold) on a sample of jets,
+    without running the whole reconstruction for each point of the grid:
+    - the track-track distances do not depend on dThreshold: the distance matrix of each jet is evaluated
+      once (JetCache) and the couples of each dThreshold are read from it;
+    - the fitting loop of a set of coupled tracks does not depend on chi2Threshold until it stops: the
+      rejection path (SSVF.rejectionPath) is evaluated once for each distinct set of coupled tracks, and
+      the fit of each chi2Threshold stops at the first step of the path whose chi2 is below the threshold.
+    The fitted SVs are the ones of SSVF(dThreshold,chi2Threshold,...).reconstruct for each point of the grid.
+    Public Members:
+    @self.ssvf: SSVF instance, whose configuration (except the thresholds) is scanned; its pre-selection
+        is applied once per jet, its instrumentation is not used;
+    @self.dThresholds: np.array of shape (nD,), distance thresholds of the vertex finding [mm];
+    @self.chi2Thresholds: np.array of shape (nChi2,), chi2 thresholds of the vertex fitting;
+    @self.nJets: number of jets of the last scan;
+    @self.nPaths: number of rejection paths evaluated in the last scan;
+
+    Public Methods:
+    @scan(jets): returns dict, the fitted SVs and the efficiency and the errors for each point of the grid;
+
+    Private Methods:
+    @__events(jets): yields the tracks and the true SV of each jet;
+    @__stops(chi2): returns the step of the path at which each chi2Threshold stops the fit, and its validity;
+    '''
+
+    # Constructor
+    def __init__(self, dThresholds, chi2Thresholds, ssvf = None):
+        '''
+        Constructor of the class.
+        Parameters:
+        @dThresholds: list or np.array, distance thresholds of the vertex finding [mm];
+        @chi2Thresholds: list or np.array, chi2 thresholds of the vertex fitting;
+        @ssvf: SSVF instance with the configuration to scan (default: SSVF());
+        '''
+        self.ssvf = SSVF() if ssvf is None else ssvf
+        self.dThresholds = np.asarray(dThresholds,dtype=float).reshape(-1)
+        self.chi2Thresholds = np.asarray(chi2Thresholds,dtype=float).reshape(-1)
+        self.nJets = 0
+        self.nPaths = 0
+
+    def __events(self,jets):
+        '''
+        Iterates over the jets.
+        Parameters:
+        @jets: list of Jet instances, or JetBatch;
+        Returns:
+        @events: generator of (tracks,SV), the TrackCollection of the jet's tracks and the true SV;
+        '''
+        if hasattr(jets,"offsets"):
+            for b in range(len(jets)):
+                yield jets.tracks(b), jets.SV[b]
+        else:
+            for jet in jets:
+                yield TrackCollection.asCollection(jet), jet.SV
+
+    def __stops(self,chi2):
+        '''
+        Finds the step at which the fitting loop stops for each chi2Threshold.
+        Parameters:
+        @chi2: np.array of shape (nSteps,), the chi2 of each step of a rejection path;
+        Returns:
+        @stops: np.array of shape (nChi2,), the first step whose chi2 is below each threshold;
+        @valid: np.array of shape (nChi2,) of bool, False if no step is below the threshold (failed fit);
+        '''
+        below = chi2[None,:] < self.chi2Thresholds[:,None]
+        return np.argmax(below,axis=1), np.any(below,axis=1)
+
+    def scan(self,jets):
+        '''
+        Reconstructs the jets with each point of the grid of thresholds.
+        Parameters:
+        @jets: list of Jet instances, or JetBatch;
+        Returns:
+        @results: dict with
+            "dThresholds", "chi2Thresholds": the grid;
+            "vertices": np.array of shape (nJets,nD,nChi2,3), the fitted SVs (NaN if the fit failed);
+            "valid": np.array of shape (nJets,nD,nChi2) of bool, the validity of the fits;
+            "efficiency": np.array of shape (nD,nChi2), the fraction of valid fits;
+            "meanError", "errorStd": np.array of shape (nD,nChi2), the mean and the standard deviation of the
+                distance of the valid fitted SVs from the true ones [mm] (NaN if there are none);
+            "paths": number of rejection paths evaluated;
+        '''
+        # The finders differ only by dThreshold; the pre-selection is applied once per jet
+        finders = []
+        for dThreshold in self.dThresholds:
+            finder = copy.copy(self.ssvf)
+            finder.dThreshold = dThreshold
+            finder.preSelection = None
+            finder.instrumentation = None
+            finders.append(finder)
+        fitter = copy.copy(self.ssvf)
+        fitter.instrumentation = None
+        vertices, valid, errors = [], [], []
+        self.nPaths = 0
+        for tracks, SV in self.__events(jets):
+            if self.ssvf.preSelection is not None:
+                tracks = tracks.subset(self.ssvf.preSelection.select(tracks.origins,tracks.versors))
+            else:
+                tracks = tracks.subset(np.arange(len(tracks)))
+            # Private cache of the scan: the distance matrix is evaluated by the first finder only
+            tracks.cache = JetCache()
+            # Rejection path of each distinct set of coupled tracks
+            paths = {}
+            jetVertices = np.full((len(self.dThresholds),len(self.chi2Thresholds),3),np.nan)
+            jetValid = np.zeros((len(self.dThresholds),len(self.chi2Thresholds)),dtype=bool)
+            for i, finder in enumerate(finders):
+                coupled = finder.coupleIndices(tracks)
+                key = tuple(coupled)
+                if key not in paths:
+                    paths[key] = fitter.rejectionPath(tracks.subset(coupled))[:2]
+                    self.nPaths += 1
+                pathVertices, chi2 = paths[key]
+                stops, jetValid[i] = self.__stops(chi2)
+                jetVertices[i,jetValid[i]] = pathVertices[stops[jetValid[i]]]
+            vertices.append(jetVertices)
+            valid.append(jetValid)
+            errors.append(np.linalg.norm(jetVertices-SV,axis=2))
+        self.nJets = len(vertices)
+        shape = (self.nJets,len(self.dThresholds),len(self.chi2Thresholds))
+        vertices = np.array(vertices).reshape(shape+(3,))
+        valid = np.array(valid,dtype=bool).reshape(shape)
+        errors = np.array(errors).reshape(shape)
+        nValid = np.sum(valid,axis=0)
+        with np.errstate(invalid="ignore",divide="ignore"):
+            meanError = np.sum(np.where(valid,errors,0.),axis=0)/nValid
+            errorStd = np.sqrt(np.sum(np.where(valid,(errors-meanError)**2,0.),axis=0)/nValid)
+        return {"dThresholds": self.dThresholds, "chi2Thresholds": self.chi2Thresholds,
+                "vertices": vertices, "valid": valid,
+                "efficiency": nValid/max(self.nJets,1), "meanError": meanError, "errorStd": errorStd,
+                "paths": self.nPaths}
@@ -4,31 +4,144 @@ import math as m
 class Track:
     '''
     Class that implements the representation of a track as a straight line with an origin and a versor.
+    The tracks have no per-instance dictionary (__slots__), and their origin and versor can be views of
+    the rows of shared arrays (fromRow), so that many tracks take little more memory than their coordinates.
     Public Members:
     @self.origin: np.array of shape (3,), (x,y,z) coordinates of the track's origin;
     @self.versor: np.array of shape (3,), (x,y,z) components of the track's versor
         with current choice of reference system they are (cos(phi)sin(theta),sin(phi)sin(theta),cos(theta))
+    @self.IP: double, impact parameter of the track (distance from the origin), evaluated at the first
+        access and cached until the origin or the versor are assigned; it can also be assigned (None
+        restores the evaluated value);
+    @self.unitVersor: np.array of shape (3,), the normalized versor;
+    @self.originVersor: double, origin·unitVersor;
+    @self.moment: np.array of shape (3,), the moment origin×unitVersor of the line: the distance of a
+        point P from the track is |P×unitVersor - moment|;
+    The line invariants (unitVersor, originVersor, moment) are evaluated at the first distance query
+    and cached until the origin or the versor are assigned.
+    The tracks whose origin or versor are views of shared arrays (fromRow, the tracks of columnar jets
+    and of JetBatch) do not cache IP and the line invariants: they are evaluated at each access, so that
+    they follow the in-place changes of the shared arrays.
 
     Public Methods:
+    @fromRow(row): returns Track, the track whose origin and versor are views of a row [x,y,z,vx,vy,vz];
     @evaluate(t): returns np.array of shape (3,), evaluates the parametric representation of the line 
         where t is the value of the line's parameter; 
     @trackDistance(track): returns double, the minimum distance of the current track 
         from the track given in input;
     @pointDistance(P): returns double, the minimum distance of the track from the point P;
     @print(): prints the track's origin and versor;
+
+    Private Methods:
+    @__invariants(): returns the tuple of the track's cached line invariants, as floats;
+    @__pointDistance(x,y,z): returns double, the distance of the point (x,y,z) from the track;
     '''
 
+    __slots__ = ("__origin","__versor","__IP","__lineInvariants","__shared")
+
     # Constructor
     def __init__(self, origin=[], versor=[]):
         '''
         Constructor of the class.
         Parameters:
-        @origin: origin of the track, np.array or list of shape (3,);
-        @versor: versor of the track, np.array or list of shape (3,);
+        @origin: origin of the track, np.array or list of shape (3,) (arrays are not copied);
+        @versor: versor of the track, np.array or list of shape (3,) (arrays are not copied);
+        '''
+        self.__origin = np.asarray(origin)
+        self.__versor = np.asarray(versor)
+        self.__IP = None
+        self.__lineInvariants = None
+        self.__shared = self.__origin.base is not None or self.__versor.base is not None
+
+    @classmethod
+    def fromRow(cls, row):
+        '''
+        Builds a track as a view of a row of a shared array, e.g. of a (nTracks,6) array of tracks.
+        Parameters:
+        @row: np.array of shape (6,), the origin's coordinates followed by the versor's components;
+        Returns:
+        @track: instance of Track, whose origin and versor are views of row;
+        '''
+        return cls(row[:3],row[3:6])
+
+    @property
+    def origin(self):
+        return self.__origin
+
+    @origin.setter
+    def origin(self, origin):
+        self.__origin = np.asarray(origin)
+        self.__IP = None
+        self.__lineInvariants = None
+        self.__shared = self.__origin.base is not None or self.__versor.base is not None
+
+    @property
+    def versor(self):
+        return self.__versor
+
+    @versor.setter
+    def versor(self, versor):
+        self.__versor = np.asarray(versor)
+        self.__IP = None
+        self.__lineInvariants = None
+        self.__shared = self.__origin.base is not None or self.__versor.base is not None
+
+    @property
+    def IP(self):
+        if self.__IP is not None:
+            return self.__IP
+        IP = self.__pointDistance(0.,0.,0.)
+        if not self.__shared:
+            self.__IP = IP
+        return IP
+
+    @IP.setter
+    def IP(self, IP):
+        self.__IP = IP
+
+    @property
+    def unitVersor(self):
+        return np.array(self.__invariants()[3:6])
+
+    @property
+    def originVersor(self):
+        return self.__invariants()[6]
+
+    @property
+    def moment(self):
+        return np.array(self.__invariants()[7:10])
+
+    def __invariants(self):
+        '''
+        Evaluates the line invariants of the track: once, unless the track is a view of shared arrays.
+        Returns:
+        @invariants: tuple of floats (ox,oy,oz, ux,uy,uz, o·u, mx,my,mz): the origin, the normalized
+            versor u, origin·u and the moment m = origin×u;
+        '''
+        if self.__lineInvariants is not None:
+            return self.__lineInvariants
+        ox, oy, oz = (float(c) for c in self.__origin)
+        vx, vy, vz = (float(c) for c in self.__versor)
+        norm = m.sqrt(vx*vx + vy*vy + vz*vz)
+        ux, uy, uz = vx/norm, vy/norm, vz/norm
+        invariants = (ox, oy, oz, ux, uy, uz, ox*ux + oy*uy + oz*uz, oy*uz - oz*uy, oz*ux - ox*uz, ox*uy - oy*ux)
+        if not self.__shared:
+            self.__lineInvariants = invariants
+        return invariants
+
+    def __pointDistance(self,x,y,z):
+        '''
+        Evaluates the distance of a point from the track as |P×u - m|.
+        Parameters:
+        @x, y, z: floats, the point's coordinates;
+        Returns:
+        @distance: double;
         '''
-        self.origin = np.asarray(origin)
-        self.versor = np.asarray(versor)
-        self.IP = self.pointDistance([0,0,0])
+        _, _, _, ux, uy, uz, _, mx, my, mz = self.__invariants()
+        wx = y*uz - z*uy - mx
+        wy = z*ux - x*uz - my
+        wz = x*uy - y*ux - mz
+        return m.sqrt(wx*wx + wy*wy + wz*wz)
     
     def evaluate(self,t):
         '''
@@ -43,23 +156,15 @@ class Track:
 
     def trackDistance(self,track):
         '''
-        Evaluates the minimum distance between the current track and the input one.
+        Evaluates the minimum distance between the current track and the input one, defined as the
+        distance of the current track's origin from the input track.
         Parameters:
         @track: instance of Track, track from which evaluate the distance;
         Returns:
         @distance: double, the minimum distance between the tracks;
         '''
-        # Angle between tracks' versors 
-        alpha = np.arccos(np.clip(np.dot(self.versor, track.versor), -1.0, 1.0))
-        # Handy variable (defined in the notes)
-        DP0 = track.origin - self.origin
-        # Values of the parameters in the tracks' parametric representation 
-        # at the closest points between the two tracks
-        tstar = -(1/m.sin(alpha)**2)*(m.cos(alpha)*(np.dot(DP0,track.versor)-np.dot(DP0,track.versor)))
-        sstar = m.cos(alpha)*tstar - np.dot(DP0,track.versor)
-        # Distance between the closest points of the two tracks
-        distance = np.linalg.norm((self.evaluate(tstar)-track.evaluate(sstar)))
-        return distance
+        ox, oy, oz = self.__invariants()[:3]
+        return track.__pointDistance(ox,oy,oz)
     
     def pointDistance(self,P):
         '''
@@ -69,18 +174,8 @@ class Track:
         Returns:
         @distance: double, the minimum distance between the track and the point;
         '''
-        P = np.asarray(P)
-        # Constant of the plane containing P and orthogonal to the track
-        d = -np.sum(self.versor*P)
-        # Handy variable (defined in the notes)
-        sP0 = np.sum(self.origin*self.versor)
-        # Value of the parameter in the track's parametric representation
-        # at the point of minimum distance from P
-        tstar = -(sP0+d)
-        # Track's closest point to P
-        Pprime = self.evaluate(tstar)
-        # return distance between P and Pprime
-        return np.linalg.norm((P-Pprime))
+        x, y, z = P
+        return self.__pointDistance(float(x),float(y),float(z))
 
     def print(self):
         '''
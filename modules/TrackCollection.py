@@ -0,0 +1,413 @@
+import numpy as np
+from modules.Track import Track
+
+class TrackCollection:
+    '''
+    Class that implements an array-backed collection of tracks: the origins and the versors of N tracks
+    are stored as contiguous arrays, so that distances can be evaluated on all of the tracks at once.
+    Public Members:
+    @self.origins: np.array of shape (N,3), (x,y,z) coordinates of the tracks' origins;
+    @self.versors: np.array of shape (N,3), (x,y,z) components of the tracks' versors, normalized to unit
+        length (see unitVersors);
+    @self.tracks: list of Track instances or None, the tracks the collection has been built from;
+    @self.minDistance: lower bound on the distances used in the chi2 derivatives [mm];
+    @self.moments: np.array of shape (N,3), the moments origin×versor of the tracks (the versors are unit
+        vectors): the distance of a point P from track i is |P×versor_i - moment_i|;
+    The moments are evaluated at the first use and kept by the subsets.
+    @self.cache: JetCache instance of the jet the collection belongs to, or None (default): see cached;
+
+    Public Methods:
+    @fromTracks(tracks): returns TrackCollection, builds the collection from a list of Track instances;
+    @fromJet(jet): returns TrackCollection, the collection of all of the jet's tracks
+        (PV, SV and pileup, in this order);
+    @asCollection(tracks): returns TrackCollection, converts a Jet, a list of Track instances
+        or a TrackCollection to a TrackCollection;
+    @unitVersors(versors): returns np.array of shape (N,3), the versors normalized to unit length;
+    @lineMoments(origins,versors): returns np.array of shape (...,3), the moments origin×versor of
+        tracks given as arrays of any shape (...,3);
+    @lineImpactParameters(origins,versors,moments): returns np.array of shape (...), the impact parameters of
+        tracks given as arrays of any shape (...,3) (e.g. the padded arrays of a JetBatch);
+    @cached(name,compute): returns the quantity name from the cache, evaluating it with compute() if it is
+        not cached (or if the collection has no cache);
+    @track(i): returns Track, the i-th track of the collection;
+    @subset(indices): returns TrackCollection, the collection of the selected tracks;
+    @evaluate(t): returns np.array of shape (N,3), evaluates the parametric representation of the tracks;
+    @pointDistances(P): returns np.array of shape (N,), the minimum distances of the tracks from the point P;
+    @trackDistances(track): returns np.array of shape (N,), the distances of the input track from the tracks;
+    @distanceMatrix(): returns np.array of shape (N,N), the track-track distances of all of the pairs;
+    @pairDistances(i,j): returns np.array, the track-track distances of the pairs (i[k],j[k]);
+    @closePairs(threshold): returns the pairs of tracks closer than threshold and their distances,
+        found with a KD-tree without evaluating all of the pairs;
+    @sumDistancesGradient(P): returns np.array of shape (3,), the gradient wrt P of the sum of the
+        distances of the tracks from P;
+    @sumDistancesHessian(P): returns np.array of shape (3,3), the hessian wrt P of the sum of the
+        distances of the tracks from P;
+    @impactParameters(): returns np.array of shape (N,), the distances of the tracks from the origin;
+    @closestPoint(): returns np.array of shape (3,), the point that minimizes the sum of the squared
+        distances from the tracks;
+
+    Private Methods:
+    @__residuals(P): returns the vectors from the tracks' closest points to P and their norms;
+    @__crossMatrix(P): returns np.array of shape (3,3), the matrix K such that v@K = P×v;
+    '''
+
+    # Lower bound on the distances used in the chi2 derivatives [mm]
+    minDistance = 1e-12
+    # Tolerance on the squared norms of the versors, beyond which they are normalized
+    unitTolerance = 1e-12
+
+    # Constructor
+    def __init__(self, origins=np.empty((0,3)), versors=np.empty((0,3)), tracks=None):
+        '''
+        Constructor of the class.
+        Parameters:
+        @origins: origins of the tracks, np.array or list of shape (N,3);
+        @versors: versors of the tracks, np.array or list of shape (N,3), normalized if they are not unit vectors;
+        @tracks: optional list of the N Track instances the arrays have been built from;
+        '''
+        self.origins = np.ascontiguousarray(origins, dtype=float).reshape(-1,3)
+        self.versors = self.unitVersors(np.ascontiguousarray(versors, dtype=float).reshape(-1,3))
+        self.tracks = tracks
+        self.cache = None
+        self.__moments = None
+
+    @classmethod
+    def fromTracks(cls, tracks):
+        '''
+        Builds the collection from a list of Track instances.
+        Parameters:
+        @tracks: list of Track instances;
+        Returns:
+        @collection: instance of TrackCollection;
+        '''
+        tracks = list(tracks)
+        if len(tracks) == 0:
+            return cls(tracks=tracks)
+        origins = np.array([t.origin for t in tracks], dtype=float)
+        versors = np.array([t.versor for t in tracks], dtype=float)
+        return cls(origins, versors, tracks)
+
+    @classmethod
+    def fromJet(cls, jet):
+        '''
+        Returns the collection of all of the jet's tracks, in the order PV, SV, pileup: for a columnar
+        jet it is the collection shared by all of the jet's users (see Jet.collection).
+        Parameters:
+        @jet: instance of Jet;
+        Returns:
+        @collection: instance of TrackCollection;
+        '''
+        return jet.collection()
+
+    @classmethod
+    def asCollection(cls, tracks):
+        '''
+        Converts the input to a TrackCollection.
+        Parameters:
+        @tracks: instance of Jet, list of Track instances or instance of TrackCollection;
+        Returns:
+        @collection: instance of TrackCollection;
+        '''
+        if isinstance(tracks, TrackCollection):
+            return tracks
+        if hasattr(tracks, "tracksPV"):
+            return cls.fromJet(tracks)
+        return cls.fromTracks(tracks)
+
+    @classmethod
+    def unitVersors(cls, versors):
+        '''
+        Normalizes the versors to unit length, as Track does: the distances of the collection (and of
+        JetBatch) assume unit versors. The versors that are already unit vectors (within unitTolerance
+        on the squared norms) are returned without copies.
+        Parameters:
+        @versors: np.array of shape (N,3);
+        Returns:
+        @versors: np.array of shape (N,3), the unit versors;
+        '''
+        norms2 = np.einsum('ij,ij->i', versors, versors)
+        if np.all(np.abs(norms2-1.) <= cls.unitTolerance):
+            return versors
+        return versors/np.sqrt(norms2)[:,None]
+
+    def __len__(self):
+        return self.origins.shape[0]
+
+    @classmethod
+    def lineMoments(cls, origins, versors):
+        '''
+        Evaluates the moments origin×versor of the tracks.
+        Parameters:
+        @origins: np.array of shape (...,3), tracks' origins;
+        @versors: np.array of shape (...,3), tracks' unit versors;
+        Returns:
+        @moments: np.array of shape (...,3);
+        '''
+        O, V = origins, versors
+        return np.stack((O[...,1]*V[...,2] - O[...,2]*V[...,1], O[...,2]*V[...,0] - O[...,0]*V[...,2],
+                         O[...,0]*V[...,1] - O[...,1]*V[...,0]), axis=-1)
+
+    @classmethod
+    def lineImpactParameters(cls, origins, versors, moments=None):
+        '''
+        Evaluates the impact parameters of the tracks (distances from the origin), as the norms of
+        their moments: this is the only implementation of the impact parameters of the arrays of tracks
+        (TrackCollection, PreSelection, ClusteringSSVF features).
+        Parameters:
+        @origins: np.array of shape (...,3), tracks' origins;
+        @versors: np.array of shape (...,3), tracks' unit versors;
+        @moments: np.array of shape (...,3), the tracks' moments if already evaluated (None: evaluated here);
+        Returns:
+        @IP: np.array of shape (...), the tracks' impact parameters;
+        '''
+        M = cls.lineMoments(origins, versors) if moments is None else moments
+        return np.sqrt(np.einsum('...k,...k->...', M, M))
+
+    @property
+    def moments(self):
+        if self.__moments is None:
+            self.__moments = self.lineMoments(self.origins, self.versors)
+        return self.__moments
+
+    def cached(self, name, compute):
+        '''
+        Returns a quantity derived from the tracks, from the cache of the jet if it is enabled (see
+        Jet.enableCache). The subsets have no cache.
+        Parameters:
+        @name: name of the quantity, e.g. "distanceMatrix";
+        @compute: function without parameters that evaluates the quantity, e.g. self.distanceMatrix;
+        Returns:
+        @value: the quantity;
+        '''
+        if self.cache is None:
+            return compute()
+        return self.cache.get(name, compute)
+
+    def track(self, i):
+        '''
+        Returns the i-th track of the collection: the original instance if the collection
+        has been built from Track instances, a new Track otherwise.
+        Parameters:
+        @i: index of the track;
+        Returns:
+        @track: instance of Track;
+        '''
+        if self.tracks is not None:
+            return self.tracks[i]
+        return Track(self.origins[i], self.versors[i])
+
+    def subset(self, indices):
+        '''
+        Returns the collection of the selected tracks.
+        Parameters:
+        @indices: np.array of integer indices or boolean mask of shape (N,);
+        Returns:
+        @collection: instance of TrackCollection;
+        '''
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        tracks = None
+        if self.tracks is not None:
+            tracks = [self.tracks[i] for i in indices]
+        collection = TrackCollection(self.origins[indices], self.versors[indices], tracks)
+        if self.__moments is not None:
+            collection.__moments = self.__moments[indices]
+        return collection
+
+    def evaluate(self, t):
+        '''
+        Evaluates the parametric representation of the tracks.
+        Parameters:
+        @t: double or np.array of shape (N,), value of the parameter of each track;
+        Returns:
+        @P: np.array of shape (N,3), the tracks' points at parameter = t;
+        '''
+        t = np.asarray(t, dtype=float)
+        return self.origins + self.versors*t[...,None]
+
+    def pointDistances(self, P):
+        '''
+        Evaluates the minimum distances between the tracks and the input point.
+        Parameters:
+        @P: np.array or list of shape (3,), point from which evaluate the distances;
+        Returns:
+        @distances: np.array of shape (N,), the minimum distances between the tracks and the point;
+        '''
+        # (P-origin)×versor = P×versor - moment, whose norm is the distance
+        W = self.versors @ self.__crossMatrix(P) - self.moments
+        return np.sqrt(np.einsum('ij,ij->i', W, W))
+
+    def __crossMatrix(self, P):
+        '''
+        Builds the matrix of the cross product with P.
+        Parameters:
+        @P: np.array or list of shape (3,);
+        Returns:
+        @K: np.array of shape (3,3), such that v@K = P×v for any vector v;
+        '''
+        x, y, z = np.asarray(P, dtype=float)
+        return np.array([[0., z, -y], [-z, 0., x], [y, -x, 0.]])
+
+    def __residuals(self, P):
+        '''
+        Evaluates the vectors from the tracks' closest points to P, and their norms (clipped 
+        from below to avoid divisions by zero when P lies on a track).
+        Parameters:
+        @P: np.array or list of shape (3,);
+        Returns:
+        @R: np.array of shape (N,3), the residual vectors;
+        @distances: np.array of shape (N,), the clipped norms of the residuals;
+        '''
+        DP = np.asarray(P, dtype=float) - self.origins
+        R = DP - self.versors*np.einsum('ij,ij->i', DP, self.versors)[:,None]
+        distances = np.maximum(np.sqrt(np.einsum('ij,ij->i', R, R)), self.minDistance)
+        return R, distances
+
+    def sumDistancesGradient(self, P):
+        '''
+        Evaluates the gradient wrt P of the sum of the distances of the tracks from P:
+        each track contributes with the unit vector from its closest point to P.
+        Parameters:
+        @P: np.array or list of shape (3,);
+        Returns:
+        @gradient: np.array of shape (3,);
+        '''
+        R, distances = self.__residuals(P)
+        return np.sum(R/distances[:,None], axis=0)
+
+    def sumDistancesHessian(self, P):
+        '''
+        Evaluates the hessian wrt P of the sum of the distances of the tracks from P:
+        each track contributes with (I - v v^T - u u^T)/d, where u is the unit residual and d the distance.
+        Parameters:
+        @P: np.array or list of shape (3,);
+        Returns:
+        @hessian: np.array of shape (3,3);
+        '''
+        R, distances = self.__residuals(P)
+        U = R/distances[:,None]
+        w = 1./distances
+        return np.sum(w)*np.eye(3) - np.einsum('i,ij,ik->jk', w, self.versors, self.versors) \
+            - np.einsum('i,ij,ik->jk', w, U, U)
+
+    def trackDistances(self, track):
+        '''
+        Evaluates the distances of the input track from all of the tracks in the collection,
+        with the same definition of Track.trackDistance: entry j is track.trackDistance(self.track(j)).
+        Parameters:
+        @track: instance of Track;
+        Returns:
+        @distances: np.array of shape (N,), the distances between the track and the collection's tracks;
+        '''
+        # The closest point of the input track is its origin (t* = 0 in Track.trackDistance),
+        # so the distance reduces to the distance of that origin from each track
+        return self.pointDistances(track.origin)
+
+    def distanceMatrix(self):
+        '''
+        Evaluates the track-track distances of all of the pairs, with the same definition
+        of Track.trackDistance: entry (i,j) is self.track(i).trackDistance(self.track(j)).
+        Returns:
+        @distances: np.array of shape (N,N), the matrix of the track-track distances;
+        '''
+        # Components of origin_i×versor_j - moment_j
+        Ox, Oy, Oz = self.origins.T[:,:,None]
+        Vx, Vy, Vz = self.versors.T[:,None,:]
+        Mx, My, Mz = self.moments.T[:,None,:]
+        Wx = Oy*Vz - Oz*Vy - Mx
+        Wy = Oz*Vx - Ox*Vz - My
+        Wz = Ox*Vy - Oy*Vx - Mz
+        return np.sqrt(Wx*Wx + Wy*Wy + Wz*Wz)
+
+    def pairDistances(self, i, j):
+        '''
+        Evaluates the track-track distances of the selected pairs, with the same definition
+        of Track.trackDistance: entry k is self.track(i[k]).trackDistance(self.track(j[k])).
+        Parameters:
+        @i: np.array of shape (M,), indices of the first tracks of the pairs;
+        @j: np.array of shape (M,), indices of the second tracks of the pairs;
+        Returns:
+        @distances: np.array of shape (M,), the distances of the pairs;
+        '''
+        # Components of origin_i×versor_j - moment_j
+        Ox, Oy, Oz = self.origins[i].T
+        Vx, Vy, Vz = self.versors[j].T
+        Mx, My, Mz = self.moments[j].T
+        Wx = Oy*Vz - Oz*Vy - Mx
+        Wy = Oz*Vx - Ox*Vz - My
+        Wz = Ox*Vy - Oy*Vx - Mz
+        return np.sqrt(Wx*Wx + Wy*Wy + Wz*Wz)
+
+    def closePairs(self, threshold):
+        '''
+        Finds the pairs (i,j), i!=j, whose track-track distance (the distance of origin i from track j) is
+        below threshold, without evaluating all of the pairs. Each track j is sampled with step delta
+        inside the bounding box of the origins (enlarged by threshold): an origin closer than threshold
+        to track j is closer than sqrt(threshold^2+delta^2/4) to one of its samples, so the candidate
+        pairs are found with a KD-tree over the origins, and only their exact distances are evaluated.
+        Parameters:
+        @threshold: distance threshold [mm];
+        Returns:
+        @i: np.array of shape (M,), indices of the first tracks of the pairs;
+        @j: np.array of shape (M,), indices of the second tracks of the pairs;
+        @distances: np.array of shape (M,), the distances of the pairs;
+        the pairs are sorted by i, then by distance, then by j.
+        '''
+        N = len(self)
+        if N < 2:
+            return np.empty(0,dtype=int), np.empty(0,dtype=int), np.empty(0)
+        lo = np.min(self.origins,axis=0) - threshold
+        hi = np.max(self.origins,axis=0) + threshold
+        # sqrt(N) samples along the diagonal balance the number of samples and of candidate pairs
+        delta = max(np.linalg.norm(hi-lo)/np.sqrt(N),threshold)
+        # Parameters of the tracks at the faces of the box (slab method), the origins are inside it
+        with np.errstate(divide='ignore',invalid='ignore'):
+            t1 = (lo-self.origins)/self.versors
+            t2 = (hi-self.origins)/self.versors
+        parallel = self.versors == 0.
+        t1[parallel], t2[parallel] = -np.inf, np.inf
+        tmin = np.max(np.minimum(t1,t2),axis=1)
+        tmax = np.min(np.maximum(t1,t2),axis=1)
+        # Samples of the tracks inside the box, with step at most delta
+        nSamples = np.ceil((tmax-tmin)/delta).astype(int) + 1
+        lines = np.repeat(np.arange(N),nSamples)
+        steps = np.arange(np.sum(nSamples)) - np.repeat(np.cumsum(nSamples)-nSamples,nSamples)
+        t = tmin[lines] + steps*((tmax-tmin)/np.maximum(nSamples-1,1))[lines]
+        samples = self.origins[lines] + self.versors[lines]*t[:,None]
+        radius = np.sqrt(threshold**2 + delta**2/4.)*(1.+1e-9)
+        # scipy.spatial is imported only when the close pairs are searched
+        from scipy.spatial import cKDTree
+        neighbours = cKDTree(samples).sparse_distance_matrix(cKDTree(self.origins),radius,output_type='ndarray')
+        # Candidate pairs: (origin i, track j), without repetitions
+        keys = np.unique(neighbours['j'].astype(np.int64)*N + lines[neighbours['i']])
+        i, j = keys//N, keys%N
+        i, j = i[i!=j], j[i!=j]
+        distances = self.pairDistances(i,j)
+        close = distances < threshold
+        i, j, distances = i[close], j[close], distances[close]
+        order = np.lexsort((j,distances,i))
+        return i[order], j[order], distances[order]
+
+    def impactParameters(self):
+        '''
+        Evaluates the impact parameters of the tracks, i.e. their distances from the origin.
+        Returns:
+        @IP: np.array of shape (N,), the tracks' impact parameters;
+        '''
+        return self.lineImpactParameters(self.origins, self.versors, self.moments)
+
+    def closestPoint(self):
+        '''
+        Evaluates the point that minimizes the sum of the squared distances from the tracks,
+        solving the 3x3 linear system sum_i (I - v_i v_i^T) P = sum_i (I - v_i v_i^T) o_i.
+        Raises np.linalg.LinAlgError if the point is not defined (less than two tracks or parallel tracks).
+        Returns:
+        @P: np.array of shape (3,), the least squares closest point to the tracks;
+        '''
+        if len(self)<2:
+            raise np.linalg.LinAlgError("The closest point needs at least two tracks")
+        # sum of the projectors orthogonal to the tracks
+        A = len(self)*np.eye(3) - self.versors.T @ self.versors
+        b = np.sum(self.origins,axis=0) - self.versors.T @ np.einsum('ij,ij->i',self.origins,self.versors)
+        return np.linalg.solve(A,b)
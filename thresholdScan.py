@@ -0,0 +1,41 @@
+from modules.JetGenerator import JetGenerator
+from modules.SSVF import SSVF
+from modules.ThresholdScan import ThresholdScan
+from matplotlib import pyplot as plt
+import numpy as np
+import time
+
+if __name__=="__main__":
+
+    generator = JetGenerator(200,seed=1)
+    jets = generator.generate()
+    dThresholds = np.array([1,2,4,6,8,12,16])*0.001
+    chi2Thresholds = np.array([0.01,0.02,0.05,0.1,0.2,0.5,1.])
+
+    # Scan of the grid of thresholds
+    scan = ThresholdScan(dThresholds,chi2Thresholds,SSVF())
+    start = time.perf_counter()
+    results = scan.scan(jets)
+    scanTime = time.perf_counter()-start
+
+    # Time of a full reconstruction of the jets, to be repeated for each point of the grid without the scan
+    start = time.perf_counter()
+    for jet in jets:
+        SSVF().reconstruct(jet)
+    reconstructionTime = time.perf_counter()-start
+    nGrid = len(dThresholds)*len(chi2Thresholds)
+    print("Scan of %d points on %d jets: %.2f s, %d rejection paths (full reconstructions: ~%.2f s)"
+          % (nGrid,len(jets),scanTime,results["paths"],nGrid*reconstructionTime))
+
+    fig,ax = plt.subplots(1,2,figsize=(11,4.5))
+    plt.suptitle("SSVF thresholds scan on %d jets" % len(jets))
+    for a,name,label in ((ax[0],"efficiency","Efficiency"),(ax[1],"meanError","Mean $||SV_{real} - SV_{fit}||$ [mm]")):
+        image = a.imshow(results[name],origin="lower",aspect="auto")
+        a.set_xticks(range(len(chi2Thresholds)),[str(c) for c in chi2Thresholds])
+        a.set_yticks(range(len(dThresholds)),[str(round(d*1e3)) for d in dThresholds])
+        a.set_xlabel("$\\chi^2_{threshold}$")
+        a.set_ylabel("$d_{threshold}$ [$\\mu$m]")
+        a.set_title(label)
+        fig.colorbar(image,ax=a)
+    plt.tight_layout()
+    plt.show()